@@ -1,5 +1,24 @@
+import os
+import shutil
+import tempfile
+
 # pytest attempts to execute shell scripts while collecting
 collect_ignore_glob = [
   "opendbc/safety/tests/misra/*.sh",
   "opendbc/safety/tests/misra/cppcheck/",
 ]
+
+
+def pytest_configure(config):
+  # keep the DBC caches written by the tests out of the user's cache directory,
+  # xdist workers inherit the directory of the controller
+  if "OPENDBC_DBC_CACHE_DIR" not in os.environ:
+    config._dbc_cache_dir = tempfile.mkdtemp(prefix="opendbc_dbc_cache_")
+    os.environ["OPENDBC_DBC_CACHE_DIR"] = config._dbc_cache_dir
+
+
+def pytest_unconfigure(config):
+  cache_dir = getattr(config, "_dbc_cache_dir", None)
+  if cache_dir is not None:
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    del os.environ["OPENDBC_DBC_CACHE_DIR"]
@@ -5,6 +5,7 @@
 #include <vector>
 
 #include "opendbc/can/common.h"
+#include "opendbc/can/crc.h"
 
 void pedal_setup_signal(Signal &sig, const std::string& dbc_name, int line_num) {
   if (sig.name == "CHECKSUM_PEDAL") {
@@ -25,7 +26,7 @@ void tesla_setup_signal(Signal &sig, const std::string& dbc_name, int line_num)
   }
 }
 
-unsigned int honda_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int honda_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   int s = 0;
   bool extended = address > 0x7FF;
   while (address) { s += (address & 0xF); address >>= 4; }
@@ -40,7 +41,7 @@ unsigned int honda_checksum(uint32_t address, const Signal &sig, const std::vect
   return s & 0xF;
 }
 
-unsigned int toyota_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int toyota_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   unsigned int s = d.size();
   while (address) { s += address & 0xFF; address >>= 8; }
   for (int i = 0; i < d.size() - 1; i++) { s += d[i]; }
@@ -48,7 +49,7 @@ unsigned int toyota_checksum(uint32_t address, const Signal &sig, const std::vec
   return s & 0xFF;
 }
 
-unsigned int subaru_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int subaru_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   unsigned int s = 0;
   while (address) { s += address & 0xFF; address >>= 8; }
 
@@ -58,7 +59,7 @@ unsigned int subaru_checksum(uint32_t address, const Signal &sig, const std::vec
   return s & 0xFF;
 }
 
-unsigned int chrysler_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int chrysler_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   // jeep chrysler canbus checksum from http://illmatics.com/Remote%20Car%20Hacking.pdf
   uint8_t checksum = 0xFF;
   for (int j = 0; j < (d.size() - 1); j++) {
@@ -89,54 +90,10 @@ unsigned int chrysler_checksum(uint32_t address, const Signal &sig, const std::v
   return ~checksum & 0xFF;
 }
 
-// Static lookup table for fast computation of CRCs
-uint8_t crc8_lut_8h2f[256]; // CRC8 poly 0x2F, aka 8H2F/AUTOSAR
-uint8_t crc8_lut_j1850[256]; // CRC8 poly 0x1D, aka SAE J1850
-uint16_t crc16_lut_xmodem[256]; // CRC16 poly 0x1021, aka XMODEM
-
-void gen_crc_lookup_table_8(uint8_t poly, uint8_t crc_lut[]) {
-  uint8_t crc;
-  int i, j;
-
-   for (i = 0; i < 256; i++) {
-    crc = i;
-    for (j = 0; j < 8; j++) {
-      if ((crc & 0x80) != 0)
-        crc = (uint8_t)((crc << 1) ^ poly);
-      else
-        crc <<= 1;
-    }
-    crc_lut[i] = crc;
-  }
-}
-
-void gen_crc_lookup_table_16(uint16_t poly, uint16_t crc_lut[]) {
-  uint16_t crc;
-  int i, j;
-
-   for (i = 0; i < 256; i++) {
-    crc = i << 8;
-    for (j = 0; j < 8; j++) {
-      if ((crc & 0x8000) != 0) {
-        crc = (uint16_t)((crc << 1) ^ poly);
-      } else {
-        crc <<= 1;
-      }
-    }
-    crc_lut[i] = crc;
-  }
-}
-
-// Initializes CRC lookup tables at module initialization
-struct CrcInitializer {
-  CrcInitializer() {
-    gen_crc_lookup_table_8(0x2F, crc8_lut_8h2f);  // CRC-8 8H2F/AUTOSAR for Volkswagen
-    gen_crc_lookup_table_8(0x1D, crc8_lut_j1850);  // CRC-8 SAE-J1850
-    gen_crc_lookup_table_16(0x1021, crc16_lut_xmodem);  // CRC-16 XMODEM for HKG CAN FD
-  }
-};
-
-static CrcInitializer crcInitializer;
+static const CrcEngine<uint8_t> crc8_8h2f(0x2F);  // CRC-8 8H2F/AUTOSAR for Volkswagen
+static const CrcEngine<uint8_t> crc8_j1850(0x1D);  // CRC-8 SAE-J1850
+static const CrcEngine<uint8_t> crc8_pedal(0xD5);  // standard CRC-8 for the pedal interceptor
+static const CrcEngine<uint16_t> crc16_xmodem(0x1021);  // CRC-16 XMODEM for HKG CAN FD
 
 static const std::unordered_map<uint32_t, std::array<uint8_t, 16>> volkswagen_mqb_meb_crc_constants {
   {0x40,  {0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40, 0x40}},  // Airbag_01
@@ -177,15 +134,14 @@ static const std::unordered_map<uint32_t, std::array<uint8_t, 16>> volkswagen_mq
   {0x65D, {0xAC, 0xB3, 0xAB, 0xEB, 0x7A, 0xE1, 0x3B, 0xF7, 0x73, 0xBA, 0x7C, 0x9E, 0x06, 0x5F, 0x02, 0xD9}},  // ESP_20
 };
 
-unsigned int volkswagen_mqb_meb_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int volkswagen_mqb_meb_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   // This is AUTOSAR E2E Profile 2, CRC-8H2F with a "data ID" (varying by message/counter) appended to the payload
 
   uint8_t crc = 0xFF; // CRC-8H2F initial value
 
   // CRC over payload first, skipping the first byte where the CRC lives
-  for (int i = 1; i < d.size(); i++) {
-    crc ^= d[i];
-    crc = crc8_lut_8h2f[crc];
+  if (d.size() > 1) {
+    crc = crc8_8h2f.update(crc, d.data() + 1, d.size() - 1);
   }
 
   // Continue CRC over the "data ID"
@@ -193,8 +149,7 @@ unsigned int volkswagen_mqb_meb_checksum(uint32_t address, const Signal &sig, co
 
   auto crc_const = volkswagen_mqb_meb_crc_constants.find(address);
   if (crc_const != volkswagen_mqb_meb_crc_constants.end()) {
-    crc ^= crc_const->second[counter];
-    crc = crc8_lut_8h2f[crc];
+    crc = crc8_8h2f.update(crc, crc_const->second[counter]);
   } else {
     printf("Attempt to CRC check undefined Volkswagen message 0x%02X\n", address);
   }
@@ -202,7 +157,7 @@ unsigned int volkswagen_mqb_meb_checksum(uint32_t address, const Signal &sig, co
   return crc ^ 0xFF; // CRC-8H2F final XOR
 }
 
-unsigned int xor_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int xor_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   uint8_t checksum = 0;
   int checksum_byte = sig.start_bit / 8;
 
@@ -216,34 +171,26 @@ unsigned int xor_checksum(uint32_t address, const Signal &sig, const std::vector
   return checksum;
 }
 
-unsigned int pedal_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int pedal_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   uint8_t crc = 0xFF;
-  uint8_t poly = 0xD5; // standard crc8
 
-  // skip checksum byte
+  // skip checksum byte, the payload is processed back to front
   for (int i = d.size()-2; i >= 0; i--) {
-    crc ^= d[i];
-    for (int j = 0; j < 8; j++) {
-      if ((crc & 0x80) != 0) {
-        crc = (uint8_t)((crc << 1) ^ poly);
-      } else {
-        crc <<= 1;
-      }
-    }
+    crc = crc8_pedal.update(crc, d[i]);
   }
   return crc;
 }
 
-unsigned int hkg_can_fd_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int hkg_can_fd_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   uint16_t crc = 0;
 
-  for (int i = 2; i < d.size(); i++) {
-    crc = (crc << 8) ^ crc16_lut_xmodem[(crc >> 8) ^ d[i]];
+  if (d.size() > 2) {
+    crc = crc16_xmodem.update(crc, d.data() + 2, d.size() - 2);
   }
 
   // Add address to crc
-  crc = (crc << 8) ^ crc16_lut_xmodem[(crc >> 8) ^ ((address >> 0) & 0xFF)];
-  crc = (crc << 8) ^ crc16_lut_xmodem[(crc >> 8) ^ ((address >> 8) & 0xFF)];
+  crc = crc16_xmodem.update(crc, (address >> 0) & 0xFF);
+  crc = crc16_xmodem.update(crc, (address >> 8) & 0xFF);
 
   if (d.size() == 8) {
     crc ^= 0x5f29;
@@ -258,13 +205,12 @@ unsigned int hkg_can_fd_checksum(uint32_t address, const Signal &sig, const std:
   return crc;
 }
 
-unsigned int fca_giorgio_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int fca_giorgio_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   // CRC is in the last byte, poly is same as SAE J1850 but uses a different init value and final XOR
   uint8_t crc = 0x00;
 
-  for (int i = 0; i < d.size() - 1; i++) {
-    crc ^= d[i];
-    crc = crc8_lut_j1850[crc];
+  if (d.size() > 1) {
+    crc = crc8_j1850.update(crc, d.data(), d.size() - 1);
   }
 
   // Final XOR varies for EPS messages, all others use a common value
@@ -280,7 +226,7 @@ unsigned int fca_giorgio_checksum(uint32_t address, const Signal &sig, const std
 
 }
 
-unsigned int tesla_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d) {
+unsigned int tesla_checksum(uint32_t address, const Signal &sig, const ByteSpan &d) {
   uint8_t checksum = (address & 0xFF) + ((address >> 8) & 0xFF);
   int checksum_byte = sig.start_bit / 8;
 
@@ -1,10 +1,18 @@
 #pragma once
 
+#include <algorithm>
+#include <array>
+#include <cmath>
+#include <condition_variable>
 #include <cstring>
+#include <exception>
+#include <functional>
 #include <map>
-#include <set>
+#include <mutex>
+#include <queue>
 #include <string>
 #include <sstream>
+#include <thread>
 #include <utility>
 #include <unordered_map>
 #include <vector>
@@ -24,16 +32,16 @@
 void pedal_setup_signal(Signal &sig, const std::string& dbc_name, int line_num);
 void tesla_setup_signal(Signal &sig, const std::string& dbc_name, int line_num);
 
-unsigned int honda_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int toyota_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int subaru_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int chrysler_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int volkswagen_mqb_meb_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int xor_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int hkg_can_fd_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int fca_giorgio_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int pedal_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
-unsigned int tesla_checksum(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
+unsigned int honda_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int toyota_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int subaru_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int chrysler_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int volkswagen_mqb_meb_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int xor_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int hkg_can_fd_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int fca_giorgio_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int pedal_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
+unsigned int tesla_checksum(uint32_t address, const Signal &sig, const ByteSpan &d);
 
 #define DBC_ASSERT(condition, message)                             \
   do {                                                             \
@@ -48,10 +56,24 @@ inline bool endswith(const std::string& str, const char* suffix) {
   return str.find(suffix, str.length() - strlen(suffix)) != std::string::npos;
 }
 
+// Precompiled extraction of a signal. Signals that fit in one 64-bit window are
+// decoded with a single load, shift and mask instead of walking the bytes
+struct SignalPlan {
+  bool fast;
+  unsigned int byte_start;  // first byte of the signal
+  unsigned int byte_end;  // last byte of the signal, the frame must cover it to use the window
+  int shift_base, shift_step;  // shift for a window starting at byte w is shift_base + shift_step * w
+  uint64_t mask;
+  uint64_t sign_bit;  // 0 for unsigned signals
+  double factor, offset;
+};
+
+SignalPlan compile_signal(const Signal &sig);
+
 struct CanFrame {
   long src;
   uint32_t address;
-  std::vector<uint8_t> dat;
+  ByteSpan dat;  // points into the caller's buffer, only valid during the update
 };
 
 struct CanData {
@@ -59,6 +81,51 @@ struct CanData {
   std::vector<CanFrame> frames;
 };
 
+// Fixed-stride frame record for bulk decoding
+struct CanRecord {
+  uint64_t nanos;
+  uint32_t address;
+  uint8_t src;
+  uint8_t size;
+  uint8_t dat[64];
+};
+
+struct DecodedMessage {
+  uint32_t address;
+  std::vector<uint64_t> nanos;
+  std::vector<double> vals;  // one row of signal values per frame
+};
+
+// Health counters of a subscribed message, kept by CANParser
+struct MessageStats {
+  uint32_t address;
+  uint64_t frames;  // frames received with this address
+  uint64_t accepted;  // frames that passed all checks
+  uint64_t checksum_failures;
+  uint64_t counter_failures;  // unexpected counter values, frames are only dropped after several in a row
+  uint64_t oversize;  // frames longer than 64 bytes
+  uint64_t timeouts;  // times the message went from seen to timed out
+  uint64_t last_interval_nanos;  // time between the last two accepted frames
+};
+
+// Streaming statistics of the time between accepted frames, using Welford's algorithm
+struct MessageTiming {
+  uint64_t expected_nanos = 0;  // from the checked frequency, 0 if unchecked
+  uint64_t count = 0;  // number of intervals
+  double mean_nanos = 0;
+  double m2 = 0;  // sum of squared differences from the mean
+  uint64_t max_gap_nanos = 0;
+
+  void update(uint64_t interval) {
+    count++;
+    const double delta = interval - mean_nanos;
+    mean_nanos += delta / count;
+    m2 += delta * (interval - mean_nanos);
+    max_gap_nanos = std::max(max_gap_nanos, interval);
+  }
+  double jitter_nanos() const { return count > 1 ? std::sqrt(m2 / (count - 1)) : 0; }  // standard deviation
+};
+
 class MessageState {
 public:
   std::string name;
@@ -66,7 +133,9 @@ public:
   unsigned int size;
 
   std::vector<Signal> parse_sigs;
+  std::vector<SignalPlan> plans;
   std::vector<double> vals;
+  std::vector<double> tmp_vals;  // scratch space for parse
   std::vector<std::vector<double>> all_vals;
 
   uint64_t last_seen_nanos;
@@ -78,15 +147,71 @@ public:
   bool ignore_checksum = false;
   bool ignore_counter = false;
 
-  bool parse(uint64_t nanos, const std::vector<uint8_t> &dat);
+  // validity tracking state, maintained by CANParser
+  bool timed_out = false;
+  bool queued = false;  // has an entry in the timeout queue
+  bool updated = false;  // in the parser's updated addresses
+
+  MessageStats stats = {};
+  MessageTiming timing;
+
+  // optional ring buffer of the last decoded samples, sample i is stored in row i % history_size
+  size_t history_size = 0;
+  uint64_t history_count = 0;
+  std::vector<uint64_t> history_nanos;
+  std::vector<double> history_vals;  // history_size rows of one value per signal
+
+  void init_signals(const std::vector<Signal> &sigs);
+  void init_history(size_t capacity);
+  bool decode(const ByteSpan &dat, double *out);
+  bool parse(uint64_t nanos, const ByteSpan &dat);
   bool update_counter_generic(int64_t v, int cnt_size);
 };
 
+// Address lookup for incoming frames, built once the subscribed addresses are known. Standard
+// 11-bit IDs index a dense table, so unsubscribed frames are rejected without hashing, and the
+// rare extended 29-bit IDs are binary searched.
+template <typename T>
+class AddressTable {
+public:
+  void insert(uint32_t address, T *value) {
+    if (address < standard.size()) {
+      standard[address] = value;
+    } else {
+      auto it = std::lower_bound(extended.begin(), extended.end(), std::make_pair(address, (T*)nullptr));
+      extended.insert(it, {address, value});
+    }
+  }
+
+  T *find(uint32_t address) const {
+    if (address < standard.size()) return standard[address];
+    if (extended.empty()) return nullptr;
+    auto it = std::lower_bound(extended.begin(), extended.end(), std::make_pair(address, (T*)nullptr));
+    return (it != extended.end() && it->first == address) ? it->second : nullptr;
+  }
+
+private:
+  std::array<T*, 0x800> standard = {};
+  std::vector<std::pair<uint32_t, T*>> extended;
+};
+
 class CANParser {
 private:
   const int bus;
   const DBC *dbc = NULL;
   std::unordered_map<uint32_t, MessageState> message_states;
+  AddressTable<MessageState> dispatch;  // points into message_states
+  std::vector<uint32_t> updated_addresses;  // unique, in order of first update
+
+  // Incrementally maintained validity. Checked messages that have been seen sit in a min-heap
+  // by deadline (last seen + threshold), entries are refreshed lazily when they reach the top.
+  typedef std::pair<uint64_t, MessageState*> Deadline;
+  std::priority_queue<Deadline, std::vector<Deadline>, std::greater<Deadline>> deadlines;
+  size_t missing_cnt = 0;
+  size_t timed_out_cnt = 0;
+  size_t bad_counter_cnt = 0;
+  uint64_t last_valid_nanos = 0;
+  bool validity_dirty = false;  // time went backwards, deadlines need to be rebuilt
 
 public:
   bool can_valid = false;
@@ -96,25 +221,104 @@ public:
   uint64_t bus_timeout_threshold = 0;
   uint64_t can_invalid_cnt = CAN_INVALID_CNT;
 
+  // signals optionally limits the decoded signals of a message, its counter and checksum are always decoded
   CANParser(int abus, const std::string& dbc_name,
-            const std::vector<std::pair<uint32_t, int>> &messages);
+            const std::vector<std::pair<uint32_t, int>> &messages,
+            const std::unordered_map<uint32_t, std::vector<std::string>> &signals = {});
   CANParser(int abus, const std::string& dbc_name, bool ignore_checksum, bool ignore_counter);
-  std::set<uint32_t> update(const std::vector<CanData> &can_data);
+  CANParser(const CANParser&) = delete;
+  const std::vector<uint32_t> &update(const std::vector<CanData> &can_data);  // valid until the next update
+  const std::vector<uint32_t> &getUpdated() const { return updated_addresses; }  // result of the last update
   MessageState *getMessageState(uint32_t address) { return &message_states.at(address); }
+  std::vector<MessageStats> getStats() const;  // sorted by address
 
 protected:
-  void UpdateCans(const CanData &can, std::set<uint32_t> &updated_addresses);
+  void InitDispatch();
+  void UpdateCans(const CanData &can);
   void UpdateValid(uint64_t nanos);
+  void UpdateValidFull(uint64_t nanos);
+  void TrackState(MessageState &state, bool was_missing);
+  void SetTimedOut(MessageState &state, bool timed_out);
+  void RebuildValidity(uint64_t nanos);
+};
+
+// Updates several CANParsers at once on a small pool of worker threads. Parsers share no state, so each
+// one is updated by a single thread exactly as in a sequential update, and results are read back in order.
+class ParserPool {
+public:
+  explicit ParserPool(int threads);
+  ParserPool(const ParserPool&) = delete;
+  ~ParserPool();
+
+  // parsers[i] is updated with can_data[slots[i]]. Batches of less than min_frames frames are
+  // updated on the calling thread, where the thread handoff would cost more than it saves.
+  void update(const std::vector<CANParser*> &parsers, const std::vector<std::vector<CanData>> &can_data,
+              const std::vector<int> &slots, size_t min_frames);
+
+private:
+  void run();
+  void work(std::unique_lock<std::mutex> &lk);
+
+  std::vector<std::thread> workers;
+  std::mutex lock;
+  std::condition_variable work_cv;
+  std::condition_variable done_cv;
+  const std::vector<CANParser*> *task_parsers = nullptr;
+  const std::vector<std::vector<CanData>> *task_data = nullptr;
+  const std::vector<int> *task_slots = nullptr;
+  std::vector<std::exception_ptr> errors;
+  size_t task_count = 0;
+  size_t next_task = 0;
+  size_t pending = 0;
+  uint64_t generation = 0;
+  bool stopping = false;
+};
+
+// Fill can_data with frames read in place from packed buffers, the buffer must outlive the update.
+// Consecutive records with the same nanos are one frame set.
+void records_to_can_data(const CanRecord *records, size_t count, std::vector<CanData> &can_data);
+// Panda USB packets (CANPacket_t in opendbc/safety/board/can_declarations.h), all received at nanos.
+// Returns the number of bytes in whole packets with a valid checksum, parsing stops at the first other one.
+size_t panda_to_can_data(uint64_t nanos, const uint8_t *dat, size_t size, std::vector<CanData> &can_data);
+
+std::vector<DecodedMessage> decode_log(const std::string& dbc_name, const CanRecord *records, size_t count, int bus,
+                                       const std::vector<uint32_t> &addresses, bool ignore_checksum, bool ignore_counter);
+
+struct MessagePackInfo {
+  const Msg *msg;
+  const Signal *counter;  // points into signal_lookup, nullptr if the message has none
+  const Signal *checksum;
+};
+
+// Several messages packed in one call. The values of message i are values[value_ends[i - 1]:value_ends[i]],
+// and its data is written to dat[dat_ends[i - 1]:dat_ends[i]]. Buffers are reused between calls.
+struct PackBatch {
+  std::vector<uint32_t> addresses;
+  std::vector<SignalPackValue> values;
+  std::vector<size_t> value_ends;
+  std::vector<uint8_t> dat;
+  std::vector<size_t> dat_ends;
 };
 
 class CANPacker {
 private:
   const DBC *dbc = NULL;
   std::unordered_map<uint32_t, std::unordered_map<std::string, Signal>> signal_lookup;
+  std::unordered_map<uint32_t, MessagePackInfo> message_info;
   std::map<uint32_t, uint32_t> counters;
+  std::vector<uint8_t> batch_msg;
+
+  void pack_into(uint32_t address, const SignalPackValue *signals, size_t count, std::vector<uint8_t> &ret);
+  void set_signal(std::vector<uint8_t> &msg, uint32_t address, const Signal &sig, double value, bool &counter_set);
+  void finish(std::vector<uint8_t> &msg, uint32_t address, const MessagePackInfo &info, bool counter_set);
 
 public:
   CANPacker(const std::string& dbc_name);
+  CANPacker(const CANPacker&) = delete;
   std::vector<uint8_t> pack(uint32_t address, const std::vector<SignalPackValue> &values);
+  void pack(PackBatch &batch);
+  // pack with signals resolved beforehand by lookup_signal, one value per signal
+  std::vector<uint8_t> pack(uint32_t address, const std::vector<const Signal*> &signals, const std::vector<double> &values);
+  const Signal* lookup_signal(uint32_t address, const std::string &name);
   const Msg* lookup_message(uint32_t address);
 };
@@ -1,18 +1,22 @@
 # distutils: language = c++
 # cython: language_level=3
 
-from libc.stdint cimport uint8_t, uint32_t, uint64_t
+from libc.stdint cimport uint8_t, uint32_t, int64_t, uint64_t
 from libcpp cimport bool
+from libcpp.map cimport map
 from libcpp.pair cimport pair
-from libcpp.set cimport set
 from libcpp.string cimport string
 from libcpp.vector cimport vector
 from libcpp.unordered_map cimport unordered_map
 
 
-ctypedef unsigned int (*calc_checksum_type)(uint32_t, const Signal&, const vector[uint8_t] &)
+ctypedef unsigned int (*calc_checksum_type)(uint32_t, const Signal&, const ByteSpan &)
 
 cdef extern from "common_dbc.h":
+  cdef cppclass ByteSpan:
+    ByteSpan()
+    ByteSpan(const uint8_t*, size_t)
+
   ctypedef enum SignalType:
     DEFAULT,
     COUNTER,
@@ -45,7 +49,7 @@ cdef extern from "common_dbc.h":
   cdef struct Val:
     string name
     uint32_t address
-    string def_val
+    vector[pair[int64_t, string]] defs
     vector[Signal] sigs
 
   cdef struct DBC:
@@ -62,29 +66,81 @@ cdef extern from "common_dbc.h":
 
 cdef extern from "common.h":
   cdef const DBC* dbc_lookup(const string) except +
+  cdef map[string, uint64_t] log_suppressed_counts() nogil
+
+  cdef cppclass MessageTiming:
+    uint64_t expected_nanos
+    double mean_nanos
+    uint64_t max_gap_nanos
+    double jitter_nanos()
 
   cdef cppclass MessageState:
+    string name
     vector[Signal] parse_sigs
     vector[double] vals
     vector[vector[double]] all_vals
     uint64_t last_seen_nanos
+    MessageTiming timing
+    size_t history_size
+    uint64_t history_count
+    vector[uint64_t] history_nanos
+    vector[double] history_vals
+    void init_history(size_t)
 
   cdef struct CanFrame:
     long src
     uint32_t address
-    vector[uint8_t] dat
+    ByteSpan dat
 
   cdef struct CanData:
     uint64_t nanos
     vector[CanFrame] frames
 
+  cdef struct CanRecord:
+    uint64_t nanos
+    uint32_t address
+    uint8_t src
+    uint8_t size
+    uint8_t dat[64]
+
+  cdef struct MessageStats:
+    uint32_t address
+
+  cdef struct DecodedMessage:
+    uint32_t address
+    vector[uint64_t] nanos
+    vector[double] vals
+
   cdef cppclass CANParser:
     bool can_valid
     bool bus_timeout
     CANParser(int, string, vector[pair[uint32_t, int]]) except + nogil
-    set[uint32_t] update(vector[CanData]&) except + nogil
+    CANParser(int, string, vector[pair[uint32_t, int]], unordered_map[uint32_t, vector[string]]) except + nogil
+    vector[uint32_t] update(vector[CanData]&) except + nogil
+    const vector[uint32_t]& getUpdated() nogil
     MessageState *getMessageState(uint32_t address) nogil
+    vector[MessageStats] getStats() nogil
+
+  cdef cppclass ParserPool:
+    ParserPool(int) except + nogil
+    void update(vector[CANParser*]&, vector[vector[CanData]]&, vector[int]&, size_t) except + nogil
+
+  void records_to_can_data(const CanRecord *, size_t, vector[CanData]&) nogil
+  size_t panda_to_can_data(uint64_t, const uint8_t *, size_t, vector[CanData]&) nogil
+
+  vector[DecodedMessage] decode_log(string, const CanRecord *, size_t, int,
+                                    vector[uint32_t]&, bool, bool) except + nogil
+
+  cdef cppclass PackBatch:
+    vector[uint32_t] addresses
+    vector[SignalPackValue] values
+    vector[size_t] value_ends
+    vector[uint8_t] dat
+    vector[size_t] dat_ends
 
   cdef cppclass CANPacker:
    CANPacker(string) nogil
    vector[uint8_t] pack(uint32_t, vector[SignalPackValue]&) nogil
+   void pack(PackBatch&) nogil
+   vector[uint8_t] pack(uint32_t, vector[const Signal*]&, vector[double]&) nogil
+   const Signal* lookup_signal(uint32_t, string) nogil
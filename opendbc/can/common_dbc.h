@@ -3,8 +3,25 @@
 #include <cstdint>
 #include <string>
 #include <unordered_map>
+#include <utility>
 #include <vector>
 
+// Non-owning view of a frame payload, so frames can be parsed straight from the caller's buffers
+class ByteSpan {
+public:
+  ByteSpan() = default;
+  ByteSpan(const uint8_t *data, size_t size) : ptr(data), len(size) {}
+  ByteSpan(const std::vector<uint8_t> &v) : ptr(v.data()), len(v.size()) {}
+
+  const uint8_t *data() const { return ptr; }
+  size_t size() const { return len; }
+  uint8_t operator[](size_t i) const { return ptr[i]; }
+
+private:
+  const uint8_t *ptr = nullptr;
+  size_t len = 0;
+};
+
 struct SignalPackValue {
   std::string name;
   double value;
@@ -32,7 +49,7 @@ struct Signal {
   double factor, offset;
   bool is_little_endian;
   SignalType type;
-  unsigned int (*calc_checksum)(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
+  unsigned int (*calc_checksum)(uint32_t address, const Signal &sig, const ByteSpan &d);
 };
 
 struct Msg {
@@ -45,7 +62,7 @@ struct Msg {
 struct Val {
   std::string name;
   uint32_t address;
-  std::string def_val;
+  std::vector<std::pair<int64_t, std::string>> defs;  // value, definition
   std::vector<Signal> sigs;
 };
 
@@ -64,11 +81,16 @@ typedef struct ChecksumState {
   int counter_start_bit;
   bool little_endian;
   SignalType checksum_type;
-  unsigned int (*calc_checksum)(uint32_t address, const Signal &sig, const std::vector<uint8_t> &d);
+  unsigned int (*calc_checksum)(uint32_t address, const Signal &sig, const ByteSpan &d);
   void (*setup_signal)(Signal &sig, const std::string& dbc_name, int line_num);
 } ChecksumState;
 
 DBC* dbc_parse(const std::string& dbc_path);
+DBC* dbc_cache_load(const std::string &cache_path, const std::string &dbc_name, uint64_t hash);
+bool dbc_cache_save(const std::string &cache_path, const DBC &dbc, uint64_t hash);
+uint64_t dbc_content_hash(const std::string &content);
+bool dbc_cache_enabled();
+std::string dbc_cache_path(const std::string &dbc_path);
 DBC* dbc_parse_from_stream(const std::string &dbc_name, std::istream &stream, ChecksumState *checksum = nullptr, bool allow_duplicate_msg_name=false);
 const DBC* dbc_lookup(const std::string& dbc_name);
 std::vector<std::string> get_dbc_names();
@@ -0,0 +1,65 @@
+#pragma once
+
+#include <array>
+#include <cstddef>
+#include <cstdint>
+
+// Table driven engine for MSB-first (non-reflected) 8 and 16 bit CRCs. tables[k][x] holds the CRC
+// of byte x followed by k zero bytes, so update() can fold N bytes per step with independent lookups
+// (slicing-by-N), instead of a chain of lookups where each one waits for the previous byte.
+// Results are raw register values, initial value and final XOR are up to the caller.
+template <typename T>
+class CrcEngine {
+public:
+  static constexpr int WIDTH = sizeof(T) * 8;
+
+  explicit CrcEngine(T poly) {
+    for (int i = 0; i < 256; i++) {
+      T crc = (T)(i << (WIDTH - 8));
+      for (int j = 0; j < 8; j++) {
+        crc = ((crc >> (WIDTH - 1)) & 1) ? (T)((crc << 1) ^ poly) : (T)(crc << 1);
+      }
+      tables[0][i] = crc;
+    }
+    for (size_t k = 1; k < tables.size(); k++) {
+      for (int i = 0; i < 256; i++) {
+        tables[k][i] = update(tables[k - 1][i], 0);
+      }
+    }
+  }
+
+  T update(T crc, uint8_t byte) const {
+    return (T)(crc << 8) ^ tables[0][(uint8_t)(crc >> (WIDTH - 8)) ^ byte];
+  }
+
+  // slicing-by-N for N = 1, 4 or 8, all variants give the same result. Slicing-by-8 finishes the
+  // remainder with slicing-by-4, which is faster for the short payloads of classic CAN frames.
+  template <int N = 8>
+  T update(T crc, const uint8_t *dat, size_t len) const {
+    static_assert(N == 1 || N == 4 || N == 8, "unsupported slice size");
+    if (N > 1) {
+      for (; len >= N; dat += N, len -= N) {
+        T next = 0;
+        for (int i = 0; i < N; i++) {
+          // the current CRC is folded into the first bytes of the slice
+          uint8_t b = dat[i];
+          if (i < (int)sizeof(T)) {
+            b ^= (uint8_t)(crc >> (WIDTH - 8 * (i + 1)));
+          }
+          next ^= tables[N - 1 - i][b];
+        }
+        crc = next;
+      }
+      if (N == 8) {
+        return update<4>(crc, dat, len);
+      }
+    }
+    for (size_t i = 0; i < len; i++) {
+      crc = update(crc, dat[i]);
+    }
+    return crc;
+  }
+
+private:
+  std::array<std::array<T, 256>, 8> tables;
+};
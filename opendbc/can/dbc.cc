@@ -3,25 +3,19 @@
 #include <fstream>
 #include <map>
 #include <memory>
-#include <regex>
 #include <set>
 #include <sstream>
 #include <string>
+#include <string_view>
 #include <vector>
 #include <mutex>
-#include <iterator>
+#include <cstdlib>
 #include <cstring>
 #include <clocale>
 
 #include "opendbc/can/common.h"
 #include "opendbc/can/common_dbc.h"
 
-std::regex bo_regexp(R"(^BO_ (\w+) (\w+) *: (\w+) (\w+))");
-std::regex sg_regexp(R"(^SG_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*))");
-std::regex sgm_regexp(R"(^SG_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*))");
-std::regex val_regexp(R"(VAL_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*))");
-std::regex val_split_regexp{R"([\"]+)"};  // split on "
-
 inline bool startswith(const std::string& str, const char* prefix) {
   return str.find(prefix, 0) == 0;
 }
@@ -33,6 +27,120 @@ inline bool startswith(const std::string& str, std::initializer_list<const char*
   return false;
 }
 
+inline bool is_word(char c) {
+  return (c >= 'a' && c <= 'z') || (c >= 'A' && c <= 'Z') || (c >= '0' && c <= '9') || c == '_';
+}
+inline bool is_digit(char c) { return c >= '0' && c <= '9'; }
+inline bool is_number(char c) { return is_digit(c) || c == '.' || c == '+' || c == '-' || c == 'e' || c == 'E'; }
+inline bool is_space(char c) { return c == ' ' || c == '\t' || c == '\n' || c == '\v' || c == '\f' || c == '\r'; }
+
+// Cursor over a DBC line. Each method matches like the regex fragment in its comment,
+// and only advances on success, so matchers can be chained with &&.
+class LineTokenizer {
+public:
+  std::string_view line;
+  size_t pos;
+
+  LineTokenizer(std::string_view s, size_t start = 0) : line(s), pos(start) {}
+
+  bool done() const { return pos == line.size(); }
+
+  bool literal(std::string_view s) {
+    if (line.compare(pos, s.size(), s) != 0) return false;
+    pos += s.size();
+    return true;
+  }
+
+  // [chars]
+  bool one_of(std::string_view chars, std::string_view &out) {
+    if (pos == line.size() || chars.find(line[pos]) == std::string_view::npos) return false;
+    out = line.substr(pos++, 1);
+    return true;
+  }
+
+  // pred+
+  template <typename Pred>
+  bool token(Pred pred, std::string_view &out) {
+    size_t end = pos;
+    while (end < line.size() && pred(line[end])) end++;
+    if (end == pos) return false;
+    out = line.substr(pos, end - pos);
+    pos = end;
+    return true;
+  }
+
+  // pred*
+  template <typename Pred>
+  bool skip(Pred pred) {
+    while (pos < line.size() && pred(line[pos])) pos++;
+    return true;
+  }
+
+  // (.*)<s>, where . doesn't match line terminators
+  bool find(std::string_view s) {
+    size_t end = line.find(s, pos);
+    if (end == std::string_view::npos || line.substr(pos, end - pos).find_first_of("\r\n") != std::string_view::npos) return false;
+    pos = end + s.size();
+    return true;
+  }
+};
+
+// ^BO_ (\w+) (\w+) *: (\w+) (\w+)$
+static bool match_bo(std::string_view line, std::string_view &address, std::string_view &name, std::string_view &size) {
+  LineTokenizer t(line);
+  std::string_view transmitter;
+  return t.literal("BO_ ") && t.token(is_word, address) && t.literal(" ") && t.token(is_word, name) &&
+         t.skip([](char c) { return c == ' '; }) && t.literal(": ") && t.token(is_word, size) && t.literal(" ") &&
+         t.token(is_word, transmitter) && t.done();
+}
+
+struct SignalTokens {
+  std::string_view name, start_bit, size, endianness, sign, factor, offset;
+};
+
+// ^SG_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)
+// multiplexed signals have a multiplexer indicator after the name: ^SG_ (\w+) (\w+) *: ...
+static bool match_sg(std::string_view line, bool multiplexed, SignalTokens &sg) {
+  LineTokenizer t(line);
+  std::string_view multiplexer, min, max;
+  bool ret = t.literal("SG_ ") && t.token(is_word, sg.name) && t.literal(" ");
+  if (multiplexed) {
+    ret = ret && t.token(is_word, multiplexer) && t.skip([](char c) { return c == ' '; });
+  }
+  return ret && t.literal(": ") && t.token(is_digit, sg.start_bit) && t.literal("|") && t.token(is_digit, sg.size) &&
+         t.literal("@") && t.token(is_digit, sg.endianness) && t.one_of("+|-", sg.sign) &&
+         t.literal(" (") && t.token(is_number, sg.factor) && t.literal(",") && t.token(is_number, sg.offset) &&
+         t.literal(") [") && t.token(is_number, min) && t.literal("|") && t.token(is_number, max) &&
+         t.literal("] \"") && t.find("\" ");
+}
+
+// VAL_ (\w+) (\w+) (\s*[-+]?[0-9]+\s+\".+?\"[^;]*), searched anywhere in the line
+static bool match_val(std::string_view line, std::string_view &address, std::string_view &name, std::string_view &defvals) {
+  for (size_t start = line.find("VAL_ "); start != std::string_view::npos; start = line.find("VAL_ ", start + 1)) {
+    LineTokenizer t(line, start);
+    std::string_view value, space, sign;
+    if (!(t.literal("VAL_ ") && t.token(is_word, address) && t.literal(" ") && t.token(is_word, name) && t.literal(" "))) {
+      continue;
+    }
+    size_t defvals_start = t.pos;
+    t.skip(is_space);
+    t.one_of("-+", sign);
+    if (!(t.token(is_digit, value) && t.token(is_space, space) && t.literal("\""))) {
+      continue;
+    }
+    // lazy .+? needs at least one character before the closing quote
+    size_t end = t.pos + 1;
+    while (end < line.size() && line[end] != '"' && line[end] != '\r' && line[end] != '\n') end++;
+    if (t.pos >= line.size() || line[t.pos] == '\r' || line[t.pos] == '\n' || end >= line.size() || line[end] != '"') {
+      continue;
+    }
+    end = std::min(line.find(';', end + 1), line.size());
+    defvals = line.substr(defvals_start, end - defvals_start);
+    return true;
+  }
+  return false;
+}
+
 inline std::string& trim(std::string& s, const char* t = " \t\n\r\f\v") {
   s.erase(s.find_last_not_of(t) + 1);
   return s.erase(0, s.find_first_not_of(t));
@@ -114,20 +222,20 @@ DBC* dbc_parse_from_stream(const std::string &dbc_name, std::istream &stream, Ch
 
   std::string line;
   int line_num = 0;
-  std::smatch match;
-  // TODO: see if we can speed up the regex statements in this loop, SG_ is specifically the slowest
+  std::string_view tokens[3];
+  SignalTokens sg_tokens;
   while (std::getline(stream, line)) {
     line = trim(line);
     line_num += 1;
     if (startswith(line, "BO_ ")) {
       // new group
-      bool ret = std::regex_match(line, match, bo_regexp);
+      bool ret = match_bo(line, tokens[0], tokens[1], tokens[2]);
       DBC_ASSERT(ret, "bad BO: " << line);
 
       Msg& msg = dbc->msgs.emplace_back();
-      address = msg.address = std::stoul(match[1].str());  // could be hex
-      msg.name = match[2].str();
-      msg.size = std::stoul(match[3].str());
+      address = msg.address = std::stoul(std::string(tokens[0]));  // could be hex
+      msg.name = tokens[1];
+      msg.size = std::stoul(std::string(tokens[2]));
 
       // check for duplicates
       DBC_ASSERT(address_set.find(address) == address_set.end(), "Duplicate message address: " << address << " (" << msg.name << ")");
@@ -139,27 +247,25 @@ DBC* dbc_parse_from_stream(const std::string &dbc_name, std::istream &stream, Ch
       }
     } else if (startswith(line, "SG_ ")) {
       // new signal
-      int offset = 0;
-      if (!std::regex_search(line, match, sg_regexp)) {
-        bool ret = std::regex_search(line, match, sgm_regexp);
-        DBC_ASSERT(ret, "bad SG: " << line);
-        offset = 1;
-      }
+      bool ret = match_sg(line, false, sg_tokens) || match_sg(line, true, sg_tokens);
+      DBC_ASSERT(ret, "bad SG: " << line);
+
       Signal& sig = signals[address].emplace_back();
-      sig.name = match[1].str();
-      sig.start_bit = std::stoi(match[offset + 2].str());
-      sig.size = std::stoi(match[offset + 3].str());
-      sig.is_little_endian = std::stoi(match[offset + 4].str()) == 1;
-      sig.is_signed = match[offset + 5].str() == "-";
-      sig.factor = std::stod(match[offset + 6].str());
-      sig.offset = std::stod(match[offset + 7].str());
+      sig.name = sg_tokens.name;
+      sig.start_bit = std::stoi(std::string(sg_tokens.start_bit));
+      sig.size = std::stoi(std::string(sg_tokens.size));
+      sig.is_little_endian = std::stoi(std::string(sg_tokens.endianness)) == 1;
+      sig.is_signed = sg_tokens.sign == "-";
+      sig.factor = std::stod(std::string(sg_tokens.factor));
+      sig.offset = std::stod(std::string(sg_tokens.offset));
       set_signal_type(sig, checksum, dbc_name, line_num);
       if (sig.is_little_endian) {
         sig.lsb = sig.start_bit;
         sig.msb = sig.start_bit + sig.size - 1;
       } else {
         auto it = find(be_bits.begin(), be_bits.end(), sig.start_bit);
-        sig.lsb = be_bits[(it - be_bits.begin()) + sig.size - 1];
+        size_t lsb_index = (it - be_bits.begin()) + sig.size - 1;
+        sig.lsb = lsb_index < be_bits.size() ? be_bits[lsb_index] : 64 * 8;  // out of bounds, caught below
         sig.msb = sig.start_bit;
       }
       DBC_ASSERT(sig.lsb < (64 * 8) && sig.msb < (64 * 8), "Signal out of bounds: " << line);
@@ -169,27 +275,47 @@ DBC* dbc_parse_from_stream(const std::string &dbc_name, std::istream &stream, Ch
       signal_name_sets[address].insert(sig.name);
     } else if (startswith(line, "VAL_ ")) {
       // new signal value/definition
-      bool ret = std::regex_search(line, match, val_regexp);
+      bool ret = match_val(line, tokens[0], tokens[1], tokens[2]);
       DBC_ASSERT(ret, "bad VAL: " << line);
 
       auto& val = dbc->vals.emplace_back();
-      val.address = std::stoul(match[1].str());  // could be hex
-      val.name = match[2].str();
+      val.address = std::stoul(std::string(tokens[0]));  // could be hex
+      val.name = tokens[1];
 
-      auto defvals = match[3].str();
-      std::sregex_token_iterator it{defvals.begin(), defvals.end(), val_split_regexp, -1};
+      // split on runs of quotes, a trailing empty part is dropped
+      std::vector<std::string> words;
+      std::string_view defvals = tokens[2];
+      for (size_t i = 0; i != std::string_view::npos;) {
+        size_t quote = defvals.find('"', i);
+        if (quote != std::string_view::npos || i < defvals.size()) {
+          words.emplace_back(defvals.substr(i, quote - i));
+        }
+        i = quote == std::string_view::npos ? quote : defvals.find_first_not_of('"', quote);
+      }
       // convert strings to UPPER_CASE_WITH_UNDERSCORES
-      std::vector<std::string> words{it, {}};
       for (auto& w : words) {
         w = trim(w);
         std::transform(w.begin(), w.end(), w.begin(), ::toupper);
         std::replace(w.begin(), w.end(), ' ', '_');
       }
-      // join string
-      std::stringstream s;
-      std::copy(words.begin(), words.end(), std::ostream_iterator<std::string>(s, " "));
-      val.def_val = s.str();
-      val.def_val = trim(val.def_val);
+      // split into value/definition pairs on whitespace, an unpaired last token is dropped
+      std::vector<std::string_view> parts;
+      for (const auto& w : words) {
+        std::string_view rest = w;
+        for (size_t i = 0; i < rest.size();) {
+          size_t end = i;
+          while (end < rest.size() && !is_space(rest[end])) end++;
+          if (end > i) parts.push_back(rest.substr(i, end - i));
+          i = end + 1;
+        }
+      }
+      for (size_t i = 0; i + 1 < parts.size(); i += 2) {
+        const std::string value(parts[i]);
+        char *end = nullptr;
+        long long v = std::strtoll(value.c_str(), &end, 10);
+        DBC_ASSERT(*end == '\0', "bad VAL value: " << line);
+        val.defs.emplace_back(v, parts[i + 1]);
+      }
     }
   }
 
@@ -209,9 +335,25 @@ DBC* dbc_parse(const std::string& dbc_path) {
   if (!infile) return nullptr;
 
   const std::string dbc_name = std::filesystem::path(dbc_path).filename();
+  const std::string content{std::istreambuf_iterator<char>(infile), std::istreambuf_iterator<char>()};
 
+  // load the compiled DBC if it's up to date, otherwise parse and compile it
+  const std::string cache_path = dbc_cache_enabled() ? dbc_cache_path(dbc_path) : "";
+  const bool use_cache = !cache_path.empty();
+  const uint64_t hash = dbc_content_hash(content);
+  if (use_cache) {
+    DBC *dbc = dbc_cache_load(cache_path, dbc_name, hash);
+    if (dbc != nullptr) return dbc;
+  }
+
+  std::istringstream stream(content);
   std::unique_ptr<ChecksumState> checksum(get_checksum(dbc_name));
-  return dbc_parse_from_stream(dbc_name, infile, checksum.get());
+  DBC *dbc = dbc_parse_from_stream(dbc_name, stream, checksum.get());
+  if (use_cache) {
+    // failing to write is fine, e.g. for read-only installs
+    dbc_cache_save(cache_path, *dbc, hash);
+  }
+  return dbc;
 }
 
 const std::string get_dbc_root_path() {
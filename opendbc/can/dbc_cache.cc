@@ -0,0 +1,274 @@
+#include <dlfcn.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <filesystem>
+#include <string>
+#include <vector>
+
+#include "opendbc/can/common.h"
+#include "opendbc/can/common_dbc.h"
+
+// Binary cache of parsed DBCs, stored in a per-user cache directory. The header holds the
+// hash of the DBC text and the identity of this library, so a cache is only used when it was
+// built from the same file by the same parser, checksum setup and signal type enum.
+static const uint32_t DBC_CACHE_MAGIC = 0x43434244;  // "DBCC", also rejects caches with another byte order
+static const uint32_t DBC_CACHE_VERSION = 3;
+
+uint64_t dbc_content_hash(const std::string &content) {
+  // FNV-1a
+  uint64_t hash = 0xcbf29ce484222325ULL;
+  for (unsigned char c : content) {
+    hash ^= c;
+    hash *= 0x100000001b3ULL;
+  }
+  return hash;
+}
+
+// Identity of the library file this code was loaded from, 0 if unknown. Any rebuild changes it,
+// which invalidates caches written by an older parser.
+static uint64_t library_id() {
+  static const uint64_t id = []() -> uint64_t {
+    Dl_info info;
+    struct stat st;
+    if (dladdr((void *)&library_id, &info) == 0 || info.dli_fname == nullptr || stat(info.dli_fname, &st) != 0) return 0;
+
+    const uint64_t fields[] = {(uint64_t)st.st_size, (uint64_t)st.st_mtime, (uint64_t)st.st_ino};
+    return dbc_content_hash(std::string((const char *)fields, sizeof(fields)));
+  }();
+  return id;
+}
+
+bool dbc_cache_enabled() {
+  const char *env = std::getenv("OPENDBC_DBC_CACHE");
+  return (env == nullptr || strcmp(env, "0") != 0) && library_id() != 0;
+}
+
+// $OPENDBC_DBC_CACHE_DIR, $XDG_CACHE_HOME/opendbc or ~/.cache/opendbc, with the cache file named by
+// the hash of the absolute DBC path. Empty if there's no cache directory.
+std::string dbc_cache_path(const std::string &dbc_path) {
+  std::filesystem::path dir;
+  if (const char *env = std::getenv("OPENDBC_DBC_CACHE_DIR"); env != nullptr && env[0] != '\0') {
+    dir = env;
+  } else if (const char *xdg = std::getenv("XDG_CACHE_HOME"); xdg != nullptr && xdg[0] != '\0') {
+    dir = std::filesystem::path(xdg) / "opendbc";
+  } else if (const char *home = std::getenv("HOME"); home != nullptr && home[0] != '\0') {
+    dir = std::filesystem::path(home) / ".cache" / "opendbc";
+  } else {
+    return {};
+  }
+
+  std::error_code ec;
+  std::filesystem::create_directories(dir, ec);
+  const std::filesystem::path path = std::filesystem::absolute(dbc_path, ec);
+  if (ec) return {};
+
+  char hash[17];
+  snprintf(hash, sizeof(hash), "%016llx", (unsigned long long)dbc_content_hash(path.string()));
+  return (dir / (path.filename().string() + "." + hash + ".cache")).string();
+}
+
+typedef unsigned int (*ChecksumFunc)(uint32_t, const Signal&, const ByteSpan&);
+
+static ChecksumFunc checksum_function(SignalType type) {
+  switch (type) {
+    case HONDA_CHECKSUM: return &honda_checksum;
+    case TOYOTA_CHECKSUM: return &toyota_checksum;
+    case PEDAL_CHECKSUM: return &pedal_checksum;
+    case VOLKSWAGEN_MQB_MEB_CHECKSUM: return &volkswagen_mqb_meb_checksum;
+    case XOR_CHECKSUM: return &xor_checksum;
+    case SUBARU_CHECKSUM: return &subaru_checksum;
+    case CHRYSLER_CHECKSUM: return &chrysler_checksum;
+    case HKG_CAN_FD_CHECKSUM: return &hkg_can_fd_checksum;
+    case FCA_GIORGIO_CHECKSUM: return &fca_giorgio_checksum;
+    case TESLA_CHECKSUM: return &tesla_checksum;
+    default: return nullptr;
+  }
+}
+
+class CacheWriter {
+public:
+  std::string buf;
+
+  template <typename T>
+  void write(T v) { buf.append((const char *)&v, sizeof(v)); }
+
+  void write(const std::string &s) {
+    write<uint32_t>(s.size());
+    buf.append(s);
+  }
+
+  void write(const std::vector<Signal> &sigs) {
+    write<uint32_t>(sigs.size());
+    for (const auto &sig : sigs) {
+      write(sig.name);
+      write<int32_t>(sig.start_bit);
+      write<int32_t>(sig.msb);
+      write<int32_t>(sig.lsb);
+      write<int32_t>(sig.size);
+      write<uint8_t>(sig.is_signed);
+      write<double>(sig.factor);
+      write<double>(sig.offset);
+      write<uint8_t>(sig.is_little_endian);
+      write<int32_t>(sig.type);
+      write<uint8_t>(sig.calc_checksum != nullptr);
+    }
+  }
+};
+
+class CacheReader {
+public:
+  const char *pos, *end;
+  bool ok = true;
+
+  CacheReader(const char *data, size_t size) : pos(data), end(data + size) {}
+
+  template <typename T>
+  T read() {
+    T v = {};
+    if (end - pos < (ptrdiff_t)sizeof(T)) {
+      ok = false;
+      return v;
+    }
+    memcpy(&v, pos, sizeof(T));
+    pos += sizeof(T);
+    return v;
+  }
+
+  std::string read_string() {
+    uint32_t size = read<uint32_t>();
+    if (!ok || end - pos < (ptrdiff_t)size) {
+      ok = false;
+      return {};
+    }
+    std::string s(pos, size);
+    pos += size;
+    return s;
+  }
+
+  std::vector<Signal> read_signals() {
+    std::vector<Signal> sigs(read<uint32_t>());
+    for (size_t i = 0; ok && i < sigs.size(); i++) {
+      Signal &sig = sigs[i];
+      sig.name = read_string();
+      sig.start_bit = read<int32_t>();
+      sig.msb = read<int32_t>();
+      sig.lsb = read<int32_t>();
+      sig.size = read<int32_t>();
+      sig.is_signed = read<uint8_t>();
+      sig.factor = read<double>();
+      sig.offset = read<double>();
+      sig.is_little_endian = read<uint8_t>();
+      const int32_t type = read<int32_t>();
+      ok = ok && type >= DEFAULT && type <= TESLA_CHECKSUM;  // the last SignalType
+      sig.type = ok ? (SignalType)type : DEFAULT;
+      sig.calc_checksum = read<uint8_t>() ? checksum_function(sig.type) : nullptr;
+    }
+    return sigs;
+  }
+};
+
+DBC* dbc_cache_load(const std::string &cache_path, const std::string &dbc_name, uint64_t hash) {
+  int fd = open(cache_path.c_str(), O_RDONLY);
+  if (fd < 0) return nullptr;
+
+  struct stat st;
+  void *data = MAP_FAILED;
+  if (fstat(fd, &st) == 0 && st.st_size > 0) {
+    data = mmap(nullptr, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+  }
+  close(fd);
+  if (data == MAP_FAILED) return nullptr;
+
+  CacheReader reader((const char *)data, st.st_size);
+  DBC *dbc = nullptr;
+
+  bool valid = reader.read<uint32_t>() == DBC_CACHE_MAGIC &&
+               reader.read<uint32_t>() == DBC_CACHE_VERSION &&
+               reader.read<uint64_t>() == hash &&
+               reader.read<uint64_t>() == library_id() &&
+               reader.read_string() == dbc_name && reader.ok;
+
+  if (valid) {
+    dbc = new DBC;
+    dbc->name = dbc_name;
+    dbc->msgs.resize(reader.read<uint32_t>());
+    for (size_t i = 0; reader.ok && i < dbc->msgs.size(); i++) {
+      Msg &msg = dbc->msgs[i];
+      msg.name = reader.read_string();
+      msg.address = reader.read<uint32_t>();
+      msg.size = reader.read<uint32_t>();
+      msg.sigs = reader.read_signals();
+    }
+    dbc->vals.resize(reader.ok ? reader.read<uint32_t>() : 0);
+    for (size_t i = 0; reader.ok && i < dbc->vals.size(); i++) {
+      Val &val = dbc->vals[i];
+      val.name = reader.read_string();
+      val.address = reader.read<uint32_t>();
+      val.defs.resize(reader.ok ? reader.read<uint32_t>() : 0);
+      for (size_t j = 0; reader.ok && j < val.defs.size(); j++) {
+        val.defs[j].first = reader.read<int64_t>();
+        val.defs[j].second = reader.read_string();
+      }
+      val.sigs = reader.read_signals();
+    }
+
+    if (reader.ok && reader.pos == reader.end) {
+      for (auto& m : dbc->msgs) {
+        dbc->addr_to_msg[m.address] = &m;
+        dbc->name_to_msg[m.name] = &m;
+      }
+    } else {
+      delete dbc;
+      dbc = nullptr;
+    }
+  }
+
+  munmap(data, st.st_size);
+  return dbc;
+}
+
+bool dbc_cache_save(const std::string &cache_path, const DBC &dbc, uint64_t hash) {
+  CacheWriter writer;
+  writer.write<uint32_t>(DBC_CACHE_MAGIC);
+  writer.write<uint32_t>(DBC_CACHE_VERSION);
+  writer.write<uint64_t>(hash);
+  writer.write<uint64_t>(library_id());
+  writer.write(dbc.name);
+
+  writer.write<uint32_t>(dbc.msgs.size());
+  for (const auto &msg : dbc.msgs) {
+    writer.write(msg.name);
+    writer.write<uint32_t>(msg.address);
+    writer.write<uint32_t>(msg.size);
+    writer.write(msg.sigs);
+  }
+  writer.write<uint32_t>(dbc.vals.size());
+  for (const auto &val : dbc.vals) {
+    writer.write(val.name);
+    writer.write<uint32_t>(val.address);
+    writer.write<uint32_t>(val.defs.size());
+    for (const auto &[value, definition] : val.defs) {
+      writer.write<int64_t>(value);
+      writer.write(definition);
+    }
+    writer.write(val.sigs);
+  }
+
+  // write to a temporary file and rename, so readers never see a partial cache
+  const std::string tmp_path = cache_path + ".tmp" + std::to_string(getpid());
+  FILE *f = fopen(tmp_path.c_str(), "wb");
+  if (f == nullptr) return false;
+  bool ok = fwrite(writer.buf.data(), 1, writer.buf.size(), f) == writer.buf.size();
+  ok = (fclose(f) == 0) && ok;
+  ok = ok && rename(tmp_path.c_str(), cache_path.c_str()) == 0;
+  if (!ok) {
+    unlink(tmp_path.c_str());
+  }
+  return ok;
+}
@@ -0,0 +1,48 @@
+#include <algorithm>
+#include <chrono>
+#include <map>
+#include <mutex>
+#include <string>
+#include <vector>
+
+#include "opendbc/can/logger.h"
+
+static std::mutex limiters_lock;
+static std::vector<LogRateLimiter*> limiters;
+
+static uint64_t millis_since_boot() {
+  auto now = std::chrono::steady_clock::now().time_since_epoch();
+  return std::chrono::duration_cast<std::chrono::milliseconds>(now).count();
+}
+
+LogRateLimiter::LogRateLimiter(const char *format, int max_burst, int millis)
+    : fmt(format), burst(max_burst), tokens_per_ms((double)max_burst / millis), tokens(max_burst) {
+  std::lock_guard<std::mutex> guard(limiters_lock);
+  limiters.push_back(this);
+}
+
+bool LogRateLimiter::allow() {
+  std::lock_guard<std::mutex> guard(lock);
+  const uint64_t now = millis_since_boot();
+  if (last_ms != 0) {
+    tokens = std::min(burst, tokens + (now - last_ms) * tokens_per_ms);
+  }
+  last_ms = now;
+
+  if (tokens < 1) {
+    suppressed++;
+    return false;
+  }
+  tokens -= 1;
+  return true;
+}
+
+std::map<std::string, uint64_t> log_suppressed_counts() {
+  std::map<std::string, uint64_t> counts;
+  std::lock_guard<std::mutex> guard(limiters_lock);
+  for (auto limiter : limiters) {
+    std::lock_guard<std::mutex> limiter_guard(limiter->lock);
+    counts[limiter->fmt] += limiter->suppressed;
+  }
+  return counts;
+}
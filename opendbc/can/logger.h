@@ -1,5 +1,33 @@
 #pragma once
 
+#include <cstdint>
+#include <cstdio>
+#include <map>
+#include <mutex>
+#include <string>
+
+// Token bucket behind cloudlog_rl in the standalone build, one per call site. Allows bursts of up
+// to `burst` messages, refilled at `burst` messages every `millis`.
+class LogRateLimiter {
+public:
+  LogRateLimiter(const char *fmt, int burst, int millis);
+  bool allow();
+
+private:
+  friend std::map<std::string, uint64_t> log_suppressed_counts();
+
+  const char *fmt;
+  const double burst;
+  const double tokens_per_ms;
+  double tokens;
+  uint64_t last_ms = 0;
+  uint64_t suppressed = 0;
+  std::mutex lock;
+};
+
+// number of messages dropped by the rate limiters, by format string. Empty when built with SWAGLOG
+std::map<std::string, uint64_t> log_suppressed_counts();
+
 #ifdef SWAGLOG
 #include SWAGLOG
 #else
@@ -11,7 +39,11 @@
 #define CLOUDLOG_CRITICAL 50
 
 #define cloudlog(lvl, fmt, ...) printf(fmt "\n", ## __VA_ARGS__)
-#define cloudlog_rl(burst, millis, lvl, fmt, ...) printf(fmt "\n", ##__VA_ARGS__)
+#define cloudlog_rl(burst, millis, lvl, fmt, ...)               \
+  do {                                                          \
+    static LogRateLimiter rate_limiter(fmt, burst, millis);     \
+    if (rate_limiter.allow()) printf(fmt "\n", ##__VA_ARGS__);  \
+  } while (false)
 
 #define LOGD(fmt, ...) cloudlog(CLOUDLOG_DEBUG, fmt, ## __VA_ARGS__)
 #define LOG(fmt, ...) cloudlog(CLOUDLOG_INFO, fmt, ## __VA_ARGS__)
@@ -39,70 +39,125 @@ CANPacker::CANPacker(const std::string& dbc_name) {
       signal_lookup[msg.address][sig.name] = sig;
     }
   }
+
+  // find the counter and checksum signals once, instead of on every pack
+  for (const auto& msg : dbc->msgs) {
+    auto &info = message_info[msg.address];
+    info.msg = &msg;
+    auto &sigs = signal_lookup[msg.address];
+    auto sig_it_counter = std::find_if(sigs.begin(), sigs.end(), [](const auto& pair) {
+      return pair.second.type == COUNTER || pair.first == "COUNTER";
+    });
+    info.counter = sig_it_counter != sigs.end() ? &sig_it_counter->second : nullptr;
+    auto sig_it_checksum = std::find_if(sigs.begin(), sigs.end(), [](const auto& pair) {
+      return pair.second.type > COUNTER;
+    });
+    info.checksum = sig_it_checksum != sigs.end() ? &sig_it_checksum->second : nullptr;
+  }
 }
 
-std::vector<uint8_t> CANPacker::pack(uint32_t address, const std::vector<SignalPackValue> &signals) {
-  auto msg_it = dbc->addr_to_msg.find(address);
-  if (msg_it == dbc->addr_to_msg.end()) {
+void CANPacker::set_signal(std::vector<uint8_t> &msg, uint32_t address, const Signal &sig, double value, bool &counter_set) {
+  int64_t ival = (int64_t)(round((value - sig.offset) / sig.factor));
+  if (ival < 0) {
+    ival = (1ULL << sig.size) + ival;
+  }
+  set_value(msg, sig, ival);
+
+  // FIXME: Type is only assigned if DBC has a ChecksumState
+  if (sig.type == COUNTER || sig.name == "COUNTER") {
+    counters[address] = value;
+    counter_set = true;
+  }
+}
+
+void CANPacker::finish(std::vector<uint8_t> &msg, uint32_t address, const MessagePackInfo &info, bool counter_set) {
+  // set message counter
+  if (!counter_set && info.counter != nullptr) {
+    const auto& sig = *info.counter;
+    uint32_t &counter = counters[address];
+    set_value(msg, sig, counter);
+    counter = (counter + 1) % (1 << sig.size);
+  }
+
+  // set message checksum
+  if (info.checksum != nullptr && info.checksum->calc_checksum != nullptr) {
+    const auto &sig = *info.checksum;
+    unsigned int checksum = sig.calc_checksum(address, sig, msg);
+    set_value(msg, sig, checksum);
+  }
+}
+
+void CANPacker::pack_into(uint32_t address, const SignalPackValue *signals, size_t count, std::vector<uint8_t> &ret) {
+  auto info_it = message_info.find(address);
+  if (info_it == message_info.end()) {
     LOGE("undefined address %d", address);
-    return {};
+    ret.clear();
+    return;
   }
 
-  std::vector<uint8_t> ret(msg_it->second->size, 0);
+  ret.assign(info_it->second.msg->size, 0);
+  const auto &sigs = signal_lookup[address];
 
   // set all values for all given signal/value pairs
   bool counter_set = false;
-  for (const auto& sigval : signals) {
-    auto sig_it = signal_lookup[address].find(sigval.name);
-    if (sig_it == signal_lookup[address].end()) {
+  for (size_t i = 0; i < count; i++) {
+    const auto &sigval = signals[i];
+    auto sig_it = sigs.find(sigval.name);
+    if (sig_it == sigs.end()) {
       // TODO: do something more here. invalid flag like CANParser?
       LOGE("undefined signal %s - %d\n", sigval.name.c_str(), address);
       continue;
     }
-    const auto &sig = sig_it->second;
+    set_signal(ret, address, sig_it->second, sigval.value, counter_set);
+  }
 
-    int64_t ival = (int64_t)(round((sigval.value - sig.offset) / sig.factor));
-    if (ival < 0) {
-      ival = (1ULL << sig.size) + ival;
-    }
-    set_value(ret, sig, ival);
+  finish(ret, address, info_it->second, counter_set);
+}
 
-    // FIXME: Type is only assigned if DBC has a ChecksumState
-    if (sig.type == COUNTER || sig.name == "COUNTER") {
-      counters[address] = sigval.value;
-      counter_set = true;
-    }
+std::vector<uint8_t> CANPacker::pack(uint32_t address, const std::vector<SignalPackValue> &signals) {
+  std::vector<uint8_t> ret;
+  pack_into(address, signals.data(), signals.size(), ret);
+  return ret;
+}
+
+void CANPacker::pack(PackBatch &batch) {
+  batch.dat.clear();
+  batch.dat_ends.clear();
+
+  size_t start = 0;
+  for (size_t i = 0; i < batch.addresses.size(); i++) {
+    pack_into(batch.addresses[i], batch.values.data() + start, batch.value_ends[i] - start, batch_msg);
+    start = batch.value_ends[i];
+    batch.dat.insert(batch.dat.end(), batch_msg.begin(), batch_msg.end());
+    batch.dat_ends.push_back(batch.dat.size());
   }
+}
 
-  // set message counter
-  auto sig_it_counter = std::find_if(signal_lookup[address].begin(), signal_lookup[address].end(), [](const auto& pair) {
-    return pair.second.type == COUNTER || pair.first == "COUNTER";
-  });
-  if (!counter_set && sig_it_counter != signal_lookup[address].end()) {
-    const auto& sig = sig_it_counter->second;
-
-    if (counters.find(address) == counters.end()) {
-      counters[address] = 0;
-    }
-    set_value(ret, sig, counters[address]);
-    counters[address] = (counters[address] + 1) % (1 << sig.size);
+std::vector<uint8_t> CANPacker::pack(uint32_t address, const std::vector<const Signal*> &signals, const std::vector<double> &values) {
+  auto info_it = message_info.find(address);
+  if (info_it == message_info.end()) {
+    LOGE("undefined address %d", address);
+    return {};
   }
+  assert(signals.size() == values.size());
 
-  // set message checksum
-  auto sig_it_checksum = std::find_if(signal_lookup[address].begin(), signal_lookup[address].end(), [](const auto& pair) {
-    return pair.second.type > COUNTER;
-  });
-  if (sig_it_checksum != signal_lookup[address].end()) {
-    const auto &sig = sig_it_checksum->second;
-    if (sig.calc_checksum != nullptr) {
-      unsigned int checksum = sig.calc_checksum(address, sig, ret);
-      set_value(ret, sig, checksum);
-    }
+  std::vector<uint8_t> ret(info_it->second.msg->size, 0);
+  bool counter_set = false;
+  for (size_t i = 0; i < signals.size(); i++) {
+    set_signal(ret, address, *signals[i], values[i], counter_set);
   }
 
+  finish(ret, address, info_it->second, counter_set);
   return ret;
 }
 
+const Signal* CANPacker::lookup_signal(uint32_t address, const std::string &name) {
+  auto msg_it = signal_lookup.find(address);
+  if (msg_it == signal_lookup.end()) return nullptr;
+  auto sig_it = msg_it->second.find(name);
+  return sig_it != msg_it->second.end() ? &sig_it->second : nullptr;
+}
+
 // This function has a definition in common.h and is used in PlotJuggler
 const Msg* CANPacker::lookup_message(uint32_t address) {
   return dbc->addr_to_msg.at(address);
@@ -6,13 +6,14 @@ from libcpp.string cimport string
 from libcpp.vector cimport vector
 
 from .common cimport CANPacker as cpp_CANPacker
-from .common cimport dbc_lookup, SignalPackValue, DBC, Msg
+from .common cimport dbc_lookup, SignalPackValue, DBC, Msg, Signal, COUNTER, PackBatch
 
 
 cdef class CANPacker:
   cdef:
     cpp_CANPacker *packer
     const DBC *dbc
+    PackBatch batch
 
   def __init__(self, dbc_name):
     self.dbc = dbc_lookup(dbc_name)
@@ -32,6 +33,41 @@ cdef class CANPacker:
       with nogil:
         del self.packer
 
+  def prepare(self, name_or_addr, signals=None):
+    """
+    Resolves a message and its signals once, for messages packed every frame. Returns a PackTemplate
+    that takes values in the order of signals. By default that's all signals of the message except the
+    counter and checksum, which are filled in as in make_can_msg.
+    """
+    cdef const Msg *m
+    try:
+      if isinstance(name_or_addr, int):
+        m = self.dbc.addr_to_msg.at(name_or_addr)
+      else:
+        m = self.dbc.name_to_msg.at(name_or_addr.encode("utf8"))
+    except IndexError:
+      raise RuntimeError(f"could not find message {repr(name_or_addr)} in DBC")
+
+    if signals is None:
+      signals = [sig.name.decode("utf-8") for sig in (<Msg*>m).sigs
+                 if not (sig.type >= COUNTER or sig.name == b"COUNTER")]
+
+    cdef PackTemplate template = PackTemplate.__new__(PackTemplate)
+    template.packer = self
+    template.address = m.address
+    template.name = m.name.decode("utf-8")
+    template.signals = list(signals)
+    template.slots = {name: i for i, name in enumerate(template.signals)}
+
+    cdef const Signal *sig_ptr
+    for name in template.signals:
+      sig_ptr = self.packer.lookup_signal(m.address, name.encode("utf8"))
+      if sig_ptr == NULL:
+        raise RuntimeError(f"could not find signal {repr(name)} in message {template.name}")
+      template.sigs.push_back(sig_ptr)
+    template.values.resize(template.sigs.size())
+    return template
+
   cdef vector[uint8_t] pack(self, addr, values):
     cdef vector[SignalPackValue] values_thing
     cdef uint32_t value_len = len(values)
@@ -51,7 +87,7 @@ cdef class CANPacker:
       result = self.packer.pack(addr_cpp, values_thing)
     return result
 
-  cpdef make_can_msg(self, name_or_addr, bus, values):
+  cdef uint32_t lookup_address(self, name_or_addr) except? 0:
     cdef uint32_t addr = 0
     cdef const Msg* m
     if isinstance(name_or_addr, int):
@@ -63,6 +99,75 @@ cdef class CANPacker:
       except IndexError:
         # The C++ pack function will log an error message for invalid addresses
         pass
+    return addr
 
+  cpdef make_can_msg(self, name_or_addr, bus, values):
+    cdef uint32_t addr = self.lookup_address(name_or_addr)
     cdef vector[uint8_t] val = self.pack(addr, values)
     return addr, (<char *>&val[0])[:val.size()], bus
+
+  def make_can_msgs(self, msgs):
+    """
+    Packs a list of (name_or_addr, bus, values) in one call into a shared buffer.
+    Returns a list of (addr, dat, bus), the same as calling make_can_msg for each.
+    """
+    cdef PackBatch *batch = &self.batch
+    cdef SignalPackValue *spv
+    cdef size_t n_values = 0
+    batch.addresses.clear()
+    batch.value_ends.clear()
+
+    buses = []
+    for name_or_addr, bus, values in msgs:
+      batch.addresses.push_back(self.lookup_address(name_or_addr))
+      for name, value in values.items():
+        # reuse the value slots, and their string buffers, from previous calls
+        spv = &batch.values[n_values] if n_values < batch.values.size() else &batch.values.emplace_back()
+        spv.name = name.encode("utf8")
+        spv.value = value
+        n_values += 1
+      batch.value_ends.push_back(n_values)
+      buses.append(bus)
+
+    with nogil:
+      self.packer.pack(batch[0])
+
+    cdef const char *dat = <const char *>batch.dat.data()
+    cdef size_t start = 0, end
+    ret = []
+    for i in range(batch.addresses.size()):
+      end = batch.dat_ends[i]
+      ret.append((batch.addresses[i], dat[start:end], buses[i]))
+      start = end
+    return ret
+
+cdef class PackTemplate:
+  """
+  A message prepared by CANPacker.prepare. Values are given as a sequence in the order of self.signals,
+  self.slots maps signal names to their index.
+  """
+  cdef:
+    CANPacker packer
+    vector[const Signal*] sigs
+    vector[double] values
+
+  cdef readonly:
+    uint32_t address
+    str name
+    list signals
+    dict slots
+
+  cpdef bytes pack(self, values):
+    if len(values) != self.sigs.size():
+      raise ValueError(f"expected {self.sigs.size()} values for {self.name}, got {len(values)}")
+    cdef size_t i
+    for i in range(self.sigs.size()):
+      self.values[i] = values[i]
+
+    cdef vector[uint8_t] result
+    with nogil:
+      result = self.packer.packer.pack(self.address, self.sigs, self.values)
+    return (<char *>result.data())[:result.size()]
+
+  def make_can_msg(self, bus, values):
+    return self.address, self.pack(values), bus
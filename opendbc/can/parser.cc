@@ -2,15 +2,16 @@
 #include <cassert>
 #include <cstring>
 #include <limits>
-#include <set>
+#include <mutex>
 #include <stdexcept>
 #include <sstream>
 #include <string>
+#include <unordered_map>
 #include <vector>
 
 #include "opendbc/can/common.h"
 
-int64_t get_raw_value(const std::vector<uint8_t> &msg, const Signal &sig) {
+int64_t get_raw_value(const ByteSpan &msg, const Signal &sig) {
   int64_t ret = 0;
 
   int i = sig.msb / 8;
@@ -29,18 +30,76 @@ int64_t get_raw_value(const std::vector<uint8_t> &msg, const Signal &sig) {
   return ret;
 }
 
+SignalPlan compile_signal(const Signal &sig) {
+  SignalPlan plan = {};
+  plan.factor = sig.factor;
+  plan.offset = sig.offset;
+  plan.mask = sig.size < 64 ? ((1ULL << sig.size) - 1) : ~0ULL;
+  plan.sign_bit = sig.is_signed ? (1ULL << (sig.size - 1)) : 0;
+
+  // bytes are walked from the MSB, which is the last byte for little endian signals
+  plan.byte_start = sig.is_little_endian ? sig.lsb / 8 : sig.msb / 8;
+  plan.byte_end = sig.is_little_endian ? sig.msb / 8 : sig.lsb / 8;
+
+  // the window is loaded little endian, big endian windows are byte swapped so the LSB byte is at the bottom
+  if (sig.is_little_endian) {
+    plan.shift_base = sig.lsb;
+    plan.shift_step = -8;
+  } else {
+    plan.shift_base = 56 - (sig.lsb / 8) * 8 + sig.lsb % 8;
+    plan.shift_step = 8;
+  }
+  plan.fast = plan.byte_end - plan.byte_start < 8;
+  return plan;
+}
+
+static inline int64_t get_raw_value(const ByteSpan &msg, const Signal &sig, const SignalPlan &plan) {
+  if (!plan.fast || plan.byte_end >= msg.size() || msg.size() < 8) {
+    return get_raw_value(msg, sig);
+  }
+
+  // load the 8 bytes starting at the signal, moved back to stay within the frame
+  const unsigned int window = std::min<size_t>(plan.byte_start, msg.size() - 8);
+  uint64_t word;
+  memcpy(&word, msg.data() + window, 8);
+#if __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+  word = __builtin_bswap64(word);
+#endif
+  if (!sig.is_little_endian) {
+    word = __builtin_bswap64(word);
+  }
+  return (word >> (plan.shift_base + plan.shift_step * (int)window)) & plan.mask;
+}
+
+void MessageState::init_signals(const std::vector<Signal> &sigs) {
+  parse_sigs = sigs;
+  plans.clear();
+  for (const auto &sig : sigs) {
+    plans.push_back(compile_signal(sig));
+  }
+  vals.assign(sigs.size(), 0);
+  tmp_vals.assign(sigs.size(), 0);
+  all_vals.assign(sigs.size(), {});
+}
+
+void MessageState::init_history(size_t capacity) {
+  history_size = capacity;
+  history_count = 0;
+  history_nanos.assign(capacity, 0);
+  history_vals.assign(capacity * parse_sigs.size(), 0);
+}
 
-bool MessageState::parse(uint64_t nanos, const std::vector<uint8_t> &dat) {
-  std::vector<double> tmp_vals(parse_sigs.size());
+bool MessageState::decode(const ByteSpan &dat, double *out) {
   bool checksum_failed = false;
   bool counter_failed = false;
 
   for (int i = 0; i < parse_sigs.size(); i++) {
     const auto &sig = parse_sigs[i];
+    const auto &plan = plans[i];
 
-    int64_t tmp = get_raw_value(dat, sig);
-    if (sig.is_signed) {
-      tmp -= ((tmp >> (sig.size-1)) & 0x1) ? (1ULL << sig.size) : 0;
+    int64_t tmp = get_raw_value(dat, sig, plan);
+    if (tmp & plan.sign_bit) {
+      tmp -= plan.sign_bit << 1;
     }
 
     //DEBUG("parse 0x%X %s -> %ld\n", address, sig.name, tmp);
@@ -57,19 +116,39 @@ bool MessageState::parse(uint64_t nanos, const std::vector<uint8_t> &dat) {
       }
     }
 
-    tmp_vals[i] = tmp * sig.factor + sig.offset;
+    out[i] = tmp * plan.factor + plan.offset;
   }
 
-  // only update values if both checksum and counter are valid
+  stats.checksum_failures += checksum_failed;
   if (checksum_failed || counter_failed) {
     LOGE_100("0x%X message checks failed, checksum failed %d, counter failed %d", address, checksum_failed, counter_failed);
     return false;
   }
+  return true;
+}
+
+bool MessageState::parse(uint64_t nanos, const ByteSpan &dat) {
+  // only update values if both checksum and counter are valid
+  if (!decode(dat, tmp_vals.data())) {
+    return false;
+  }
 
   for (int i = 0; i < parse_sigs.size(); i++) {
     vals[i] = tmp_vals[i];
     all_vals[i].push_back(vals[i]);
   }
+  if (history_size > 0) {
+    const size_t row = history_count % history_size;
+    history_nanos[row] = nanos;
+    std::copy(vals.begin(), vals.end(), history_vals.begin() + row * vals.size());
+    history_count++;
+  }
+
+  stats.accepted++;
+  if (last_seen_nanos != 0 && nanos >= last_seen_nanos) {
+    stats.last_interval_nanos = nanos - last_seen_nanos;
+    timing.update(stats.last_interval_nanos);
+  }
   last_seen_nanos = nanos;
 
   return true;
@@ -79,8 +158,11 @@ bool MessageState::parse(uint64_t nanos, const std::vector<uint8_t> &dat) {
 bool MessageState::update_counter_generic(int64_t v, int cnt_size) {
   if (((counter + 1) & ((1 << cnt_size) -1)) != v) {
     counter_fail = std::min(counter_fail + 1, MAX_BAD_COUNTER);
+    if (last_seen_nanos != 0) {
+      stats.counter_failures++;  // the first frame has nothing to compare against
+    }
     if (counter_fail > 1) {
-      INFO("0x%X COUNTER FAIL #%d -- %d -> %d\n", address, counter_fail, counter, (int)v);
+      LOG_100("0x%X COUNTER FAIL #%d -- %d -> %d", address, counter_fail, counter, (int)v);
     }
   } else if (counter_fail > 0) {
     counter_fail--;
@@ -90,7 +172,8 @@ bool MessageState::update_counter_generic(int64_t v, int cnt_size) {
 }
 
 
-CANParser::CANParser(int abus, const std::string& dbc_name, const std::vector<std::pair<uint32_t, int>> &messages)
+CANParser::CANParser(int abus, const std::string& dbc_name, const std::vector<std::pair<uint32_t, int>> &messages,
+                     const std::unordered_map<uint32_t, std::vector<std::string>> &signals)
   : bus(abus) {
   dbc = dbc_lookup(dbc_name);
   assert(dbc);
@@ -111,7 +194,8 @@ CANParser::CANParser(int abus, const std::string& dbc_name, const std::vector<st
 
     // msg is not valid if a message isn't received for 10 consecutive steps
     if (frequency > 0) {
-      state.check_threshold = (1000000000ULL / frequency) * 10;
+      state.timing.expected_nanos = 1000000000ULL / frequency;
+      state.check_threshold = state.timing.expected_nanos * 10;
 
       // bus timeout threshold should be 10x the fastest msg
       bus_timeout_threshold = std::min(bus_timeout_threshold, state.check_threshold);
@@ -122,11 +206,30 @@ CANParser::CANParser(int abus, const std::string& dbc_name, const std::vector<st
     state.size = msg->size;
     assert(state.size <= 64);  // max signal size is 64 bytes
 
-    // track all signals for this message
-    state.parse_sigs = msg->sigs;
-    state.vals.resize(msg->sigs.size());
-    state.all_vals.resize(msg->sigs.size());
+    auto it = signals.find(address);
+    if (it == signals.end()) {
+      // track all signals for this message
+      state.init_signals(msg->sigs);
+      continue;
+    }
+
+    for (const auto &name : it->second) {
+      auto sig_it = std::find_if(msg->sigs.begin(), msg->sigs.end(), [&](const Signal &sig) { return sig.name == name; });
+      if (sig_it == msg->sigs.end()) {
+        throw std::runtime_error("could not find signal " + name + " in message " + msg->name);
+      }
+    }
+    std::vector<Signal> sigs;
+    for (const auto &sig : msg->sigs) {
+      // counters and checksums are still needed to validate the message
+      bool requested = std::find(it->second.begin(), it->second.end(), sig.name) != it->second.end();
+      if (requested || sig.type != SignalType::DEFAULT) {
+        sigs.push_back(sig);
+      }
+    }
+    state.init_signals(sigs);
   }
+  InitDispatch();
 }
 
 CANParser::CANParser(int abus, const std::string& dbc_name, bool ignore_checksum, bool ignore_counter)
@@ -145,35 +248,132 @@ CANParser::CANParser(int abus, const std::string& dbc_name, bool ignore_checksum
       .ignore_counter = ignore_counter,
     };
 
-    for (const auto& sig : msg.sigs) {
-      state.parse_sigs.push_back(sig);
-      state.vals.push_back(0);
-      state.all_vals.push_back({});
-    }
+    state.init_signals(msg.sigs);
 
     message_states[state.address] = state;
   }
+  InitDispatch();
 }
 
-std::set<uint32_t> CANParser::update(const std::vector<CanData> &can_data) {
+void CANParser::InitDispatch() {
+  for (auto &kv : message_states) {
+    kv.second.stats.address = kv.first;
+    dispatch.insert(kv.first, &kv.second);
+  }
+  RebuildValidity(0);
+}
+
+std::vector<MessageStats> CANParser::getStats() const {
+  std::vector<MessageStats> stats;
+  stats.reserve(message_states.size());
+  for (const auto &kv : message_states) {
+    stats.push_back(kv.second.stats);
+  }
+  std::sort(stats.begin(), stats.end(), [](const auto &a, const auto &b) { return a.address < b.address; });
+  return stats;
+}
+
+const std::vector<uint32_t> &CANParser::update(const std::vector<CanData> &can_data) {
   // Clear all_values
   for (auto &state : message_states) {
     for (auto &vals : state.second.all_vals) vals.clear();
+    state.second.updated = false;
   }
 
-  std::set<uint32_t> updated_addresses;
+  updated_addresses.clear();
   for (const auto &c : can_data) {
     if (first_nanos == 0) {
       first_nanos = c.nanos;
     }
 
-    UpdateCans(c, updated_addresses);
+    UpdateCans(c);
     UpdateValid(c.nanos);
   }
   return updated_addresses;
 }
 
-void CANParser::UpdateCans(const CanData &can, std::set<uint32_t> &updated_addresses) {
+ParserPool::ParserPool(int threads) {
+  for (int i = 0; i < threads; i++) {
+    workers.emplace_back(&ParserPool::run, this);
+  }
+}
+
+ParserPool::~ParserPool() {
+  {
+    std::lock_guard<std::mutex> guard(lock);
+    stopping = true;
+  }
+  work_cv.notify_all();
+  for (auto &worker : workers) {
+    worker.join();
+  }
+}
+
+void ParserPool::update(const std::vector<CANParser*> &parsers, const std::vector<std::vector<CanData>> &can_data,
+                        const std::vector<int> &slots, size_t min_frames) {
+  size_t frames = 0;
+  for (size_t i = 0; i < parsers.size(); i++) {
+    for (const auto &c : can_data[slots[i]]) {
+      frames += c.frames.size();
+    }
+  }
+
+  if (workers.empty() || parsers.size() < 2 || frames < min_frames) {
+    for (size_t i = 0; i < parsers.size(); i++) {
+      parsers[i]->update(can_data[slots[i]]);
+    }
+    return;
+  }
+
+  std::unique_lock<std::mutex> lk(lock);
+  task_parsers = &parsers;
+  task_data = &can_data;
+  task_slots = &slots;
+  task_count = pending = parsers.size();
+  next_task = 0;
+  errors.assign(parsers.size(), nullptr);
+  generation++;
+  work_cv.notify_all();
+
+  // the calling thread takes tasks too
+  work(lk);
+  done_cv.wait(lk, [&] { return pending == 0; });
+  task_count = 0;
+
+  // rethrow in parser order, so the same error is raised as in a sequential update
+  for (const auto &error : errors) {
+    if (error) std::rethrow_exception(error);
+  }
+}
+
+void ParserPool::run() {
+  uint64_t seen = 0;
+  std::unique_lock<std::mutex> lk(lock);
+  while (true) {
+    work_cv.wait(lk, [&] { return stopping || generation != seen; });
+    if (stopping) return;
+    seen = generation;
+    work(lk);
+  }
+}
+
+void ParserPool::work(std::unique_lock<std::mutex> &lk) {
+  while (next_task < task_count) {
+    const size_t i = next_task++;
+    lk.unlock();
+    try {
+      (*task_parsers)[i]->update((*task_data)[(*task_slots)[i]]);
+    } catch (...) {
+      errors[i] = std::current_exception();
+    }
+    lk.lock();
+    if (--pending == 0) {
+      done_cv.notify_all();
+    }
+  }
+}
+
+void CANParser::UpdateCans(const CanData &can) {
   //DEBUG("got %zu messages\n", can.frames.size());
 
   bool bus_empty = true;
@@ -185,24 +385,35 @@ void CANParser::UpdateCans(const CanData &can, std::set<uint32_t> &updated_addre
     }
     bus_empty = false;
 
-    auto state_it = message_states.find(frame.address);
-    if (state_it == message_states.end()) {
+    MessageState *state = dispatch.find(frame.address);
+    if (state == nullptr) {
       // DEBUG("skip %d: not specified\n", cmsg.getAddress());
       continue;
     }
+    state->stats.frames++;
     if (frame.dat.size() > 64) {
+      state->stats.oversize++;
       DEBUG("got message longer than 64 bytes: 0x%X %zu\n", frame.address, frame.dat.size());
       continue;
     }
 
     // TODO: this actually triggers for some cars. fix and enable this
-    //if (dat.size() != state_it->second.size) {
-    //  DEBUG("got message with unexpected length: expected %d, got %zu for %d", state_it->second.size, dat.size(), cmsg.getAddress());
+    //if (dat.size() != state->size) {
+    //  DEBUG("got message with unexpected length: expected %d, got %zu for %d", state->size, dat.size(), cmsg.getAddress());
     //  continue;
     //}
 
-    if (state_it->second.parse(can.nanos, frame.dat)) {
-      updated_addresses.insert(state_it->first);
+    const bool was_missing = state->last_seen_nanos == 0;
+    const bool was_bad_counter = state->counter_fail >= MAX_BAD_COUNTER;
+    if (state->parse(can.nanos, frame.dat)) {
+      if (!state->updated) {
+        state->updated = true;
+        updated_addresses.push_back(state->address);
+      }
+      TrackState(*state, was_missing);
+    }
+    if (was_bad_counter != (state->counter_fail >= MAX_BAD_COUNTER)) {
+      bad_counter_cnt += was_bad_counter ? -1 : 1;
     }
   }
 
@@ -213,13 +424,101 @@ void CANParser::UpdateCans(const CanData &can, std::set<uint32_t> &updated_addre
   bus_timeout = (can.nanos - last_nonempty_nanos) > bus_timeout_threshold;
 }
 
+void CANParser::TrackState(MessageState &state, bool was_missing) {
+  if (state.check_threshold == 0) return;
+
+  const bool missing = state.last_seen_nanos == 0;
+  if (was_missing != missing) {
+    missing_cnt += missing ? 1 : -1;
+  }
+  SetTimedOut(state, false);
+  if (!missing && !state.queued) {
+    deadlines.push({state.last_seen_nanos + state.check_threshold, &state});
+    state.queued = true;
+  }
+}
+
+// every validity path goes through here, so timeouts are counted once per transition
+void CANParser::SetTimedOut(MessageState &state, bool timed_out) {
+  if (state.timed_out == timed_out) return;
+
+  state.timed_out = timed_out;
+  if (timed_out) {
+    state.stats.timeouts++;
+    timed_out_cnt++;
+  } else {
+    timed_out_cnt--;
+  }
+}
+
+void CANParser::RebuildValidity(uint64_t nanos) {
+  deadlines = {};
+  missing_cnt = bad_counter_cnt = 0;
+  for (auto &kv : message_states) {
+    auto &state = kv.second;
+    state.queued = false;
+    if (state.counter_fail >= MAX_BAD_COUNTER) {
+      bad_counter_cnt++;
+    }
+    if (state.check_threshold == 0) continue;
+
+    const bool missing = state.last_seen_nanos == 0;
+    SetTimedOut(state, !missing && (nanos - state.last_seen_nanos) > state.check_threshold);
+    if (missing) {
+      missing_cnt++;
+    } else if (!state.timed_out) {
+      deadlines.push({state.last_seen_nanos + state.check_threshold, &state});
+      state.queued = true;
+    }
+  }
+  last_valid_nanos = nanos;
+  validity_dirty = false;
+}
+
 void CANParser::UpdateValid(uint64_t nanos) {
+  if (nanos < last_valid_nanos) {
+    validity_dirty = true;
+  }
+  if (validity_dirty) {
+    UpdateValidFull(nanos);
+    return;
+  }
+  last_valid_nanos = nanos;
+
+  // expire deadlines, messages seen since their entry was queued are requeued with the new deadline
+  while (!deadlines.empty() && deadlines.top().first < nanos) {
+    MessageState &state = *deadlines.top().second;
+    deadlines.pop();
+    state.queued = false;
+
+    const uint64_t deadline = state.last_seen_nanos + state.check_threshold;
+    if (deadline < nanos) {
+      SetTimedOut(state, true);
+    } else {
+      deadlines.push({deadline, &state});
+      state.queued = true;
+    }
+  }
+
+  const bool _valid = missing_cnt == 0 && timed_out_cnt == 0;
+  if (!_valid && (nanos - first_nanos) > 8e9 && !bus_timeout) {
+    // slow path, only to log which messages are missing
+    UpdateValidFull(nanos);
+    return;
+  }
+  can_invalid_cnt = _valid ? 0 : (can_invalid_cnt + 1);
+  can_valid = (can_invalid_cnt < CAN_INVALID_CNT) && bad_counter_cnt == 0;
+}
+
+void CANParser::UpdateValidFull(uint64_t nanos) {
   const bool show_missing = (nanos - first_nanos) > 8e9;
 
   bool _valid = true;
   bool _counters_valid = true;
-  for (const auto& kv : message_states) {
-    const auto& state = kv.second;
+  uint64_t max_last_seen_nanos = 0;
+  for (auto& kv : message_states) {
+    auto& state = kv.second;
+    max_last_seen_nanos = std::max(max_last_seen_nanos, state.last_seen_nanos);
 
     if (state.counter_fail >= MAX_BAD_COUNTER) {
       _counters_valid = false;
@@ -227,6 +526,9 @@ void CANParser::UpdateValid(uint64_t nanos) {
 
     const bool missing = state.last_seen_nanos == 0;
     const bool timed_out = (nanos - state.last_seen_nanos) > state.check_threshold;
+    if (state.check_threshold > 0) {
+      SetTimedOut(state, !missing && timed_out);
+    }
     if (state.check_threshold > 0 && (missing || timed_out)) {
       if (show_missing && !bus_timeout) {
         if (missing) {
@@ -240,4 +542,121 @@ void CANParser::UpdateValid(uint64_t nanos) {
   }
   can_invalid_cnt = _valid ? 0 : (can_invalid_cnt + 1);
   can_valid = (can_invalid_cnt < CAN_INVALID_CNT) && _counters_valid;
+
+  // deadlines can be used again once no message was seen after this point in time
+  if (validity_dirty && max_last_seen_nanos <= nanos) {
+    RebuildValidity(nanos);
+  }
+}
+
+void records_to_can_data(const CanRecord *records, size_t count, std::vector<CanData> &can_data) {
+  // entries and their frame vectors are reused between calls
+  size_t sets = 0;
+  for (size_t i = 0; i < count; i++) {
+    const CanRecord &record = records[i];
+    if (sets == 0 || can_data[sets - 1].nanos != record.nanos) {
+      if (sets == can_data.size()) {
+        can_data.emplace_back();
+      }
+      can_data[sets].nanos = record.nanos;
+      can_data[sets].frames.clear();
+      sets++;
+    }
+    if (record.size <= sizeof(record.dat)) {
+      can_data[sets - 1].frames.push_back({record.src, record.address, ByteSpan(record.dat, record.size)});
+    }
+  }
+  can_data.resize(sets);
+}
+
+size_t panda_to_can_data(uint64_t nanos, const uint8_t *dat, size_t size, std::vector<CanData> &can_data) {
+  static const size_t HEAD_SIZE = 6;
+  static const uint8_t DLC_TO_LEN[] = {0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64};
+
+  can_data.resize(1);
+  can_data[0].nanos = nanos;
+  can_data[0].frames.clear();
+
+  size_t pos = 0;
+  while (size - pos >= HEAD_SIZE) {
+    const uint8_t *packet = dat + pos;
+    const size_t len = DLC_TO_LEN[packet[0] >> 4];
+    if (size - pos < HEAD_SIZE + len) {
+      break;
+    }
+    uint8_t checksum = 0;
+    for (size_t i = 0; i < HEAD_SIZE + len; i++) {
+      checksum ^= packet[i];
+    }
+    if (checksum != 0) {
+      break;
+    }
+
+    // same bus numbering as panda's unpack_can_buffer
+    const uint32_t header = packet[1] | (packet[2] << 8) | (packet[3] << 16) | ((uint32_t)packet[4] << 24);
+    long src = (packet[0] >> 1) & 0x7;
+    if (header & 0x2) src += 128;  // returned
+    if (header & 0x1) src += 192;  // rejected
+    can_data[0].frames.push_back({src, header >> 3, ByteSpan(packet + HEAD_SIZE, len)});
+    pos += HEAD_SIZE + len;
+  }
+  return pos;
+}
+
+std::vector<DecodedMessage> decode_log(const std::string& dbc_name, const CanRecord *records, size_t count, int bus,
+                                       const std::vector<uint32_t> &addresses, bool ignore_checksum, bool ignore_counter) {
+  const DBC *dbc = dbc_lookup(dbc_name);
+  if (dbc == nullptr) {
+    throw std::runtime_error("Can't find DBC: " + dbc_name);
+  }
+
+  std::vector<const Msg*> msgs;
+  if (addresses.empty()) {
+    for (const auto &msg : dbc->msgs) msgs.push_back(&msg);
+  } else {
+    for (uint32_t address : addresses) msgs.push_back(dbc->addr_to_msg.at(address));
+  }
+
+  AddressTable<MessageState> dispatch;
+  std::vector<MessageState> states(msgs.size());
+  std::vector<DecodedMessage> decoded(msgs.size());
+  for (size_t i = 0; i < msgs.size(); i++) {
+    MessageState &state = states[i];
+    state.name = msgs[i]->name;
+    state.address = msgs[i]->address;
+    state.size = msgs[i]->size;
+    state.ignore_checksum = ignore_checksum;
+    state.ignore_counter = ignore_counter;
+    state.init_signals(msgs[i]->sigs);
+    decoded[i].address = state.address;
+    dispatch.insert(state.address, &state);
+  }
+
+  for (size_t i = 0; i < count; i++) {
+    const CanRecord &record = records[i];
+    if (record.src != bus) {
+      continue;
+    }
+    MessageState *state_ptr = dispatch.find(record.address);
+    if (state_ptr == nullptr || record.size > sizeof(record.dat)) {
+      continue;
+    }
+
+    MessageState &state = *state_ptr;
+    DecodedMessage &msg = decoded[state_ptr - states.data()];
+
+    size_t row = msg.vals.size();
+    msg.vals.resize(row + state.parse_sigs.size());
+    if (state.decode(ByteSpan(record.dat, record.size), &msg.vals[row])) {
+      msg.nanos.push_back(record.nanos);
+    } else {
+      msg.vals.resize(row);
+    }
+  }
+
+  // only return messages that were seen
+  decoded.erase(std::remove_if(decoded.begin(), decoded.end(), [](const auto &msg) {
+    return msg.nanos.empty();
+  }), decoded.end());
+  return decoded;
 }
@@ -1,2 +1,4 @@
-from opendbc.can.parser_pyx import CANParser, CANDefine
-assert CANParser, CANDefine
+from opendbc.can.parser_pyx import CANParser, CANParserGroup, CANDefine, CAN_RECORD_DTYPE, MESSAGE_STATS_DTYPE, decode_log
+assert CANParser, CANParserGroup
+assert CANDefine, CAN_RECORD_DTYPE
+assert MESSAGE_STATS_DTYPE, decode_log
@@ -1,16 +1,164 @@
 # distutils: language = c++
 # cython: c_string_encoding=ascii, language_level=3
 
+from cpython.buffer cimport PyBUF_WRITABLE
 from libcpp.pair cimport pair
 from libcpp.string cimport string
+from libcpp.unordered_map cimport unordered_map
 from libcpp.vector cimport vector
-from libc.stdint cimport uint32_t, int
+from libc.stdint cimport uint8_t, uint32_t, uint64_t, int
 
 from .common cimport CANParser as cpp_CANParser
-from .common cimport dbc_lookup, Msg, DBC, CanData
+from .common cimport dbc_lookup, Msg, Val, DBC, ByteSpan, CanData, CanFrame, CanRecord, DecodedMessage
+from .common cimport MessageState, MessageStats, ParserPool
+from .common cimport decode_log as cpp_decode_log, log_suppressed_counts
+from .common cimport records_to_can_data, panda_to_can_data
 
 import numbers
 from collections import defaultdict
+from collections.abc import Mapping, MutableMapping
+
+import numpy as np
+
+
+cdef class _CppBuffer:
+  """Read-only buffer over C++ memory, keeps its owner alive while in use"""
+  cdef:
+    object owner
+    const void *ptr
+    Py_ssize_t size
+
+  def __getbuffer__(self, Py_buffer *buffer, int flags):
+    if flags & PyBUF_WRITABLE:
+      raise BufferError("buffer is read-only")
+    buffer.buf = <void *>self.ptr
+    buffer.obj = self
+    buffer.len = self.size
+    buffer.readonly = 1
+    buffer.itemsize = 1
+    buffer.format = NULL
+    buffer.ndim = 1
+    buffer.shape = &self.size
+    buffer.strides = NULL
+    buffer.suboffsets = NULL
+    buffer.internal = NULL
+
+  def __releasebuffer__(self, Py_buffer *buffer):
+    pass
+
+
+cdef object cpp_array(object owner, const void *ptr, Py_ssize_t count, object dtype):
+  cdef _CppBuffer buf = _CppBuffer.__new__(_CppBuffer)
+  buf.owner = owner
+  buf.ptr = ptr
+  buf.size = count * np.dtype(dtype).itemsize
+  return np.frombuffer(buf, dtype=dtype)
+
+
+CAN_RECORD_DTYPE = np.dtype([
+  ("nanos", np.uint64),
+  ("address", np.uint32),
+  ("src", np.uint8),
+  ("size", np.uint8),
+  ("dat", np.uint8, 64),
+], align=True)
+assert CAN_RECORD_DTYPE.itemsize == sizeof(CanRecord)
+
+MESSAGE_STATS_DTYPE = np.dtype([
+  ("address", np.uint32),
+  ("frames", np.uint64),
+  ("accepted", np.uint64),
+  ("checksum_failures", np.uint64),
+  ("counter_failures", np.uint64),
+  ("oversize", np.uint64),
+  ("timeouts", np.uint64),
+  ("last_interval_nanos", np.uint64),
+], align=True)
+assert MESSAGE_STATS_DTYPE.itemsize == sizeof(MessageStats)
+
+
+cdef list convert_strings(strings, const vector[int] &slots, vector[vector[CanData]] &out):
+  # input format:
+  # [nanos, [[address, data, src], ...]]
+  # [[nanos, [[address, data, src], ...], ...]]
+  # frames are appended to out[slots[src]], sources without a slot are dropped.
+  # The frames point into the data buffers, the returned list keeps all of them alive for the update
+  cdef CanFrame *frame
+  cdef uint32_t source_bus
+  cdef const uint8_t *dat_ptr
+  cdef list buffers = []
+  try:
+    if len(strings) and not isinstance(strings[0], (list, tuple)):
+      strings = [strings]
+
+    # reuse the CanData entries and their frame buffers from the previous update
+    for i in range(out.size()):
+      out[i].resize(len(strings))
+      for j in range(out[i].size()):
+        out[i][j].frames.clear()
+
+    for j, s in enumerate(strings):
+      nanos = s[0]
+      for i in range(out.size()):
+        out[i][j].nanos = nanos
+        out[i][j].frames.reserve(len(s[1]))
+      for address, dat, src in s[1]:
+        source_bus = <uint32_t>src
+        if source_bus < slots.size() and slots[source_bus] >= 0:
+          if type(dat) is not bytes:
+            dat = bytes(dat)
+          buffers.append(dat)
+          dat_ptr = dat
+          frame = &(out[slots[source_bus]][j].frames.emplace_back())
+          frame.address = address
+          frame.dat = ByteSpan(dat_ptr, len(<bytes>dat))
+          frame.src = source_bus
+  except TypeError:
+    raise RuntimeError("invalid parameter")
+  return buffers
+
+cdef class MessageHistory:
+  """
+  The last samples of a message, kept across updates. nanos and vals are read-only views over the parser's
+  ring buffer, sample i is stored in row i % capacity. vals has one column per signal slot.
+  """
+  cdef object count_view
+
+  cdef readonly:
+    object nanos
+    object vals
+    dict slots
+
+  @property
+  def count(self):
+    """Number of samples recorded so far"""
+    return int(self.count_view[0])
+
+  def ordered(self):
+    """Copy of the samples in the buffer as (nanos, vals), oldest first"""
+    capacity = len(self.nanos)
+    count = self.count
+    rows = np.arange(count) if count <= capacity else (np.arange(capacity) + count) % capacity
+    return self.nanos[rows], self.vals[rows]
+
+
+class MessageTimings(Mapping):
+  """Time between accepted frames of each message by name and address, read from the parser on lookup"""
+  def __init__(self, parser, addresses):
+    self._parser = parser
+    self._addresses = addresses
+
+  def __getitem__(self, key):
+    return self._parser._message_timing(self._addresses[key])
+
+  def __iter__(self):
+    return iter(self._addresses)
+
+  def __len__(self):
+    return len(self._addresses)
+
+  def __repr__(self):
+    return repr(dict(self))
 
 
 cdef class CANParser:
@@ -18,17 +166,40 @@ cdef class CANParser:
     cpp_CANParser *can
     const DBC *dbc
     set addresses
+    dict message_addresses  # message name or address -> address
+    set vl_all_updated
+    vector[int] slots_by_bus
+    vector[vector[CanData]] can_data
 
   cdef readonly:
     dict vl
     dict vl_all
     dict ts_nanos
+    dict history
+    dict slots
     string dbc_name
     uint32_t bus
+    bint columnar
 
-  def __init__(self, dbc_name, messages, bus=0):
+  def __init__(self, dbc_name, messages, bus=0, columnar=False, history=0):
+    """
+    messages holds (name or address, frequency) pairs, or (name or address, frequency, signals) to only decode
+    the listed signals of a message. The counter and checksum of a message are always decoded, so its frames
+    are validated as usual.
+
+    In columnar mode, vl and ts_nanos hold read-only NumPy views over the parser's C++ state instead of
+    per-signal dicts, indexed by the signal slots in self.slots. vl_all holds one array per slot with the values
+    of the last update, copied out of the parser so they stay valid after the next update.
+
+    timing holds the time between accepted frames of each message, by name and address: expected_nanos from
+    the checked frequency, and the observed mean_nanos, jitter_nanos (standard deviation) and max_gap_nanos.
+    They are read from the parser on lookup.
+
+    With history > 0, history holds a MessageHistory per message with the last `history` samples.
+    """
     self.dbc_name = dbc_name
     self.bus = bus
+    self.columnar = columnar
     self.dbc = dbc_lookup(dbc_name)
     if not self.dbc:
       raise RuntimeError(f"Can't find DBC: {dbc_name}")
@@ -36,10 +207,17 @@ cdef class CANParser:
     self.vl = {}
     self.vl_all = {}
     self.ts_nanos = {}
+    self.history = {}
+    self.slots = {}
     self.addresses = set()
+    self.vl_all_updated = set()
+    self.slots_by_bus = vector[int](bus + 1, -1)
+    self.slots_by_bus[bus] = 0
+    self.can_data = vector[vector[CanData]](1)
 
     # Convert message names into addresses and check existence in DBC
     cdef vector[pair[uint32_t, int]] message_v
+    cdef unordered_map[uint32_t, vector[string]] signals
     for i in range(len(messages)):
       c = messages[i]
       try:
@@ -50,16 +228,8 @@ cdef class CANParser:
       address = m.address
       message_v.push_back((address, c[1]))
       self.addresses.add(address)
-
-      name = m.name.decode("utf8")
-      signal_names = [sig.name.decode("utf-8") for sig in (<Msg*>m).sigs]
-
-      self.vl[address] = {name: 0.0 for name in signal_names}
-      self.vl[name] = self.vl[address]
-      self.vl_all[address] = defaultdict(list)
-      self.vl_all[name] = self.vl_all[address]
-      self.ts_nanos[address] = {name: 0.0 for name in signal_names}
-      self.ts_nanos[name] = self.ts_nanos[address]
+      if len(c) > 2:
+        signals[address] = [sig_name.encode("utf-8") for sig_name in c[2]]
 
     cdef string cpp_dbc_name
     if isinstance(dbc_name, str):
@@ -68,7 +238,70 @@ cdef class CANParser:
       cpp_dbc_name = dbc_name  # Assume bytes
     cdef int cpp_bus = bus
     with nogil:
-      self.can = new cpp_CANParser(cpp_bus, cpp_dbc_name, message_v)
+      self.can = new cpp_CANParser(cpp_bus, cpp_dbc_name, message_v, signals)
+
+    cdef MessageState *state
+    self.message_addresses = {}
+    for address in self.addresses:
+      state = self.can.getMessageState(address)
+      name = <unicode>state.name
+      signal_names = [<unicode>state.parse_sigs[j].name for j in range(state.parse_sigs.size())]
+
+      self.slots[address] = {sig_name: i for i, sig_name in enumerate(signal_names)}
+      self.slots[name] = self.slots[address]
+      self.message_addresses[address] = self.message_addresses[name] = address
+      if not self.columnar:
+        self.vl[address] = {sig_name: 0.0 for sig_name in signal_names}
+        self.vl[name] = self.vl[address]
+        self.vl_all[address] = defaultdict(list)
+        self.vl_all[name] = self.vl_all[address]
+        self.ts_nanos[address] = {sig_name: 0.0 for sig_name in signal_names}
+        self.ts_nanos[name] = self.ts_nanos[address]
+
+      if history > 0:
+        self.history[address] = self._init_history(address, history)
+        self.history[name] = self.history[address]
+
+    if self.columnar:
+      for address in self.addresses:
+        self._init_views(address)
+
+  cdef _init_views(self, uint32_t address):
+    cdef MessageState *state = self.can.getMessageState(address)
+    name = <unicode>state.name
+    self.vl[address] = cpp_array(self, state.vals.data(), state.vals.size(), np.float64)
+    self.vl[name] = self.vl[address]
+    self.ts_nanos[address] = cpp_array(self, &state.last_seen_nanos, 1, np.uint64)
+    self.ts_nanos[name] = self.ts_nanos[address]
+    self.vl_all[address] = [np.empty(0, dtype=np.float64)] * state.all_vals.size()
+    self.vl_all[name] = self.vl_all[address]
+
+  cdef MessageHistory _init_history(self, uint32_t address, size_t size):
+    cdef MessageState *state = self.can.getMessageState(address)
+    state.init_history(size)
+    cdef MessageHistory h = MessageHistory.__new__(MessageHistory)
+    h.nanos = cpp_array(self, state.history_nanos.data(), size, np.uint64)
+    h.vals = cpp_array(self, state.history_vals.data(), state.history_vals.size(), np.float64)
+    h.vals = h.vals.reshape(size, state.parse_sigs.size())
+    h.count_view = cpp_array(self, &state.history_count, 1, np.uint64)
+    h.slots = self.slots[address]
+    return h
+
+  def _message_timing(self, uint32_t address):
+    cdef MessageState *state = self.can.getMessageState(address)
+    return {
+      "expected_nanos": state.timing.expected_nanos,
+      "mean_nanos": state.timing.mean_nanos,
+      "jitter_nanos": state.timing.jitter_nanos(),
+      "max_gap_nanos": state.timing.max_gap_nanos,
+    }
+
+  cdef _update_views(self, uint32_t address):
+    cdef MessageState *state = self.can.getMessageState(address)
+    vl_all = self.vl_all[address]
+    for i in range(state.all_vals.size()):
+      # all_vals is cleared and regrown on every update, the arrays must own their data
+      vl_all[i] = cpp_array(self, state.all_vals[i].data(), state.all_vals[i].size(), np.float64).copy()
 
   def __dealloc__(self):
     if self.can:
@@ -76,37 +309,57 @@ cdef class CANParser:
         del self.can
 
   def update_strings(self, strings, sendcan=False):
-    # input format:
-    # [nanos, [[address, data, src], ...]]
-    # [[nanos, [[address, data, src], ...], ...]]
-    for address in self.addresses:
-      self.vl_all[address].clear()
-
-    cdef vector[CanData] can_data_array
-
-    try:
-      if len(strings) and not isinstance(strings[0], (list, tuple)):
-        strings = [strings]
-
-      can_data_array.reserve(len(strings))
-      for s in strings:
-        can_data = &(can_data_array.emplace_back())
-        can_data.nanos = s[0]
-        can_data.frames.reserve(len(s[1]))
-        for address, dat, src in s[1]:
-          source_bus = <uint32_t>src
-          if source_bus == self.bus:
-            frame = &(can_data.frames.emplace_back())
-            frame.address = address
-            frame.dat = dat
-            frame.src = source_bus
-    except TypeError:
-      raise RuntimeError("invalid parameter")
-
+    _buffers = convert_strings(strings, self.slots_by_bus, self.can_data)  # kept alive until the update is done
+    return self._update(self.can_data[0])
+
+  def update_records(self, records):
+    """
+    Same as update_strings, from an array of CAN_RECORD_DTYPE frames instead of Python tuples.
+    Consecutive frames with the same nanos are one frame set.
+    """
+    records = np.ascontiguousarray(records, dtype=CAN_RECORD_DTYPE)
+    cdef const uint8_t[::1] buf = records.view(np.uint8)
+    cdef size_t count = len(records)
+    cdef const CanRecord *ptr = <const CanRecord *>&buf[0] if count else NULL
     with nogil:
-      updated_addrs = self.can.update(can_data_array)
+      records_to_can_data(ptr, count, self.can_data[0])
+    return self._update(self.can_data[0])
+
+  def update_panda(self, nanos, dat):
+    """Same as update_strings, from a buffer of panda USB CAN packets that were all received at nanos"""
+    cdef const uint8_t[::1] buf = dat
+    cdef size_t size = len(buf)
+    cdef const uint8_t *ptr = &buf[0] if size else NULL
+    cdef uint64_t cpp_nanos = nanos
+    cdef size_t parsed
+    with nogil:
+      parsed = panda_to_can_data(cpp_nanos, ptr, size, self.can_data[0])
+    if parsed != size:
+      raise ValueError(f"invalid panda CAN packet at offset {parsed}")
+    return self._update(self.can_data[0])
 
-    for addr in updated_addrs:
+  cdef _update(self, vector[CanData] &can_data_array):
+    self._start_update()
+    with nogil:
+      self.can.update(can_data_array)
+    return self._finish_update(self.can.getUpdated())
+
+  cdef _start_update(self):
+    if not self.columnar:
+      for address in self.addresses:
+        self.vl_all[address].clear()
+
+  cdef _finish_update(self, const vector[uint32_t] &updated_addrs):
+    if self.columnar:
+      # vl and ts_nanos are views, vl_all is copied for the messages that changed
+      updated = set(updated_addrs)
+      for address in updated | self.vl_all_updated:
+        self._update_views(address)
+      self.vl_all_updated = updated
+      return updated
+
+    for j in range(updated_addrs.size()):
+      addr = updated_addrs[j]
       vl = self.vl[addr]
       vl_all = self.vl_all[addr]
       ts_nanos = self.ts_nanos[addr]
@@ -119,7 +372,7 @@ cdef class CANParser:
         vl_all[name] = state.all_vals[i]
         ts_nanos[name] = state.last_seen_nanos
 
-    return updated_addrs
+    return set(updated_addrs)
 
   @property
   def can_valid(self):
@@ -135,13 +388,168 @@ cdef class CANParser:
       timeout = self.can.bus_timeout
     return timeout
 
+  @property
+  def timing(self):
+    return MessageTimings(self, self.message_addresses)
+
+  def stats(self):
+    """Snapshot of the per-message health counters, a MESSAGE_STATS_DTYPE array sorted by address"""
+    cdef vector[MessageStats] stats
+    with nogil:
+      stats = self.can.getStats()
+    return cpp_array(self, stats.data(), stats.size(), MESSAGE_STATS_DTYPE).copy()
+
+  @property
+  def suppressed_logs(self):
+    """Rate limited log messages that were dropped, by format string. Shared by all parsers"""
+    return {(<bytes>fmt).decode(): count for fmt, count in log_suppressed_counts()}
+
+
+cdef class CANParserGroup:
+  """
+  Updates several CANParsers from one batch of frames. Each frame is converted once and only passed
+  to the parsers on its bus, the parsers keep their own vl, can_valid and bus_timeout.
+
+  With threads > 0, batches of at least min_parallel_frames frames are decoded by the parsers in parallel,
+  on that many worker threads besides the calling one. The results are the same as updating them one by one.
+  """
+  cdef:
+    ParserPool *pool
+    vector[int] slots
+    vector[int] parser_slots
+    vector[cpp_CANParser*] cpp_parsers
+    vector[vector[CanData]] can_data
+    size_t min_parallel_frames
+
+  cdef readonly:
+    list parsers
+
+  def __init__(self, parsers, threads=0, min_parallel_frames=1000):
+    self.parsers = [p for p in parsers if p is not None]
+    if len({id(p) for p in self.parsers}) != len(self.parsers):
+      # each parser is updated by one thread, the same parser twice would be updated concurrently
+      raise ValueError("a CANParser can only be in a group once")
+    buses = sorted({(<CANParser>p).bus for p in self.parsers})
+
+    self.slots = vector[int](buses[-1] + 1 if buses else 0, -1)
+    for i, bus in enumerate(buses):
+      self.slots[bus] = i
+    for p in self.parsers:
+      self.parser_slots.push_back(self.slots[(<CANParser>p).bus])
+      self.cpp_parsers.push_back((<CANParser>p).can)
+    self.can_data = vector[vector[CanData]](len(buses))
+    self.min_parallel_frames = min_parallel_frames
+    self.pool = new ParserPool(threads)
+
+  def __dealloc__(self):
+    if self.pool:
+      with nogil:
+        del self.pool
+
+  def update_strings(self, strings):
+    """Same input as CANParser.update_strings, returns the updated addresses for each parser"""
+    _buffers = convert_strings(strings, self.slots, self.can_data)  # kept alive until the update is done
+    for p in self.parsers:
+      (<CANParser>p)._start_update()
+    with nogil:
+      self.pool.update(self.cpp_parsers, self.can_data, self.parser_slots, self.min_parallel_frames)
+    return [(<CANParser>p)._finish_update((<CANParser>p).can.getUpdated()) for p in self.parsers]
+
+  @property
+  def can_valid(self):
+    return all(p.can_valid for p in self.parsers)
+
+  @property
+  def bus_timeout(self):
+    return any(p.bus_timeout for p in self.parsers)
+
+
+cdef dict build_value_table(const DBC *dbc, list indices):
+  cdef const Val *val
+  table = {}
+  for i in indices:
+    val = &dbc.vals[i]
+    defs = {val.defs[j].first: val.defs[j].second.decode("utf8") for j in range(val.defs.size())}
+    table[val.name.decode("utf8")] = defs
+  return table
+
+
+cdef tuple build_value_table_index(const DBC *dbc):
+  cdef const Msg *m
+  cdef const Val *val
+  addresses = {}  # address or message name -> address
+  indices = {}  # address -> indices into the DBC vals
+  for i in range(dbc.vals.size()):
+    val = &dbc.vals[i]
+    address = val.address
+    if address not in indices:
+      try:
+        m = dbc.addr_to_msg.at(address)
+      except IndexError:
+        raise KeyError(address)
+      # two ways to lookup: address or msg name
+      addresses[address] = address
+      addresses[m.name.decode("utf-8")] = address
+      indices[address] = []
+    indices[address].append(i)
+  return addresses, indices
+
+
+# value table index by DBC name, shared by all CANDefines in the process
+value_table_indices = {}
+
+
+class ValueTables(MutableMapping):
+  """
+  Value tables of a DBC, {signal name: {value: definition}} by message address and name.
+  The tables of a message are only built when it's looked up. Each CANDefine has its own tables,
+  which can be changed like the dict this replaced.
+  """
+  def __init__(self, dbc_name):
+    cdef const DBC *dbc = dbc_lookup(dbc_name)
+    index = value_table_indices.get(dbc_name)
+    if index is None:
+      index = value_table_indices[dbc_name] = build_value_table_index(dbc)
+    self.dbc_name = dbc_name
+    self._keys = dict(index[0])  # key -> address, None for tables set by the user
+    self._indices = index[1]
+    self._signals = {}  # address -> signal tables, shared by the address and name keys
+    self._tables = {}
+
+  def __getitem__(self, key):
+    table = self._tables.get(key)
+    if table is None:
+      address = self._keys[key]
+      signals = self._signals.get(address)
+      if signals is None:
+        signals = self._signals[address] = build_value_table(dbc_lookup(self.dbc_name), self._indices[address])
+      table = self._tables[key] = dict(signals)
+    return table
+
+  def __setitem__(self, key, value):
+    self._keys.setdefault(key, None)
+    self._tables[key] = value
+
+  def __delitem__(self, key):
+    del self._keys[key]
+    self._tables.pop(key, None)
+
+  def __iter__(self):
+    return iter(self._keys)
+
+  def __len__(self):
+    return len(self._keys)
+
+  def __repr__(self):
+    return repr(dict(self))
+
 
 cdef class CANDefine():
   cdef:
     const DBC *dbc
 
   cdef public:
-    dict dv
+    object dv
     string dbc_name
 
   def __init__(self, dbc_name):
@@ -150,27 +558,52 @@ cdef class CANDefine():
     if not self.dbc:
       raise RuntimeError(f"Can't find DBC: '{dbc_name}'")
 
-    dv = defaultdict(dict)
+    self.dv = ValueTables(self.dbc_name)
 
-    for i in range(self.dbc[0].vals.size()):
-      val = self.dbc[0].vals[i]
 
-      sgname = val.name.decode("utf8")
-      def_val = val.def_val.decode("utf8")
-      address = val.address
-      try:
-        m = self.dbc.addr_to_msg.at(address)
-      except IndexError:
-        raise KeyError(address)
-      msgname = m.name.decode("utf-8")
+def decode_log(dbc_name, records, bus=0, messages=None, ignore_checksum=False, ignore_counter=False):
+  """
+  Decodes an array of CAN_RECORD_DTYPE frames in one pass with the GIL released. Returns
+  {message name: (nanos, vals, signal names)} for every message with at least one valid frame,
+  where vals has one row per frame and one column per signal.
+  """
+  cdef const DBC *dbc = dbc_lookup(dbc_name)
+  if not dbc:
+    raise RuntimeError(f"Can't find DBC: {dbc_name}")
 
-      # separate definition/value pairs
-      def_val = def_val.split()
-      values = [int(v) for v in def_val[::2]]
-      defs = def_val[1::2]
-
-      # two ways to lookup: address or msg name
-      dv[address][sgname] = dict(zip(values, defs))
-      dv[msgname][sgname] = dv[address][sgname]
-
-    self.dv = dict(dv)
+  cdef vector[uint32_t] addresses
+  for c in (messages or []):
+    try:
+      m = dbc.addr_to_msg.at(c) if isinstance(c, numbers.Number) else dbc.name_to_msg.at(c)
+    except IndexError:
+      raise RuntimeError(f"could not find message {repr(c)} in DBC {dbc_name}")
+    addresses.push_back(m.address)
+
+  records = np.ascontiguousarray(records, dtype=CAN_RECORD_DTYPE)
+  cdef const uint8_t[::1] buf = records.view(np.uint8)
+  cdef size_t count = len(records)
+  cdef const CanRecord *ptr = <const CanRecord *>&buf[0] if count else NULL
+
+  cdef string cpp_dbc_name
+  if isinstance(dbc_name, str):
+    cpp_dbc_name = (<str>dbc_name).encode("utf-8")
+  else:
+    cpp_dbc_name = dbc_name  # Assume bytes
+  cdef int cpp_bus = bus
+  cdef bint cpp_ignore_checksum = ignore_checksum
+  cdef bint cpp_ignore_counter = ignore_counter
+  cdef vector[DecodedMessage] decoded
+  with nogil:
+    decoded = cpp_decode_log(cpp_dbc_name, ptr, count, cpp_bus, addresses, cpp_ignore_checksum, cpp_ignore_counter)
+
+  ret = {}
+  cdef const Msg *msg
+  for i in range(decoded.size()):
+    msg = dbc.addr_to_msg.at(decoded[i].address)
+    signal_names = [sig.name.decode("utf-8") for sig in (<Msg*>msg).sigs]
+    n = decoded[i].nanos.size()
+    nanos = cpp_array(None, decoded[i].nanos.data(), n, np.uint64).copy()
+    vals = cpp_array(None, decoded[i].vals.data(), decoded[i].vals.size(), np.float64)
+    vals = vals.reshape(n, len(signal_names)).copy()
+    ret[msg.name.decode("utf-8")] = (nanos, vals, signal_names)
+  return ret
@@ -0,0 +1,62 @@
+// Counts the C++ heap allocations of CANParser::update, once the parser is warmed up.
+// usage: count_allocations <frames>, prints the number of allocations
+#include <cstdio>
+#include <cstdlib>
+#include <new>
+#include <string>
+#include <utility>
+#include <vector>
+
+#include "opendbc/can/common.h"
+
+static bool counting = false;
+static size_t allocations = 0;
+
+void *operator new(size_t size) {
+  if (counting) allocations++;
+  void *ptr = std::malloc(size ? size : 1);
+  if (ptr == nullptr) throw std::bad_alloc();
+  return ptr;
+}
+
+void operator delete(void *ptr) noexcept { std::free(ptr); }
+void operator delete(void *ptr, size_t) noexcept { std::free(ptr); }
+
+int main(int argc, char **argv) {
+  const size_t frames = argc > 1 ? std::strtoul(argv[1], nullptr, 10) : 1000;
+  const std::string dbc_name = "hyundai_canfd_generated";
+  const uint32_t address = 416;  // SCC_CONTROL, with checksum and counter
+
+  // two batches of consecutive frames: the first one warms up the parser, the second one is counted
+  CANPacker packer(dbc_name);
+  std::vector<std::vector<uint8_t>> dats;
+  for (size_t i = 0; i < 2 * frames; i++) {
+    dats.push_back(packer.pack(address, std::vector<SignalPackValue>{}));
+  }
+
+  std::vector<std::vector<CanData>> batches(2, std::vector<CanData>(frames));
+  for (size_t i = 0; i < 2 * frames; i++) {
+    CanData &can_data = batches[i / frames][i % frames];
+    can_data.nanos = (i + 1) * 20000000ULL;
+    can_data.frames.push_back(CanFrame{0, address, ByteSpan(dats[i].data(), dats[i].size())});
+  }
+
+  CANParser parser(0, dbc_name, {{address, 50}});
+  counting = true;
+  parser.update(batches[0]);
+  const size_t warmup_allocations = std::exchange(allocations, 0);
+  const std::vector<uint32_t> &updated = parser.update(batches[1]);
+  counting = false;
+
+  // the first update grows the parser's buffers, which shows operator new is replaced in libdbc too
+  if (warmup_allocations == 0) {
+    std::fprintf(stderr, "allocations in libdbc are not counted\n");
+    return 1;
+  }
+  if (updated.size() != 1 || parser.getMessageState(address)->stats.accepted != 2 * frames) {
+    std::fprintf(stderr, "frames were not parsed\n");
+    return 1;
+  }
+  std::printf("%zu\n", allocations);
+  return 0;
+}
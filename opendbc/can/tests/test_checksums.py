@@ -1,7 +1,44 @@
 import copy
+import os
+import pytest
+import random
+import re
+import subprocess
+
+from opendbc import DBC_PATH
 from opendbc.can.parser import CANParser
 from opendbc.can.packer import CANPacker
 
+CRC_BIN = os.path.join(os.path.dirname(__file__), 'test_crc')
+
+
+def crc_reference(poly: int, width: int, crc: int, data: bytes) -> int:
+  """Bit by bit MSB-first CRC, without initial value or final XOR"""
+  top = 1 << (width - 1)
+  mask = (1 << width) - 1
+  for b in data:
+    crc ^= b << (width - 8)
+    for _ in range(8):
+      crc = ((crc << 1) ^ poly) & mask if crc & top else (crc << 1) & mask
+  return crc
+
+
+def hkg_can_fd_reference(address: int, dat: bytes) -> int:
+  crc = crc_reference(0x1021, 16, 0, dat[2:] + bytes([address & 0xFF, (address >> 8) & 0xFF]))
+  return crc ^ {8: 0x5f29, 16: 0x041d, 24: 0x819d, 32: 0x9f5b}.get(len(dat), 0)
+
+
+def volkswagen_hca_01_reference(address: int, dat: bytes) -> int:
+  return crc_reference(0x2F, 8, 0xFF, dat[1:] + b'\xda') ^ 0xFF
+
+
+def fca_giorgio_reference(address: int, dat: bytes) -> int:
+  return crc_reference(0x1D, 8, 0, dat[:-1]) ^ {0xDE: 0x10, 0x106: 0xF6, 0x122: 0xF1}.get(address, 0xA)
+
+
+def pedal_reference(address: int, dat: bytes) -> int:
+  return crc_reference(0xD5, 8, 0xFF, dat[-2::-1])
+
 
 class TestCanChecksums:
 
@@ -61,6 +98,40 @@ class TestCanChecksums:
       b'\x7e\x38\x00\x7d\x20\x31\x82\x20',
     ])
 
+  @pytest.mark.skipif(not os.path.isfile(CRC_BIN), reason="test_crc is only built with the test files")
+  @pytest.mark.parametrize("crc", ["8h2f", "j1850", "pedal", "xmodem"])
+  def test_crc_tables(self, crc):
+    """The table driven CRCs match a bit by bit CRC, for every byte value and every (8 bit) or sampled (16 bit) initial value"""
+    result = subprocess.run([CRC_BIN, crc], stdout=subprocess.PIPE, encoding='utf8')
+    assert result.returncode == 0, result.stdout
+
+  def test_crc_reference(self, subtests):
+    """Checksums match a bit by bit reference, over random payloads of every message size"""
+    rng = random.Random(0)
+    crcs = [
+      ("hyundai_canfd_generated", None, hkg_can_fd_reference),
+      ("vw_mqb", "HCA_01", volkswagen_hca_01_reference),
+      ("fca_giorgio", None, fca_giorgio_reference),
+      ("comma_body", None, pedal_reference),
+    ]
+    for dbc_file, msg_name, reference in crcs:
+      with open(os.path.join(DBC_PATH, f"{dbc_file}.dbc")) as f:
+        # byte aligned checksums, 16 bit ones are little endian
+        checksums = re.findall(r"^BO_ \d+ (\w+):[^\n]*\n(?: +SG_ [^\n]*\n)*? +SG_ CHECKSUM : (\d+)\|(\d+)@", f.read(), re.MULTILINE)
+      checksums = [(msg, int(start) // 8, int(size) // 8) for msg, start, size in checksums if msg_name in (None, msg)]
+      assert len(checksums)
+
+      packer = CANPacker(dbc_file)
+      for msg, checksum_start, checksum_size in checksums:
+        template = packer.prepare(msg)
+        with subtests.test(dbc=dbc_file, msg=msg):
+          for _ in range(50):
+            dat = bytearray(template.pack([rng.getrandbits(16) for _ in template.signals]))
+            checksum = int.from_bytes(dat[checksum_start:checksum_start + checksum_size], "little")
+            # checksums are computed with the checksum field cleared
+            dat[checksum_start:checksum_start + checksum_size] = bytes(checksum_size)
+            assert checksum == reference(template.address, bytes(dat))
+
   def test_honda_checksum(self):
     """Test checksums for Honda standard and extended CAN ids"""
     # TODO: refactor to use self.verify_checksum()
@@ -0,0 +1,90 @@
+// Check of CrcEngine against a bit by bit CRC, for one of the CRCs used by the checksums.
+// usage: test_crc <8h2f|j1850|pedal|xmodem>, exits with 1 and prints the first mismatch if any
+#include <cstdint>
+#include <cstdio>
+#include <random>
+#include <string>
+#include <vector>
+
+#include "opendbc/can/crc.h"
+
+template <typename T>
+static T crc_reference(T poly, T crc, uint8_t byte) {
+  constexpr int width = sizeof(T) * 8;
+  crc ^= (T)(byte << (width - 8));
+  for (int i = 0; i < 8; i++) {
+    crc = ((crc >> (width - 1)) & 1) ? (T)((crc << 1) ^ poly) : (T)(crc << 1);
+  }
+  return crc;
+}
+
+// Compares every slicing variant with update(crc, byte) chained over the payload, for each initial value, every
+// byte value and each payload length
+template <typename T>
+static bool check(const char *name, T poly, const std::vector<uint32_t> &inits) {
+  const CrcEngine<T> engine(poly);
+
+  // every register value and byte, so any payload chained through update(crc, byte) matches the reference
+  for (uint32_t crc = 0; crc < (1u << (sizeof(T) * 8)); crc++) {
+    for (int b = 0; b < 256; b++) {
+      if (engine.update((T)crc, (uint8_t)b) != crc_reference(poly, (T)crc, (uint8_t)b)) {
+        std::printf("%s: update(0x%x, 0x%x) mismatch\n", name, crc, b);
+        return false;
+      }
+    }
+  }
+
+  // every path through the slices (up to two 8 byte slices, then every 4 byte and byte remainder),
+  // the HKG CAN FD payloads after the checksum and the longest CAN FD payload
+  const std::vector<size_t> lengths = {0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17,
+                                       18, 22, 30, 46, 62, 64};
+  uint8_t dat[64];
+  for (int b = 0; b < 256; b++) {
+    // shorter payloads are prefixes of longer ones
+    for (size_t i = 0; i < sizeof(dat); i++) {
+      dat[i] = (uint8_t)(b ^ (i * 0x3B));
+    }
+    for (uint32_t init : inits) {
+      T expected = (T)init;
+      size_t chained = 0;
+      for (size_t len : lengths) {
+        for (; chained < len; chained++) {
+          expected = engine.update(expected, dat[chained]);
+        }
+        const T results[] = {engine.template update<8>((T)init, dat, len), engine.template update<4>((T)init, dat, len),
+                             engine.template update<1>((T)init, dat, len)};
+        const int slices[] = {8, 4, 1};
+        for (int v = 0; v < 3; v++) {
+          if (results[v] != expected) {
+            std::printf("%s: slicing-by-%d, length %zu, init 0x%x, byte 0x%x mismatch\n", name, slices[v], len, init, b);
+            return false;
+          }
+        }
+      }
+    }
+  }
+  return true;
+}
+
+int main(int argc, char **argv) {
+  // every initial value of the 8 bit CRCs. For CRC-16, 0, 0xFFFF, every single bit and a fixed random set.
+  std::vector<uint32_t> inits8(256), inits16 = {0x0000, 0xFFFF};
+  for (uint32_t i = 0; i < inits8.size(); i++) {
+    inits8[i] = i;
+  }
+  for (int bit = 0; bit < 16; bit++) {
+    inits16.push_back(1u << bit);
+  }
+  std::mt19937 rng(0);
+  for (int i = 0; i < 64; i++) {
+    inits16.push_back(rng() & 0xFFFF);
+  }
+
+  const std::string crc = argc > 1 ? argv[1] : "";
+  if (crc == "8h2f") return check<uint8_t>("CRC-8 8H2F", 0x2F, inits8) ? 0 : 1;
+  if (crc == "j1850") return check<uint8_t>("CRC-8 SAE-J1850", 0x1D, inits8) ? 0 : 1;
+  if (crc == "pedal") return check<uint8_t>("CRC-8 pedal", 0xD5, inits8) ? 0 : 1;
+  if (crc == "xmodem") return check<uint16_t>("CRC-16 XMODEM", 0x1021, inits16) ? 0 : 1;
+  std::printf("unknown CRC: %s\n", crc.c_str());
+  return 1;
+}
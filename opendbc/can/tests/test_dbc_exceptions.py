@@ -28,3 +28,26 @@ class TestCanParserPackerExceptions:
     CANParser(dbc_file, [], 0)
     CANPacker(dbc_file)
     CANDefine(dbc_file)
+
+  def test_bad_lines(self, tmp_path):
+    bad_lines = [
+      ("BO_ 100 TEST 8 XXX", "bad BO"),
+      ("BO_ 100 TEST: 8 XXX extra", "bad BO"),
+      ('SG_ SIG : 0|8@1+ (1,0) [0|255] XXX', "bad SG"),
+      ('SG_ SIG  : 0|8@1+ (1,0) [0|255] "" XXX', "bad SG"),
+      ('SG_ SIG : 0|8@1* (1,0) [0|255] "" XXX', "bad SG"),
+      ('VAL_ 100 SIG 0 "";', "bad VAL"),
+      ('VAL_ 100 SIG "OFF";', "bad VAL"),
+    ]
+    for i, (line, err) in enumerate(bad_lines):
+      dbc = tmp_path / f"test_{i}.dbc"
+      dbc.write_text(f"BO_ 200 TEST: 8 XXX\n{line}\n")
+      with pytest.raises(RuntimeError, match=rf"\[test_{i}.dbc:2\] {err}: "):
+        CANParser(str(dbc), [], 0)
+
+  def test_bad_val_value(self, tmp_path):
+    dbc = tmp_path / "test_bad_val.dbc"
+    dbc.write_text('BO_ 200 TEST: 8 XXX\n SG_ SIG : 0|8@1+ (1,0) [0|255] "" XXX\nVAL_ 200 SIG 0 "OFF" X "BAD" 2 "ON";\n')
+    for load in (lambda: CANParser(str(dbc), [("TEST", 0)], 0), lambda: CANPacker(str(dbc)), lambda: CANDefine(str(dbc))):
+      with pytest.raises(RuntimeError, match=r"\[test_bad_val.dbc:3\] bad VAL value: "):
+        load()
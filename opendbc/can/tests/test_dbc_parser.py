@@ -1,5 +1,59 @@
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import textwrap
+
+from opendbc import DBC_PATH
 from opendbc.can.parser import CANParser
-from opendbc.can.tests import ALL_DBCS
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
+
+# decodes random frames for every message, so that the digest covers all parsed signal properties
+DIGEST_SCRIPT = textwrap.dedent("""
+  import hashlib, random, re, sys
+  import numpy as np
+  from opendbc.can.parser import CANDefine, CAN_RECORD_DTYPE, decode_log
+
+  digest = hashlib.sha256()
+  for dbc in sys.argv[1:]:
+    with open(dbc) as f:
+      msgs = [(int(a), int(s)) for a, s in re.findall(r"^BO_ (\\w+) \\w+ *: (\\w+)", f.read(), re.MULTILINE)]
+    random.seed(0)
+    records = np.zeros(len(msgs) * 10, dtype=CAN_RECORD_DTYPE)
+    for i, r in enumerate(records):
+      address, size = msgs[i % len(msgs)]
+      r["nanos"], r["address"], r["size"] = i, address, size
+      r["dat"][:size] = [random.randrange(256) for _ in range(size)]
+    decoded = decode_log(dbc, records, ignore_checksum=True, ignore_counter=True)
+    for name in sorted(decoded):
+      nanos, vals, signal_names = decoded[name]
+      digest.update(repr((name, signal_names, nanos.tolist(), vals.tolist())).encode())
+    try:
+      digest.update(repr(sorted(CANDefine(dbc).dv.items(), key=str)).encode())
+    except KeyError as e:
+      digest.update(repr(e).encode())
+  print(digest.hexdigest())
+""")
+
+
+# one DBC for each checksum setup, and some without checksums
+CACHE_TEST_DBCS = [
+  "honda_civic_touring_2016_can_generated", "acura_ilx_2016_nidec", "toyota_new_mc_pt_generated", "hyundai_canfd_generated",
+  "vw_mqb", "vw_meb", "vw_pq", "subaru_global_2017_generated", "chrysler_pacifica_2017_hybrid_generated", "fca_giorgio",
+  "comma_body", "tesla_model3_party", "gm_global_a_powertrain_generated", "ford_lincoln_base_pt", "mazda_2017",
+]
+
+
+def dbc_digest(dbcs, cache_dir=None):
+  env = {**os.environ, "OPENDBC_DBC_CACHE": "0" if cache_dir is None else "1", "OPENDBC_DBC_CACHE_DIR": str(cache_dir)}
+  return subprocess.check_output([sys.executable, "-c", DIGEST_SCRIPT, *dbcs], env=env, text=True).strip()
+
+
+def cache_file(cache_dir):
+  files = list(cache_dir.iterdir())
+  assert len(files) == 1
+  return files[0]
 
 
 class TestDBCParser:
@@ -19,3 +73,85 @@ class TestDBCParser:
     for dbc in ALL_DBCS:
       with subtests.test(dbc=dbc):
         CANParser(dbc, [], 0)
+
+
+class TestDBCCache:
+  def test_cache_matches_parser(self, tmp_path):
+    dbc_dir, cache_dir = tmp_path / "dbc", tmp_path / "cache"
+    dbc_dir.mkdir()
+    dbcs = [shutil.copy(os.path.join(DBC_PATH, f"{dbc}.dbc"), dbc_dir) for dbc in CACHE_TEST_DBCS] + [shutil.copy(TEST_DBC, dbc_dir)]
+
+    expected = dbc_digest(dbcs)
+    assert not cache_dir.exists()
+
+    # first run writes the caches, second one loads them
+    assert dbc_digest(dbcs, cache_dir) == expected
+    assert len(list(cache_dir.iterdir())) == len(dbcs)
+    assert dbc_digest(dbcs, cache_dir) == expected
+    assert sorted(os.listdir(dbc_dir)) == sorted(os.path.basename(dbc) for dbc in dbcs)  # nothing written next to the DBCs
+
+  def test_same_name(self, tmp_path):
+    # DBCs with the same name in different directories have their own caches
+    cache_dir = tmp_path / "cache"
+    dbcs = []
+    for i, size in enumerate((5, 6)):
+      (tmp_path / str(i)).mkdir()
+      dbcs.append(shutil.copy(TEST_DBC, tmp_path / str(i)))
+      with open(dbcs[-1]) as f:
+        content = f.read()
+      with open(dbcs[-1], "w") as f:
+        f.write(content.replace("BO_ 228 STEERING_CONTROL: 5 EON", f"BO_ 228 STEERING_CONTROL: {size} EON"))
+
+    expected = [dbc_digest([dbc]) for dbc in dbcs]
+    assert expected[0] != expected[1]
+    for _ in range(2):
+      assert [dbc_digest([dbc], cache_dir) for dbc in dbcs] == expected
+    assert len(list(cache_dir.iterdir())) == 2
+
+  def test_stale_cache(self, tmp_path):
+    dbc = shutil.copy(TEST_DBC, tmp_path)
+    dbc_digest([dbc], tmp_path / "cache")
+
+    with open(dbc) as f:
+      content = f.read()
+    with open(dbc, "w") as f:
+      f.write(content.replace("BO_ 228 STEERING_CONTROL: 5 EON", "BO_ 228 STEERING_CONTROL: 6 EON"))
+
+    assert dbc_digest([dbc], tmp_path / "cache") == dbc_digest([dbc])
+
+  def test_cache_from_other_build(self, tmp_path):
+    # the header holds the identity of the library that wrote the cache, after the magic, version and DBC hash
+    dbc = shutil.copy(TEST_DBC, tmp_path)
+    expected = dbc_digest([dbc], tmp_path / "cache")
+    cache = cache_file(tmp_path / "cache")
+    data = cache.read_bytes()
+
+    cache.write_bytes(data[:16] + bytes(b ^ 0xFF for b in data[16:24]) + data[24:])
+    assert dbc_digest([dbc], tmp_path / "cache") == expected
+    assert cache.read_bytes() == data
+
+  def test_corrupt_cache(self, tmp_path):
+    dbc = shutil.copy(TEST_DBC, tmp_path)
+    expected = dbc_digest([dbc])
+    dbc_digest([dbc], tmp_path / "cache")
+    cache = cache_file(tmp_path / "cache")
+    data = cache.read_bytes()
+
+    for corrupt in (b"", b"DBCC", os.urandom(1000), data[:-1]):
+      cache.write_bytes(corrupt)
+      assert dbc_digest([dbc], tmp_path / "cache") == expected
+
+  def test_bad_signal_type(self, tmp_path):
+    dbc = tmp_path / "test_signal_type.dbc"
+    dbc.write_text('BO_ 256 MSG: 8 XXX\n SG_ SIG : 0|8@1+ (1,0) [0|255] "" XXX\n')
+    expected = dbc_digest([dbc])
+    dbc_digest([dbc], tmp_path / "cache")
+    cache = cache_file(tmp_path / "cache")
+    data = cache.read_bytes()
+
+    # header, message and signal fields before the signal type
+    offset = 4 + 4 + 8 + 8 + (4 + len(dbc.name)) + 4 + (4 + len("MSG")) + 4 + 4 + 4 + (4 + len("SIG")) + 4 * 4 + 1 + 8 + 8 + 1
+    assert struct.unpack_from("=i", data, offset) == (0,)
+    cache.write_bytes(data[:offset] + struct.pack("=i", 1000) + data[offset + 4:])
+    assert dbc_digest([dbc], tmp_path / "cache") == expected
+    assert cache.read_bytes() == data
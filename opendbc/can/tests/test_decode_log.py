@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+import pytest
+
+from opendbc.can.parser import CANParser, CAN_RECORD_DTYPE, decode_log
+from opendbc.can.packer import CANPacker
+
+DBC_FILE = "honda_civic_touring_2016_can_generated"
+
+
+def to_records(can_strings):
+  records = np.zeros(sum(len(frames) for _, frames in can_strings), dtype=CAN_RECORD_DTYPE)
+  i = 0
+  for nanos, frames in can_strings:
+    for address, dat, src in frames:
+      records[i]["nanos"] = nanos
+      records[i]["address"] = address
+      records[i]["src"] = src
+      records[i]["size"] = len(dat)
+      records[i]["dat"][:len(dat)] = np.frombuffer(dat, dtype=np.uint8)
+      i += 1
+  return records
+
+
+class TestDecodeLog:
+  def test_matches_parser(self):
+    msgs = [("VSA_STATUS", 50), ("POWERTRAIN_DATA", 100), ("STEERING_CONTROL", 0)]
+    parser = CANParser(DBC_FILE, msgs, 0)
+    packer = CANPacker(DBC_FILE)
+
+    can_strings = []
+    for i in range(500):
+      frames = [packer.make_can_msg("VSA_STATUS", random.randint(0, 1), {"USER_BRAKE": random.randrange(100)})]
+      if i % 2 == 0:
+        frames.append(packer.make_can_msg("POWERTRAIN_DATA", 0, {"PEDAL_GAS": random.randrange(100)}))
+      can_strings.append((i * 10_000_000, frames))
+
+    parser.update_strings(can_strings)
+    decoded = decode_log(DBC_FILE, to_records(can_strings), messages=[m for m, _ in msgs])
+
+    # messages without valid frames are left out
+    assert set(decoded) == {"VSA_STATUS", "POWERTRAIN_DATA"}
+    for name, (nanos, vals, signal_names) in decoded.items():
+      assert vals.shape == (len(nanos), len(signal_names))
+      assert nanos[-1] == parser.ts_nanos[name][signal_names[0]]
+      for i, sig in enumerate(signal_names):
+        assert list(vals[:, i]) == parser.vl_all[name][sig]
+
+  def test_bus(self):
+    packer = CANPacker(DBC_FILE)
+    can_strings = [(i, [packer.make_can_msg("VSA_STATUS", i % 3, {})]) for i in range(30)]
+
+    # the packer counter is shared across buses
+    for bus in range(3):
+      nanos, _, _ = decode_log(DBC_FILE, to_records(can_strings), bus=bus, ignore_counter=True)["VSA_STATUS"]
+      assert list(nanos) == list(range(bus, 30, 3))
+
+  def test_checks(self):
+    packer = CANPacker(DBC_FILE)
+    records = to_records([(0, [packer.make_can_msg("VSA_STATUS", 0, {"COUNTER": 0})]) for _ in range(10)])
+    records["dat"][:, 7] ^= 1  # corrupt checksum
+
+    assert decode_log(DBC_FILE, records) == {}
+    assert decode_log(DBC_FILE, records, ignore_checksum=True, ignore_counter=True)["VSA_STATUS"][0].shape == (10,)
+
+  def test_invalid(self):
+    with pytest.raises(RuntimeError):
+      decode_log(DBC_FILE + "abcdef", np.zeros(1, dtype=CAN_RECORD_DTYPE))
+    with pytest.raises(RuntimeError):
+      decode_log(DBC_FILE, np.zeros(1, dtype=CAN_RECORD_DTYPE), messages=["UNKNOWN_MESSAGE"])
+    assert decode_log(DBC_FILE, np.zeros(0, dtype=CAN_RECORD_DTYPE)) == {}
@@ -1,3 +1,5 @@
+import pytest
+
 from opendbc.can.can_define import CANDefine
 from opendbc.can.tests import ALL_DBCS
 
@@ -19,6 +21,29 @@ class TestCANDefine:
                              0: 'NORMAL'}
                             }
 
+  def test_value_tables(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    defs = CANDefine(dbc_file)
+
+    # tables are only built on lookup, the address and name share the signal tables
+    assert defs.dv["GEARBOX"]["GEAR_SHIFTER"] is defs.dv[0x191]["GEAR_SHIFTER"]
+    assert "GEARBOX" in defs.dv and "UNKNOWN_MESSAGE" not in defs.dv
+    assert dict(defs.dv) == {key: defs.dv[key] for key in defs.dv}
+    with pytest.raises(KeyError):
+      defs.dv["UNKNOWN_MESSAGE"]
+
+    # each instance has its own tables, which can be changed
+    defs.dv["STEER_STATUS"]["STEER_STATUS"][8] = "NEW"
+    defs.dv["STEER_STATUS"]["NEW_SIGNAL"] = {}
+    defs.dv["NEW_MESSAGE"] = {"NEW_SIGNAL": {0: "OFF"}}
+    del defs.dv["GEARBOX"]
+    assert defs.dv["STEER_STATUS"]["STEER_STATUS"][8] == "NEW" and "NEW_SIGNAL" in defs.dv["STEER_STATUS"]
+    assert defs.dv["NEW_MESSAGE"] == {"NEW_SIGNAL": {0: "OFF"}} and "GEARBOX" not in defs.dv
+
+    other = CANDefine(dbc_file).dv
+    assert 8 not in other["STEER_STATUS"]["STEER_STATUS"] and "NEW_SIGNAL" not in other["STEER_STATUS"]
+    assert "NEW_MESSAGE" not in other and "GEARBOX" in other
+
   def test_all_dbcs(self, subtests):
     # Asserts no exceptions on all DBCs
     for dbc in ALL_DBCS:
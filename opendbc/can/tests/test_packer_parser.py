@@ -1,11 +1,17 @@
+import functools
+import numpy as np
+import operator
 import pytest
 import random
+import statistics
 
-from opendbc.can.parser import CANParser
+from opendbc.can.parser import CANParser, CANParserGroup, CAN_RECORD_DTYPE, MESSAGE_STATS_DTYPE
 from opendbc.can.packer import CANPacker
 from opendbc.can.tests import TEST_DBC
+from opendbc.safety import LEN_TO_DLC
 
 MAX_BAD_COUNTER = 5
+CAN_INVALID_CNT = 5
 
 
 class TestCanParserPacker:
@@ -68,6 +74,244 @@ class TestCanParserPacker:
       parser.update_strings([t, [msg]])
       assert parser.can_valid
 
+  def test_parser_stats(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    parser = CANParser(dbc_file, [("VSA_STATUS", 50), ("POWERTRAIN_DATA", 100)], 0)
+    packer = CANPacker(dbc_file)
+
+    t = 0
+    for _ in range(10):
+      t += 20_000_000
+      parser.update_strings([t, [packer.make_can_msg("VSA_STATUS", 0, {})]])
+    addr, dat, bus = packer.make_can_msg("VSA_STATUS", 0, {})
+    parser.update_strings([t + 10_000_000, [(addr, dat[:-1] + bytes([dat[-1] ^ 1]), bus)]])
+    parser.update_strings([t + 20_000_000, [packer.make_can_msg("VSA_STATUS", 0, {"COUNTER": 0})]])
+    parser.update_strings([t + 30_000_000, [(addr, bytes(65), bus)]])
+    parser.update_strings([t + 1_000_000_000, []])
+
+    stats = parser.stats()
+    assert stats.dtype == MESSAGE_STATS_DTYPE
+    assert list(stats["address"]) == [0x17c, 0x1a4]
+    assert stats[0]["frames"] == 0 and stats[0]["timeouts"] == 0
+    vsa = stats[1]
+    assert vsa["frames"] == 13
+    assert vsa["accepted"] == 11  # a single counter jump is tolerated
+    assert vsa["checksum_failures"] == 1
+    assert vsa["counter_failures"] == 1
+    assert vsa["oversize"] == 1
+    assert vsa["timeouts"] == 1
+    assert vsa["last_interval_nanos"] == 20_000_000
+
+  def test_parser_timing(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    for columnar in (False, True):
+      parser = CANParser(dbc_file, [("VSA_STATUS", 50)], 0, columnar=columnar)
+      assert set(parser.timing) == {"VSA_STATUS", 0x1a4}
+      assert parser.timing["VSA_STATUS"] == parser.timing[0x1a4]
+      assert parser.timing["VSA_STATUS"] == {"expected_nanos": 20_000_000, "mean_nanos": 0, "jitter_nanos": 0, "max_gap_nanos": 0}
+
+      t, intervals = 1_000_000_000, []
+      for i in range(100):
+        intervals.append(random.choice([19_000_000, 20_000_000, 21_000_000]) if i else 0)
+        t += intervals[-1]
+        parser.update_strings([t, [packer.make_can_msg("VSA_STATUS", 0, {})]])
+
+      timing = parser.timing["VSA_STATUS"]
+      assert timing["mean_nanos"] == pytest.approx(statistics.mean(intervals[1:]))
+      assert timing["jitter_nanos"] == pytest.approx(statistics.stdev(intervals[1:]))
+      assert timing["max_gap_nanos"] == max(intervals)
+
+  def test_parser_history(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    for columnar in (False, True):
+      parser = CANParser(dbc_file, [("VSA_STATUS", 50)], 0, columnar=columnar, history=8)
+      history = parser.history["VSA_STATUS"]
+      assert history is parser.history[0x1a4]
+      assert history.count == 0 and history.ordered()[0].shape == (0,)
+
+      # samples are kept across updates, also when one update has more samples than fit
+      brakes = []
+      for n in (3, 1, 10, 2):
+        can_strings = []
+        for _ in range(n):
+          brakes.append(random.randrange(100))
+          can_strings.append([len(brakes) * 10_000_000, [packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": brakes[-1]})]])
+        parser.update_strings(can_strings)
+
+        nanos, vals = history.ordered()
+        expected = brakes[-8:]
+        assert history.count == len(brakes)
+        assert list(nanos) == [i * 10_000_000 for i in range(len(brakes) - len(expected) + 1, len(brakes) + 1)]
+        assert list(vals[:, history.slots["USER_BRAKE"]]) == pytest.approx(expected)
+
+  def test_parser_signal_subset(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    for columnar in (False, True):
+      parser = CANParser(dbc_file, [("VSA_STATUS", 50, ["USER_BRAKE"]), ("POWERTRAIN_DATA", 100)], 0, columnar=columnar)
+      full = CANParser(dbc_file, [("VSA_STATUS", 50), ("POWERTRAIN_DATA", 100)], 0)
+
+      # the counter and checksum are always decoded
+      assert set(parser.slots["VSA_STATUS"]) == {"USER_BRAKE", "COUNTER", "CHECKSUM"}
+      assert set(parser.slots["POWERTRAIN_DATA"]) == set(full.vl["POWERTRAIN_DATA"])
+
+      for i in range(10):
+        can_strings = [(i + 1) * 10_000_000, [
+          packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": i, "ESP_DISABLED": 1}),
+          packer.make_can_msg("POWERTRAIN_DATA", 0, {"PEDAL_GAS": i}),
+        ]]
+        parser.update_strings([can_strings])
+        full.update_strings([can_strings])
+        for name, slot in parser.slots["VSA_STATUS"].items():
+          assert parser.vl["VSA_STATUS"][slot if columnar else name] == full.vl["VSA_STATUS"][name]
+      assert parser.can_valid
+
+      # frames with a bad checksum are still rejected
+      addr, dat, bus = packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": 50})
+      assert parser.update_strings([[20 * 10_000_000, [(addr, dat[:-1] + bytes([dat[-1] ^ 1]), bus)]]]) == set()
+
+    with pytest.raises(RuntimeError):
+      CANParser(dbc_file, [("VSA_STATUS", 50, ["UNKNOWN_SIGNAL"])], 0)
+
+  def test_parser_packed_input(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("VSA_STATUS", 50), ("POWERTRAIN_DATA", 100)]
+    packer = CANPacker(dbc_file)
+
+    def panda_packet(address, dat, bus):
+      header = bytearray([(LEN_TO_DLC[len(dat)] << 4) | (bus << 1)]) + (address << 3).to_bytes(4, "little") + b"\x00"
+      packet = header + dat
+      packet[5] = functools.reduce(operator.xor, packet)
+      return bytes(packet)
+
+    can_strings = []
+    for i in range(50):
+      frames = [packer.make_can_msg("VSA_STATUS", i % 2, {"USER_BRAKE": i}), packer.make_can_msg("POWERTRAIN_DATA", 0, {"PEDAL_GAS": i})]
+      can_strings.append([(i + 1) * 10_000_000, frames])
+
+    parser = CANParser(dbc_file, msgs, 0)
+    records_parser = CANParser(dbc_file, msgs, 0)
+    panda_parser = CANParser(dbc_file, msgs, 0)
+    for strings in (can_strings[:1], can_strings[1:10], [], can_strings[10:]):
+      records = np.zeros(sum(len(frames) for _, frames in strings), dtype=CAN_RECORD_DTYPE)
+      for i, (nanos, address, dat, src) in enumerate((nanos, *f) for nanos, frames in strings for f in frames):
+        records[i] = (nanos, address, src, len(dat), np.frombuffer(dat.ljust(64, b"\x00"), dtype=np.uint8))
+
+      updated = parser.update_strings(strings)
+      assert records_parser.update_records(records) == updated
+      for nanos, frames in strings:
+        panda_parser.update_panda(nanos, b"".join(panda_packet(*f) for f in frames))
+      for p in (records_parser, panda_parser):
+        assert p.vl == parser.vl
+        assert p.ts_nanos == parser.ts_nanos
+        assert p.can_valid == parser.can_valid
+
+    # truncated or corrupt packets are rejected
+    packet = panda_packet(*packer.make_can_msg("VSA_STATUS", 0, {}))
+    for dat in (packet[:-1], packet[:-1] + bytes([packet[-1] ^ 1])):
+      with pytest.raises(ValueError):
+        panda_parser.update_panda(10**9, dat)
+
+  def test_parser_log_rate_limit(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    parser = CANParser(dbc_file, [("VSA_STATUS", 50)], 0)
+    packer = CANPacker(dbc_file)
+
+    def checks_failed():
+      return sum(count for fmt, count in parser.suppressed_logs.items() if "checks failed" in fmt)
+
+    # a storm of bad checksums only logs bursts, the rest are counted
+    suppressed = checks_failed()
+    for i in range(1000):
+      addr, dat, bus = packer.make_can_msg("VSA_STATUS", 0, {})
+      parser.update_strings([i * 10_000_000, [(addr, dat[:-1] + bytes([dat[-1] ^ 1]), bus)]])
+    assert checks_failed() - suppressed > 900
+
+  def test_parser_can_valid_timeout(self):
+    msgs = [("CAN_FD_MESSAGE", 10), ("STEERING_CONTROL", 100)]
+    packer = CANPacker(TEST_DBC)
+    parser = CANParser(TEST_DBC, msgs, 0)
+
+    def send(t, names):
+      return parser.update_strings([int(t * 1e9), [packer.make_can_msg(name, 0, {}) for name in names]])
+
+    # both messages at their rates
+    for i in range(1, 200):
+      send(0.01 * i, ["STEERING_CONTROL"] + (["CAN_FD_MESSAGE"] if i % 10 == 0 else []))
+      assert parser.can_valid == (i >= 10)
+
+    # CAN_FD_MESSAGE times out after 10 missed frames, invalid for CAN_INVALID_CNT updates
+    for i in range(200, 400):
+      send(0.01 * i, ["STEERING_CONTROL"])
+      assert parser.can_valid == (i < 290 + CAN_INVALID_CNT)
+
+    # recovers once seen again
+    send(4.0, ["STEERING_CONTROL", "CAN_FD_MESSAGE"])
+    assert parser.can_valid
+    assert list(parser.stats()["timeouts"]) == [0, 1]  # STEERING_CONTROL, CAN_FD_MESSAGE
+
+    # time going backwards is treated as a timeout for messages seen later
+    send(3.0, ["STEERING_CONTROL"])
+    for i in range(1, 100):
+      send(3.0 + 0.01 * i, ["STEERING_CONTROL"])
+      assert parser.can_valid == (i < CAN_INVALID_CNT - 1)
+
+    # until they're seen again
+    send(4.0, ["STEERING_CONTROL", "CAN_FD_MESSAGE"])
+    for i in range(1, 50):
+      send(4.0 + 0.01 * i, ["STEERING_CONTROL"] + (["CAN_FD_MESSAGE"] if i % 10 == 0 else []))
+      assert parser.can_valid
+
+    # timeouts found by the full scan and the rebuild after time went backwards are counted once
+    assert list(parser.stats()["timeouts"]) == [0, 2]
+
+  def test_parser_group(self, subtests):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("VSA_STATUS", 50), ("POWERTRAIN_DATA", 100)]
+
+    # threads=2 with no minimum batch size always updates the parsers in parallel
+    for threads in (0, 2):
+      with subtests.test(threads=threads):
+        packers = {bus: CANPacker(dbc_file) for bus in range(3)}
+
+        # two parsers on bus 0, one on bus 2 and nothing listening on bus 1
+        buses = (0, 0, 2)
+        parsers = [CANParser(dbc_file, msgs, bus) for bus in buses]
+        group_parsers = [CANParser(dbc_file, msgs, bus) for bus in buses]
+        group = CANParserGroup(group_parsers + [None], threads=threads, min_parallel_frames=0)
+        assert group.parsers == group_parsers
+
+        for i in range(200):
+          frames = []
+          for bus in (0, 1, 2):
+            if i < 100 or bus != 2:
+              frames.append(packers[bus].make_can_msg("VSA_STATUS", bus, {"USER_BRAKE": i + bus}))
+              frames.append(packers[bus].make_can_msg("POWERTRAIN_DATA", bus, {"PEDAL_GAS": i + bus}))
+          strings = [int(i * 1e7), frames]
+
+          updated = group.update_strings(strings)
+          assert updated == [p.update_strings(strings) for p in parsers]
+          for p, gp in zip(parsers, group_parsers, strict=True):
+            assert gp.vl == p.vl
+            assert gp.vl_all == p.vl_all
+            assert gp.ts_nanos == p.ts_nanos
+            assert (gp.can_valid, gp.bus_timeout) == (p.can_valid, p.bus_timeout)
+
+          assert group.can_valid == all(p.can_valid for p in parsers)
+          assert group.bus_timeout == any(p.bus_timeout for p in parsers)
+          if i == 99:
+            assert group.can_valid and not group.bus_timeout
+
+        # bus 2 stopped sending
+        assert not group.can_valid and group.bus_timeout
+
+  def test_parser_group_duplicate(self):
+    parser = CANParser("honda_civic_touring_2016_can_generated", [("VSA_STATUS", 50)], 0)
+    with pytest.raises(ValueError):
+      CANParserGroup([parser, None, parser], threads=2)
+
   def test_parser_updated_list(self):
     msgs = [("CAN_FD_MESSAGE", 10), ]
     parser = CANParser(TEST_DBC, msgs, 0)
@@ -176,6 +420,56 @@ class TestCanParserPacker:
         for sig in ("STEER_TORQUE", "STEER_TORQUE_REQUEST", "COUNTER", "CHECKSUM"):
           assert parser.vl["STEERING_CONTROL"][sig] == parser.vl[228][sig]
 
+  def test_packer_prepare(self, subtests):
+    msgs = [
+      ("honda_civic_touring_2016_can_generated", "STEERING_CONTROL", True),
+      ("toyota_nodsu_pt_generated", "ACC_CONTROL", False),
+      ("vw_mqb", "HCA_01", True),
+      (TEST_DBC, "CAN_FD_MESSAGE", True),
+    ]
+    for dbc_file, msg, has_counter in msgs:
+      with subtests.test(dbc=dbc_file, msg=msg):
+        packer = CANPacker(dbc_file)
+        template_packer = CANPacker(dbc_file)
+        template = template_packer.prepare(msg)
+        assert template_packer.prepare(template.address).signals == template.signals
+        assert "COUNTER" not in template.signals and "CHECKSUM" not in template.signals
+        assert template.slots == {sig: i for i, sig in enumerate(template.signals)}
+
+        # counter and checksum are filled in like make_can_msg
+        for _ in range(20):
+          values = [random.randint(0, 1) for _ in template.signals]
+          assert template.make_can_msg(1, values) == packer.make_can_msg(msg, 1, dict(zip(template.signals, values, strict=True)))
+
+        # explicit counter
+        if not has_counter:
+          continue
+        template = template_packer.prepare(msg, [template.signals[0], "COUNTER"])
+        assert template.pack([1, 2]) == packer.make_can_msg(msg, 0, {template.signals[0]: 1, "COUNTER": 2})[1]
+
+  def test_packer_prepare_invalid(self):
+    packer = CANPacker(TEST_DBC)
+    with pytest.raises(RuntimeError):
+      packer.prepare("UNKNOWN_MESSAGE")
+    with pytest.raises(RuntimeError):
+      packer.prepare("CAN_FD_MESSAGE", ["UNKNOWN_SIGNAL"])
+    with pytest.raises(ValueError):
+      packer.prepare("CAN_FD_MESSAGE", ["SIGNED"]).pack([1, 2])
+
+  def test_packer_make_can_msgs(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    batch_packer = CANPacker(dbc_file)
+
+    for _ in range(10):
+      msgs = [("STEERING_CONTROL", 0, {"STEER_TORQUE": random.randint(-100, 100), "STEER_TORQUE_REQUEST": 1}),
+              (0x1a4, 1, {"USER_BRAKE": random.randrange(100)}),
+              ("UNKNOWN_MESSAGE", 2, {}),
+              ("POWERTRAIN_DATA", 0, {})]
+      # fewer values than the previous batch still packs the right signals
+      msgs = msgs[:random.randint(0, len(msgs))]
+      assert batch_packer.make_can_msgs(msgs) == [packer.make_can_msg(*msg) for msg in msgs]
+
   def test_scale_offset(self):
     """Test that both scale and offset are correctly preserved"""
     dbc_file = "honda_civic_touring_2016_can_generated"
@@ -284,6 +578,44 @@ class TestCanParserPacker:
       if len(user_brake_vals):
         assert vl_all[-1] == parser.vl["VSA_STATUS"]["USER_BRAKE"]
 
+  def test_columnar(self):
+    """Test the columnar mode views match the dict outputs"""
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    msgs = [("VSA_STATUS", 50), ("POWERTRAIN_DATA", 100)]
+    parser = CANParser(dbc_file, msgs, 0)
+    columnar_parser = CANParser(dbc_file, msgs, 0, columnar=True)
+    packer = CANPacker(dbc_file)
+
+    vl = columnar_parser.vl["VSA_STATUS"]
+    slots = columnar_parser.slots["VSA_STATUS"]
+    assert columnar_parser.slots[420] is slots
+    with pytest.raises(ValueError):
+      vl[0] = 1
+
+    for i in range(10):
+      can_strings = [[i * 10, [packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": brake})]] for brake in range(i)]
+      assert parser.update_strings(can_strings) == columnar_parser.update_strings(can_strings)
+
+      # vl and ts_nanos views are updated in place
+      assert columnar_parser.vl["VSA_STATUS"] is vl
+      for name, slot in slots.items():
+        assert vl[slot] == parser.vl["VSA_STATUS"][name]
+        assert list(columnar_parser.vl_all["VSA_STATUS"][slot]) == parser.vl_all["VSA_STATUS"][name]
+        assert columnar_parser.ts_nanos["VSA_STATUS"][0] == parser.ts_nanos["VSA_STATUS"][name]
+      assert len(columnar_parser.vl_all["POWERTRAIN_DATA"][0]) == 0
+
+    # vl_all arrays own their data, and are still valid after later updates
+    vl_all = columnar_parser.vl_all["VSA_STATUS"][slots["USER_BRAKE"]]
+    assert vl_all.flags.owndata
+    expected = list(vl_all)
+    for i in range(500):
+      columnar_parser.update_strings([[(100 + i) * 10, [packer.make_can_msg("VSA_STATUS", 0, {"USER_BRAKE": j}) for j in range(10)]]])
+    assert list(vl_all) == expected
+
+    # views keep the parser alive
+    del columnar_parser
+    assert vl[slots["USER_BRAKE"]] == 9
+
   def test_timestamp_nanos(self):
     """Test message timestamp dict"""
     dbc_file = "honda_civic_touring_2016_can_generated"
@@ -329,6 +661,28 @@ class TestCanParserPacker:
         new_msg = msg + "1" if isinstance(msg, str) else msg + 1
         CANParser(TEST_DBC, [(new_msg, 0)])
 
+  def test_extended_addresses(self):
+    dbc_file = "vw_mqb"
+    msgs = [("LH_EPS_03", 0), ("KN_Airbag_01", 0), ("NMH_Gateway", 0)]
+    parser = CANParser(dbc_file, msgs, 0)
+    packer = CANPacker(dbc_file)
+
+    for i in range(10):
+      values = {
+        "KN_Airbag_01": {"Airbag_01_Nachlauftyp": i},
+        "NMH_Gateway": {"NM_Gateway_Wakeup": i * 2},
+      }
+      frames = [packer.make_can_msg(k, 0, v) for k, v in values.items()]
+      # unsubscribed standard and extended addresses around the subscribed ones
+      frames += [(addr, b"\xff" * 8, 0) for addr in (0, 0x7ff, 0x800, 2549088276, 2549088278, 0x1fffffff)]
+      updated = parser.update_strings([0, frames])
+
+      assert updated == {2549088277, 2600468496}
+      for k, v in values.items():
+        for key, val in v.items():
+          assert parser.vl[k][key] == pytest.approx(val)
+    assert parser.vl["LH_EPS_03"]["EPS_HCA_Status"] == 0
+
   def test_track_all_signals(self):
     parser = CANParser("toyota_nodsu_pt_generated", [("ACC_CONTROL", 0)])
     assert parser.vl["ACC_CONTROL"] == {
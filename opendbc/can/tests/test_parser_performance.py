@@ -1,20 +1,73 @@
+import os
 import pytest
+import subprocess
+import sys
 import time
+import tracemalloc
 
-from opendbc.can.parser import CANParser
+from opendbc.can.parser import CANParser, CANParserGroup
 from opendbc.can.packer import CANPacker
 
 
+ALLOCATIONS_BIN = os.path.join(os.path.dirname(__file__), 'count_allocations')
+
+
+class TestParserAllocations:
+  @pytest.mark.skipif(not os.path.isfile(ALLOCATIONS_BIN), reason="count_allocations is only built with the test files")
+  @pytest.mark.parametrize("frames", [10, 10000])
+  def test_cpp_update_allocations(self, frames):
+    # counts calls to operator new in CANParser::update, once the parser's buffers have grown
+    allocations = int(subprocess.check_output([ALLOCATIONS_BIN, str(frames)], encoding='utf8'))
+    assert allocations == 0
+
+  def test_update_allocations(self):
+    # tracemalloc only sees Python allocations: frames are parsed straight from the bytes objects,
+    # so the Python side of update_strings doesn't allocate per frame
+    dbc = 'hyundai_canfd_generated'
+    parser = CANParser(dbc, [('SCC_CONTROL', 50)], 0, columnar=True)
+    packer = CANPacker(dbc)
+    can_msgs = [[int(0.02 * i * 1e9), [packer.make_can_msg('SCC_CONTROL', 0, {})]] for i in range(20000)]
+    parser.update_strings(can_msgs[:10000])
+
+    peaks = {}
+    for n in (10, 10000):
+      strings = can_msgs[10000:10000 + n]
+      tracemalloc.start()
+      parser.update_strings(strings)
+      peaks[n] = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    print(f'peak traced memory per update: {peaks}')
+    # only the vl_all arrays, copied out of the parser, and the list of frame buffers grow with the frame count
+    grown_size = (8 * len(parser.slots['SCC_CONTROL']) + 16) * (10000 - 10)
+    assert peaks[10000] - peaks[10] < grown_size + 1024
+
+  def test_update_keeps_buffers_alive(self):
+    # frames point into the data buffers until the update is done, including ones only referenced by the input
+    dbc = 'honda_civic_touring_2016_can_generated'
+    parser = CANParser(dbc, [('VSA_STATUS', 50)], 0)
+    packer = CANPacker(dbc)
+
+    def frames(i):
+      yield (0x1a4, bytes(packer.make_can_msg('VSA_STATUS', 0, {'USER_BRAKE': i})[1]), 0)
+
+    for i in range(1, 100):
+      with pytest.raises(RuntimeError):
+        parser.update_strings([[i * 20_000_000, frames(i)]])
+      parser.update_strings([[i * 20_000_000, [(0x1a4, bytearray(packer.make_can_msg('VSA_STATUS', 0, {'USER_BRAKE': i})[1]), 0)]]])
+      assert parser.vl['VSA_STATUS']['USER_BRAKE'] == i
+
+
 @pytest.mark.skip("TODO: varies too much between machines")
 class TestParser:
-  def _benchmark(self, checks, thresholds, n):
-    parser = CANParser('toyota_new_mc_pt_generated', checks, 0)
-    packer = CANPacker('toyota_new_mc_pt_generated')
+  def _benchmark(self, checks, thresholds, n, dbc='toyota_new_mc_pt_generated', values=None):
+    parser = CANParser(dbc, checks, 0)
+    packer = CANPacker(dbc)
+    if values is None:
+      values = {"ACC_CONTROL": {"ACC_TYPE": 1, "ALLOW_LONG_PRESS": 3}}
 
     t1 = time.process_time_ns()
     can_msgs = []
     for i in range(50000):
-      values = {"ACC_CONTROL": {"ACC_TYPE": 1, "ALLOW_LONG_PRESS": 3}}
       msgs = [packer.make_can_msg(k, 0, v) for k, v in values.items()]
       can_msgs.append([int(0.01 * i * 1e9), msgs])
     t2 = time.process_time_ns()
@@ -40,7 +93,7 @@ class TestParser:
 
     et = sum(ets) / len(ets)
     avg_nanos = et / len(can_msgs)
-    print('%s: [%d] %.1fms to parse %s, avg: %dns' % (self._testMethodName, n, et/1e6, len(can_msgs), avg_nanos))
+    print('%s: [%d] %.1fms to parse %s, avg: %dns' % (dbc, n, et/1e6, len(can_msgs), avg_nanos))
 
     minn, maxx = thresholds
     assert avg_nanos < maxx
@@ -49,3 +102,63 @@ class TestParser:
   def test_performance_all_signals(self):
     self._benchmark([('ACC_CONTROL', 10)], (10000, 19000), 1)
     self._benchmark([('ACC_CONTROL', 10)], (1300, 5000), 10)
+
+  def test_performance_can_fd(self):
+    # wide CAN-FD message, most signals are decoded with a single shift-and-mask
+    values = {"SCC_CONTROL": {"aReqValue": 1.5, "VSetDis": 100, "ACCMode": 1}}
+    self._benchmark([('SCC_CONTROL', 50)], (5000, 25000), 1, 'hyundai_canfd_generated', values)
+    self._benchmark([('SCC_CONTROL', 50)], (1000, 10000), 10, 'hyundai_canfd_generated', values)
+
+  def test_performance_checksums(self):
+    # one CRC checked message per checksum algorithm, the parse time is dominated by the CRC
+    crcs = [
+      ('hyundai_canfd_generated', 'SCC_CONTROL', (1000, 5000)),  # CRC16 XMODEM over 32 bytes
+      ('vw_mqb', 'HCA_01', (300, 3000)),  # CRC8 8H2F
+      ('fca_giorgio', 'EPS_2', (300, 3000)),  # CRC8 J1850
+      ('comma_body', 'MOTORS_DATA', (300, 3000)),  # pedal CRC8
+    ]
+    for dbc, msg, thresholds in crcs:
+      self._benchmark([(msg, 0)], thresholds, 10, dbc, {msg: {}})
+
+  def test_performance_parallel_group(self):
+    # replay of a segment with three busy buses, updated in batches of 100 frame sets
+    dbc = 'hyundai_canfd_generated'
+    msgs = [('SCC_CONTROL', 0), ('LKAS', 0)] + [(f'RADAR_0x{addr:x}', 0) for addr in range(0x210, 0x220)]
+    packers = [CANPacker(dbc) for _ in range(3)]
+    can_msgs = []
+    for i in range(5000):
+      can_msgs.append([int(0.01 * (i + 1) * 1e9), [packers[bus].make_can_msg(m, bus, {}) for bus in range(3) for m, _ in msgs]])
+    strings = [can_msgs[i:i + 100] for i in range(0, len(can_msgs), 100)]
+
+    results, ets = {}, {}
+    for threads in (0, 2):
+      group = CANParserGroup([CANParser(dbc, msgs, bus) for bus in range(3)], threads=threads)
+      t1 = time.perf_counter_ns()
+      results[threads] = [group.update_strings(m) for m in strings]
+      ets[threads] = time.perf_counter_ns() - t1
+      print('%d worker threads: %.1fms to parse %d frame sets' % (threads, ets[threads] / 1e6, len(can_msgs)))
+
+    assert results[0] == results[2]
+    if os.cpu_count() >= 3:
+      assert ets[2] < 0.8 * ets[0]
+
+  def test_performance_dbc_parse(self):
+    # parse every DBC from text in a fresh process, bypassing the DBC cache. The std::regex parser
+    # this replaced took ~370ms on a machine where this takes ~120ms.
+    script = """
+import time
+from opendbc.can.parser import CANParser
+from opendbc.can.tests import ALL_DBCS
+t = time.process_time_ns()
+for dbc in ALL_DBCS:
+  CANParser(dbc, [], 0)
+print(time.process_time_ns() - t)
+"""
+    env = {**os.environ, "OPENDBC_DBC_CACHE": "0"}
+    ets = [int(subprocess.check_output([sys.executable, "-c", script], env=env)) for _ in range(5)]
+    et = sorted(ets)[len(ets) // 2]
+    print('parsed all DBCs in %.1fms' % (et / 1e6))
+
+    minn, maxx = (50e6, 200e6)
+    assert et < maxx
+    assert et > minn, "Performance seems to have improved, update test thresholds."
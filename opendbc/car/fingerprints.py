@@ -1,3 +1,6 @@
+from collections import defaultdict
+from functools import cache
+
 from opendbc.car.interfaces import get_interface_attr
 from opendbc.car.body.values import CAR as BODY
 from opendbc.car.chrysler.values import CAR as CHRYSLER
@@ -24,6 +27,44 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+class FingerprintIndex:
+  """Candidate cars as a bitset, bit i is set if cars[i] is still a candidate"""
+  def __init__(self, fingerprints: dict[str, list[dict[int, int]]]):
+    self.cars = list(fingerprints)
+    self.bits = {car: i for i, car in enumerate(self.cars)}
+    self.all_cars = (1 << len(self.cars)) - 1
+
+    # cars with any fingerprint that has the (address, length)
+    masks: defaultdict[tuple[int, int], int] = defaultdict(int)
+    for car, car_fingerprints in fingerprints.items():
+      for fingerprint in car_fingerprints:
+        # add alien debug address
+        for address, length in (fingerprint | _DEBUG_ADDRESS).items():
+          masks[(address, length)] |= 1 << self.bits[car]
+    self.masks = dict(masks)
+
+  def compatible(self, msg) -> int:
+    """Returns the cars that could have sent msg"""
+    # ignore addresses that are more than 11 bits
+    if msg.address >= 0x800:
+      return self.all_cars
+    return self.masks.get((msg.address, len(msg.dat)), 0)
+
+  def to_cars(self, candidates: int) -> list[str]:
+    return [car for i, car in enumerate(self.cars) if candidates >> i & 1]
+
+  def single_car(self, candidates: int) -> str | None:
+    """Returns the only candidate, if exactly one is left"""
+    if candidates == 0 or candidates & (candidates - 1):
+      return None
+    return self.cars[candidates.bit_length() - 1]
+
+
+@cache
+def get_fingerprint_index() -> FingerprintIndex:
+  return FingerprintIndex(_FINGERPRINTS)
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -34,18 +75,9 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  index = get_fingerprint_index()
+  compatible = index.compatible(msg)
+  return [car_name for car_name in candidate_cars if compatible >> index.bits[car_name] & 1]
 
 
 def all_legacy_fingerprint_cars():
@@ -0,0 +1,128 @@
+import contextlib
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Protocol
+
+from opendbc.car.carlog import carlog
+from opendbc.car.fw_query_definitions import EcuAddrBusType
+from opendbc.car.structs import CarParams
+
+FW_CACHE_VERSION = 1
+FW_CACHE_MAX_AGE = 60 * 60 * 24 * 90  # seconds, entries are queried again after this
+
+
+@dataclass
+class FwCacheEntry:
+  vin: str
+  ecu_rx_addrs: set[EcuAddrBusType]
+  car_fw: list[CarParams.CarFw]
+  timestamp: float = field(default_factory=time.time)
+
+
+class FwCache(Protocol):
+  def load(self, vin: str) -> FwCacheEntry | None:
+    ...
+
+  def store(self, entry: FwCacheEntry) -> None:
+    ...
+
+
+def car_fw_to_dict(f: CarParams.CarFw) -> dict:
+  return {
+    'ecu': str(f.ecu),
+    'fwVersion': f.fwVersion.hex(),
+    'address': f.address,
+    'subAddress': f.subAddress,
+    'responseAddress': f.responseAddress,
+    'request': [r.hex() for r in f.request],
+    'brand': f.brand,
+    'bus': f.bus,
+    'logging': f.logging,
+    'obdMultiplexing': f.obdMultiplexing,
+  }
+
+
+def car_fw_from_dict(d: dict) -> CarParams.CarFw:
+  return CarParams.CarFw(ecu=d['ecu'], fwVersion=bytes.fromhex(d['fwVersion']), address=d['address'], subAddress=d['subAddress'],
+                         responseAddress=d['responseAddress'], request=[bytes.fromhex(r) for r in d['request']], brand=d['brand'],
+                         bus=d['bus'], logging=d['logging'], obdMultiplexing=d['obdMultiplexing'])
+
+
+class FileFwCache:
+  """
+  Stores the FW versions and present ECUs of each VIN in a JSON file. The file is replaced atomically on write,
+  so a crash leaves either the old or the new cache. Unreadable files, files with another schema version and
+  invalid entries are ignored. Entries older than max_age are ignored and removed on the next write.
+  """
+  def __init__(self, path: str, max_age: float = FW_CACHE_MAX_AGE):
+    self.path = path
+    self.max_age = max_age
+
+  def _read(self) -> dict[str, dict]:
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except FileNotFoundError:
+      return {}
+    except (OSError, ValueError):
+      carlog.exception("Failed to read FW cache")
+      return {}
+
+    if not isinstance(data, dict) or data.get('version') != FW_CACHE_VERSION:
+      carlog.warning("Ignoring FW cache with a different schema version")
+      return {}
+
+    entries = data.get('entries')
+    if not isinstance(entries, dict):
+      carlog.warning("Ignoring FW cache without entries")
+      return {}
+
+    now = time.time()
+    return {vin: entry for vin, entry in entries.items() if self._valid_entry(entry, now)}
+
+  def _valid_entry(self, entry, now: float) -> bool:
+    return (isinstance(entry, dict) and isinstance(entry.get('timestamp'), (int, float)) and
+            isinstance(entry.get('ecu_rx_addrs'), list) and isinstance(entry.get('car_fw'), list) and
+            now - entry['timestamp'] < self.max_age)
+
+  def load(self, vin: str) -> FwCacheEntry | None:
+    entry = self._read().get(vin)
+    if entry is None:
+      return None
+
+    try:
+      return FwCacheEntry(vin, {tuple(addr) for addr in entry['ecu_rx_addrs']},
+                          [car_fw_from_dict(f) for f in entry['car_fw']], entry['timestamp'])
+    except Exception:
+      carlog.exception("Invalid FW cache entry")
+      return None
+
+  def store(self, entry: FwCacheEntry) -> None:
+    entries = self._read()
+    entries[entry.vin] = {
+      'timestamp': entry.timestamp,
+      'ecu_rx_addrs': sorted(entry.ecu_rx_addrs, key=lambda addr: (addr[0], addr[1] or 0, addr[2])),
+      'car_fw': [car_fw_to_dict(f) for f in entry.car_fw],
+    }
+
+    directory = os.path.dirname(os.path.abspath(self.path))
+    tmp_path = None
+    try:
+      os.makedirs(directory, exist_ok=True)
+      with tempfile.NamedTemporaryFile('w', dir=directory, prefix='.fw_cache_', delete=False) as f:
+        tmp_path = f.name
+        json.dump({'version': FW_CACHE_VERSION, 'entries': entries}, f)
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_path, self.path)
+      tmp_path = None
+    except OSError:
+      carlog.exception("Failed to write FW cache")
+    finally:
+      # the temporary file is left behind if the write or the replace failed
+      if tmp_path is not None:
+        with contextlib.suppress(OSError):
+          os.unlink(tmp_path)
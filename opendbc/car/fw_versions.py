@@ -1,5 +1,7 @@
 from collections import defaultdict
 from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from functools import cache
 from typing import Protocol, TypeVar
 
 from tqdm import tqdm
@@ -10,9 +12,10 @@ from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams
 from opendbc.car.ecu_addrs import get_ecu_addrs
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions
+from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, EcuAddrSubAddr, FwQueryConfig, LiveFwVersions, \
+                                            OfflineFwVersions, Request
 from opendbc.car.interfaces import get_interface_attr
-from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery, get_data_concurrently
 
 Ecu = CarParams.Ecu
 FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
@@ -25,6 +28,7 @@ REQUESTS = [(brand, config, r) for brand, config in FW_QUERY_CONFIGS.items() for
 
 T = TypeVar('T')
 ObdCallback = Callable[[bool], None]
+FwQuery = tuple[str, FwQueryConfig, Request, list[AddrType]]  # brand, config, request, addresses to query
 
 
 def chunks(l: list[T], n: int = 128) -> Iterator[list[T]]:
@@ -51,29 +55,72 @@ class MatchFwToCar(Protocol):
     ...
 
 
+@dataclass(frozen=True)
+class BrandFwIndex:
+  """Lookup tables over the FW_VERSIONS of one brand, built once and shared by every match"""
+  candidates: frozenset[str]
+  # exact matching: the candidates with each ECU, those that need it present, and those with each version
+  ecu_candidates: dict[EcuAddrSubAddr, frozenset[str]]
+  essential_candidates: dict[EcuAddrSubAddr, frozenset[str]]
+  version_candidates: dict[EcuAddrSubAddr, dict[bytes, frozenset[str]]]
+  # fuzzy matching: the candidates with each version on an address, excluding ECUs shared between models
+  fuzzy_candidates: dict[tuple[int, int | None, bytes], tuple[str, ...]]
+
+  @staticmethod
+  def build(brand: str) -> 'BrandFwIndex':
+    config = FW_QUERY_CONFIGS[brand]
+    candidates = set()
+    ecu_candidates = defaultdict(set)
+    essential_candidates = defaultdict(set)
+    version_candidates: defaultdict[EcuAddrSubAddr, defaultdict[bytes, set[str]]] = defaultdict(lambda: defaultdict(set))
+    fuzzy_candidates = defaultdict(list)
+
+    for candidate, fw_by_addr in FW_VERSIONS.items():
+      if MODEL_TO_BRAND[candidate] != brand:
+        continue
+
+      candidates.add(candidate)
+      for ecu, fws in fw_by_addr.items():
+        ecu_type = ecu[0]
+
+        # Virtual debug ecu doesn't need to match the database
+        if ecu_type != Ecu.debug:
+          ecu_candidates[ecu].add(candidate)
+          # Some models can sometimes miss an ecu, or show on two different addresses
+          # FIXME: this logic can be improved to be more specific, should require one of the two addresses
+          if ecu_type in ESSENTIAL_ECUS and candidate not in config.non_essential_ecus.get(ecu_type, []):
+            essential_candidates[ecu].add(candidate)
+          for f in fws:
+            version_candidates[ecu][f].add(candidate)
+
+        # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+        # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+        # impossible to get 3 matching versions, even if two models with shared parts are released at the same
+        # time and only one is in our database.
+        if ecu_type not in FUZZY_EXCLUDE_ECUS:
+          for f in fws:
+            fuzzy_candidates[(ecu[1], ecu[2], f)].append(candidate)
+
+    return BrandFwIndex(
+      candidates=frozenset(candidates),
+      ecu_candidates={ecu: frozenset(c) for ecu, c in ecu_candidates.items()},
+      essential_candidates={ecu: frozenset(c) for ecu, c in essential_candidates.items()},
+      version_candidates={ecu: {f: frozenset(c) for f, c in fws.items()} for ecu, fws in version_candidates.items()},
+      fuzzy_candidates={key: tuple(c) for key, c in fuzzy_candidates.items()},
+    )
+
+
+@cache
+def get_brand_fw_index(brand: str) -> BrandFwIndex:
+  return BrandFwIndex.build(brand)
+
+
 def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = None, log: bool = True, exclude: str = None) -> set[str]:
   """Do a fuzzy FW match. This function will return a match, and the number of firmware version
   that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
   the match is rejected."""
 
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
-      continue
-
-    if candidate == exclude:
-      continue
-
-    for addr, fws in fw_by_addr.items():
-      # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-      # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-      # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-      # time and only one is in our database.
-      if addr[0] in FUZZY_EXCLUDE_ECUS:
-        continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+  indexes = [get_brand_fw_index(brand) for brand in VERSIONS if is_brand(brand, match_brand)]
 
   matched_ecus = set()
   match: str | None = None
@@ -81,7 +128,7 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = N
     ecu_key = (addr[0], addr[1])
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
+      candidates = [c for index in indexes for c in index.fuzzy_candidates.get((*ecu_key, version), ()) if c != exclude]
 
       if len(candidates) == 1:
         matched_ecus.add(ecu_key)
@@ -109,37 +156,28 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str = N
   if extra_fw_versions is None:
     extra_fw_versions = {}
 
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
-      ecu_type = ecu[0]
-      addr = ecu[1:]
+  matches = set()
+  for brand in VERSIONS:
+    if not is_brand(brand, match_brand):
+      continue
 
-      found_versions = live_fw_versions.get(addr, set())
+    # Eliminate the candidates with an ECU that is missing or doesn't match any of its versions
+    index = get_brand_fw_index(brand)
+    invalid: set[str] = set()
+    for ecu, ecu_candidates in index.ecu_candidates.items():
+      found_versions = live_fw_versions.get(ecu[1:], set())
       if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
+        invalid |= index.essential_candidates.get(ecu, frozenset())
         continue
 
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
-        break
+      valid = set().union(*(index.version_candidates[ecu].get(v, ()) for v in found_versions))
+      if extra_fw_versions:
+        valid |= {c for c in ecu_candidates if not found_versions.isdisjoint(extra_fw_versions.get(c, {}).get(ecu, []))}
+      invalid |= ecu_candidates - valid
 
-  return set(candidates.keys()) - invalid
+    matches |= index.candidates - invalid
+
+  return matches
 
 
 def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: bool = True,
@@ -169,7 +207,9 @@ def match_fw_to_car(fw_versions: list[CarParams.CarFw], vin: str, allow_exact: b
   return True, set()
 
 
-def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, num_pandas: int = 1) -> set[EcuAddrBusType]:
+def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, num_pandas: int = 1,
+                     concurrent: bool = False) -> set[EcuAddrBusType]:
+  """With concurrent, ECUs with a subaddress on different buses are queried at the same time instead of one after another"""
   # queries are split by OBD multiplexing mode
   queries: dict[bool, list[list[EcuAddrBusType]]] = {True: [], False: []}
   parallel_queries: dict[bool, list[EcuAddrBusType]] = {True: [], False: []}
@@ -196,6 +236,17 @@ def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_o
         response_addr = uds.get_rx_addr_for_tx_addr(addr, r.rx_offset)
         responses.add((response_addr, sub_addr, r.bus))
 
+  if concurrent:
+    for obd_multiplexing, subaddr_queries in queries.items():
+      batches: list[list[EcuAddrBusType]] = []
+      for [a] in subaddr_queries:
+        batch = next((b for b in batches if all(q[2] != a[2] for q in b)), None)
+        if batch is None:
+          batches.append([a])
+        else:
+          batch.append(a)
+      queries[obd_multiplexing] = batches
+
   for obd_multiplexing in queries:
     queries[obd_multiplexing].insert(0, parallel_queries[obd_multiplexing])
 
@@ -228,7 +279,8 @@ def get_brand_ecu_matches(ecu_rx_addrs: set[EcuAddrBusType]) -> dict[str, list[b
 
 
 def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, vin: str,
-                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, num_pandas: int = 1, progress: bool = False) -> list[CarParams.CarFw]:
+                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, num_pandas: int = 1, progress: bool = False,
+                            concurrent: bool = False) -> list[CarParams.CarFw]:
   """Queries for FW versions ordering brands by likelihood, breaks when exact match is found"""
 
   all_car_fw = []
@@ -241,7 +293,8 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
     if True not in brand_matches[brand]:
       continue
 
-    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, num_pandas=num_pandas, progress=progress)
+    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, num_pandas=num_pandas, progress=progress,
+                             concurrent=concurrent)
     all_car_fw.extend(car_fw)
 
     # If there is a match using this brand's FW alone, finish querying early
@@ -252,8 +305,28 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
   return all_car_fw
 
 
+def concurrent_batches(jobs: list[FwQuery]) -> list[list[FwQuery]]:
+  """
+  Groups consecutive queries on different buses, which can run at the same time. OBD multiplexing is set for
+  all pandas at once, so the queries in a group that depend on it need the same mode.
+  """
+  batches: list[list[FwQuery]] = []
+  for job in jobs:
+    r = job[2]
+    batch = batches[-1] if len(batches) else []
+    conflict = any(b[2].bus == r.bus or (r.bus % 4 == 1 and b[2].bus % 4 == 1 and b[2].obd_multiplexing != r.obd_multiplexing)
+                   for b in batch)
+    if len(batch) and not conflict:
+      batch.append(job)
+    else:
+      batches.append([job])
+  return batches
+
+
 def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str = None,
-                    extra: OfflineFwVersions = None, timeout: float = 0.1, num_pandas: int = 1, progress: bool = False) -> list[CarParams.CarFw]:
+                    extra: OfflineFwVersions = None, timeout: float = 0.1, num_pandas: int = 1, progress: bool = False,
+                    concurrent: bool = False) -> list[CarParams.CarFw]:
+  """With concurrent, queries on different buses are sent at the same time instead of one after another"""
   versions = VERSIONS.copy()
 
   if query_brand is not None:
@@ -289,39 +362,55 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
   requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
   for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
     for addr_chunk in chunks(addr_group):
+      jobs: list[FwQuery] = []
       for brand, config, r in requests:
         # Skip query if no panda available
         if r.bus > num_pandas * 4 - 1:
           continue
 
-        # Toggle OBD multiplexing for each request
-        if r.bus % 4 == 1:
-          set_obd_multiplexing(r.obd_multiplexing)
+        query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
+                       (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
+        jobs.append((brand, config, r, query_addrs))
+
+      for batch in (concurrent_batches([job for job in jobs if job[3]]) if concurrent else [[job] for job in jobs]):
+        # Toggle OBD multiplexing for each request, the requests in a batch that depend on it share the mode
+        obd_requests = [r for _, _, r, _ in batch if r.bus % 4 == 1]
+        if obd_requests:
+          set_obd_multiplexing(obd_requests[0].obd_multiplexing)
+
+        batch = [job for job in batch if job[3]]
+        if not batch:
+          continue
 
         try:
-          query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
-                         (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
-
-          if query_addrs:
-            query = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
-              f = CarParams.CarFw()
-
-              f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
-              f.fwVersion = version
-              f.address = tx_addr
-              f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
-              f.request = r.request
-              f.brand = brand
-              f.bus = r.bus
-              f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
-              f.obdMultiplexing = r.obd_multiplexing
-
-              if sub_addr is not None:
-                f.subAddress = sub_addr
-
-              car_fw.append(f)
+          queries = [IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset)
+                     for _, _, r, query_addrs in batch]
+          results = [queries[0].get_data(timeout)] if len(queries) == 1 else get_data_concurrently(can_recv, queries, timeout)
         except Exception:
           carlog.exception("FW query exception")
+          continue
+
+        for (brand, config, r, _), result in zip(batch, results, strict=True):
+          if isinstance(result, BaseException):
+            carlog.error("FW query exception", exc_info=result)
+            continue
+
+          for (tx_addr, sub_addr), version in result.items():
+            f = CarParams.CarFw()
+
+            f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
+            f.fwVersion = version
+            f.address = tx_addr
+            f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
+            f.request = r.request
+            f.brand = brand
+            f.bus = r.bus
+            f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
+            f.obdMultiplexing = r.obd_multiplexing
+
+            if sub_addr is not None:
+              f.subAddress = sub_addr
+
+            car_fw.append(f)
 
   return car_fw
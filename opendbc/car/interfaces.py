@@ -16,7 +16,7 @@ from opendbc.car.common.basedir import BASEDIR
 from opendbc.car.common.conversions import Conversions as CV
 from opendbc.car.common.simple_kalman import KF1D, get_kalman_gain
 from opendbc.car.values import PLATFORMS
-from opendbc.can.parser import CANParser
+from opendbc.can.parser import CANParser, CANParserGroup
 
 GearShifter = structs.CarState.GearShifter
 ButtonType = structs.CarState.ButtonEvent.Type
@@ -117,6 +117,7 @@ class CarInterfaceBase(ABC):
 
     self.CS: CarStateBase = self.CarState(CP)
     self.can_parsers: dict[StrEnum, CANParser] = self.CS.get_can_parsers(CP)
+    self.can_parser_group = CANParserGroup(self.can_parsers.values())
 
     dbc_names = {bus: cp.dbc_name for bus, cp in self.can_parsers.items()}
     self.CC: CarControllerBase = self.CarController(dbc_names, CP)
@@ -240,16 +241,14 @@ class CarInterfaceBase(ABC):
     tune.torque.steeringAngleDeadzoneDeg = steering_angle_deadzone_deg
 
   def update(self, can_packets: list[tuple[int, list[CanData]]]) -> structs.CarState:
-    # parse can
-    for cp in self.can_parsers.values():
-      if cp is not None:
-        cp.update_strings(can_packets)
+    # parse can, each frame is converted once for all parsers
+    self.can_parser_group.update_strings(can_packets)
 
     # get CarState
     ret = self.CS.update(self.can_parsers)
 
-    ret.canValid = all(cp.can_valid for cp in self.can_parsers.values())
-    ret.canTimeout = any(cp.bus_timeout for cp in self.can_parsers.values())
+    ret.canValid = self.can_parser_group.can_valid
+    ret.canTimeout = self.can_parser_group.bus_timeout
 
     if ret.vEgoCluster == 0.0 and not self.v_ego_cluster_seen:
       ret.vEgoCluster = ret.vEgo
@@ -1,5 +1,8 @@
+import asyncio
+import heapq
 import time
 from collections import defaultdict
+from collections.abc import Generator, Iterable
 from functools import partial
 
 from opendbc.car import uds
@@ -8,6 +11,58 @@ from opendbc.car.carlog import carlog
 from opendbc.car.fw_query_definitions import AddrType
 
 
+class CanReader:
+  """
+  Reads can_recv in a single asyncio task and hands the frames to the queries listening on their bus and
+  address, so that queries on different buses can run at the same time.
+  """
+  def __init__(self, can_recv: CanRecvCallable, poll_interval: float = 0.001) -> None:
+    self.can_recv = can_recv
+    self.poll_interval = poll_interval
+    self.listeners: dict[tuple[int, int], asyncio.Queue[CanData]] = {}
+
+  def listen(self, bus: int, addrs: Iterable[int]) -> asyncio.Queue[CanData]:
+    keys = [(bus, addr) for addr in addrs]
+    for key in keys:
+      if key in self.listeners:
+        raise ValueError(f"Already listening on bus {bus}: {hex(key[1])}")
+
+    queue: asyncio.Queue[CanData] = asyncio.Queue()
+    for key in keys:
+      self.listeners[key] = queue
+    return queue
+
+  def remove(self, bus: int, addrs: Iterable[int]) -> None:
+    for addr in addrs:
+      self.listeners.pop((bus, addr), None)
+
+  async def run(self) -> None:
+    while True:
+      can_packets = self.can_recv()
+      for packet in can_packets:
+        for msg in packet:
+          queue = self.listeners.get((msg.src, msg.address))
+          if queue is not None:
+            queue.put_nowait(msg)
+      await asyncio.sleep(0 if len(can_packets) else self.poll_interval)
+
+
+def get_data_concurrently(can_recv: CanRecvCallable, queries: list['IsoTpParallelQuery'],
+                          timeout: float) -> list[dict[AddrType, bytes] | BaseException]:
+  """Runs queries on different buses at the same time, returns the results or exception of each query"""
+  async def run():
+    # drop frames from before the requests, like get_data does
+    can_recv()
+    reader = CanReader(can_recv)
+    reader_task = asyncio.create_task(reader.run())
+    try:
+      return await asyncio.gather(*(query.get_data_async(reader, timeout) for query in queries), return_exceptions=True)
+    finally:
+      reader_task.cancel()
+
+  return asyncio.run(run())
+
+
 class IsoTpParallelQuery:
   def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, addrs: list[int] | list[AddrType],
                request: list[bytes], response: list[bytes], response_offset: int = 0x8,
@@ -27,14 +82,22 @@ class IsoTpParallelQuery:
     self.msg_addrs = {tx_addr: uds.get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in real_addrs}
     self.msg_buffer: dict[int, list[CanData]] = defaultdict(list)
 
-  def rx(self) -> None:
-    """Drain can socket and sort messages into buffers based on address"""
+    # reverse index, several tx addresses can share an rx address with different sub-addresses
+    self.rx_addrs: dict[int, list[AddrType]] = defaultdict(list)
+    for tx_addr, rx_addr in self.msg_addrs.items():
+      self.rx_addrs[rx_addr].append(tx_addr)
+
+  def rx(self) -> set[int]:
+    """Drain can socket and sort messages into buffers based on address, returns the addresses that received any"""
     can_packets = self.can_recv(wait_for_one=True)
 
+    updated = set()
     for packet in can_packets:
       for msg in packet:
-        if msg.src == self.bus and msg.address in self.msg_addrs.values():
+        if msg.src == self.bus and msg.address in self.rx_addrs:
           self.msg_buffer[msg.address].append(CanData(msg.address, msg.dat, msg.src))
+          updated.add(msg.address)
+    return updated
 
   def _can_tx(self, tx_addr: int, dat: bytes, bus: int):
     """Helper function to send single message"""
@@ -75,15 +138,47 @@ class IsoTpParallelQuery:
 
   def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
     self._drain_rx()
+    query = self._query(timeout, total_timeout)
+    try:
+      next(query)
+      while True:
+        query.send(self.rx())
+    except StopIteration as e:
+      return e.value
+
+  async def get_data_async(self, reader: CanReader, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
+    """Same as get_data, with the frames from a CanReader so that it can run along with queries on other buses"""
+    queue = reader.listen(self.bus, self.rx_addrs)
+    self.msg_buffer = defaultdict(list)
+    while not queue.empty():
+      queue.get_nowait()
+
+    query = self._query(timeout, total_timeout)
+    try:
+      next(query)
+      while True:
+        # frames are only taken with get_nowait, a get() canceled by a timeout can drop its frame
+        if queue.empty():
+          await asyncio.sleep(reader.poll_interval)
+        updated = set()
+        while not queue.empty():
+          msg = queue.get_nowait()
+          self.msg_buffer[msg.address].append(msg)
+          updated.add(msg.address)
+        query.send(updated)
+    except StopIteration as e:
+      return e.value
+    finally:
+      reader.remove(self.bus, self.rx_addrs)
 
+  def _query(self, timeout: float, total_timeout: float) -> Generator[None, set[int], dict[AddrType, bytes]]:
+    """Sends the requests and processes the responses, is sent the rx addresses with new frames in msg_buffer"""
     # Create message objects
     msgs = {}
     request_counter = {}
-    request_done = {}
     for tx_addr, rx_addr in self.msg_addrs.items():
       msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
       request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
 
     # Send first request to functional addrs, subsequent responses are handled on physical addrs
     if len(self.functional_addrs):
@@ -99,29 +194,46 @@ class IsoTpParallelQuery:
     start_time = time.monotonic()
     addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
     response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
-    while True:
-      self.rx()
+    # lazy deadline heap, entries that don't match response_timeouts anymore are skipped
+    deadlines = [(deadline, i, tx_addr) for i, (tx_addr, deadline) in enumerate(response_timeouts.items())]
+    heapq.heapify(deadlines)
+    order = {tx_addr: i for i, tx_addr in enumerate(msgs)}
+    pending = set(msgs)
+    backlog: set[AddrType] = set()  # messages with received frames that are left to process
+
+    def set_timeout(tx_addr: AddrType, deadline: float) -> None:
+      response_timeouts[tx_addr] = deadline
+      heapq.heappush(deadlines, (deadline, order[tx_addr], tx_addr))
 
-      for tx_addr, msg in msgs.items():
+    while True:
+      # only poll the messages that received frames, in query order
+      updated = yield
+      ready = backlog.union(*(self.rx_addrs[rx_addr] for rx_addr in updated))
+      backlog = set()
+      for tx_addr in sorted(ready, key=order.__getitem__):
+        msg = msgs[tx_addr]
         try:
           dat, rx_in_progress = msg.recv()
         except Exception:
           carlog.exception(f"Error processing UDS response: {tx_addr}")
-          request_done[tx_addr] = True
+          pending.discard(tx_addr)
           continue
 
         # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
         if rx_in_progress:
           addrs_responded.add(tx_addr)
-          response_timeouts[tx_addr] = time.monotonic() + timeout
+          set_timeout(tx_addr, time.monotonic() + timeout)
 
         if dat is None:
           continue
 
+        # a completed response can leave frames in the client buffer, poll again on the next loop
+        backlog.add(tx_addr)
+
         # Log unexpected empty responses
         if len(dat) == 0:
           carlog.error(f"iso-tp query empty response: {tx_addr}")
-          request_done[tx_addr] = True
+          pending.discard(tx_addr)
           continue
 
         counter = request_counter[tx_addr]
@@ -130,37 +242,39 @@ class IsoTpParallelQuery:
 
         if response_valid:
           if counter + 1 < len(self.request):
-            response_timeouts[tx_addr] = time.monotonic() + timeout
+            set_timeout(tx_addr, time.monotonic() + timeout)
             msg.send(self.request[counter + 1])
             request_counter[tx_addr] += 1
           else:
             results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
+            pending.discard(tx_addr)
         else:
           error_code = dat[2] if len(dat) > 2 else -1
           if error_code == 0x78:
-            response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
+            set_timeout(tx_addr, time.monotonic() + self.response_pending_timeout)
             carlog.error(f"iso-tp query response pending: {tx_addr}")
           else:
-            request_done[tx_addr] = True
+            pending.discard(tx_addr)
             carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
 
       # Mark request done if address timed out
       cur_time = time.monotonic()
-      for tx_addr in response_timeouts:
-        if cur_time - response_timeouts[tx_addr] > 0:
-          if not request_done[tx_addr]:
-            if request_counter[tx_addr] > 0:
-              carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
-            elif tx_addr in addrs_responded:
-              carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
-            # TODO: handle functional addresses
-            # else:
-            #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
-          request_done[tx_addr] = True
+      while deadlines and cur_time - deadlines[0][0] > 0:
+        deadline, _, tx_addr = heapq.heappop(deadlines)
+        if deadline != response_timeouts[tx_addr]:
+          continue
+        if tx_addr in pending:
+          if request_counter[tx_addr] > 0:
+            carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
+          elif tx_addr in addrs_responded:
+            carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
+          # TODO: handle functional addresses
+          # else:
+          #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
+        pending.discard(tx_addr)
 
       # Break if all requests are done (finished or timed out)
-      if all(request_done.values()):
+      if not pending:
         break
 
       if cur_time - start_time > total_timeout:
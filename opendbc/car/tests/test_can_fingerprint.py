@@ -1,7 +1,8 @@
 import pytest
 from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from opendbc.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from opendbc.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS as FINGERPRINTS, all_legacy_fingerprint_cars, \
+                                    eliminate_incompatible_cars, is_valid_for_fingerprint
 
 
 class TestCanFingerprint:
@@ -21,6 +22,20 @@ class TestCanFingerprint:
       assert finger[1] == fingerprint
       assert finger[2] == {}
 
+  def test_eliminate_incompatible_cars(self):
+    # every address and length in any fingerprint, plus wrong lengths, the debug address and extended addresses
+    keys = {(address, length + offset) for fingerprints in FINGERPRINTS.values() for fingerprint in fingerprints
+            for address, length in fingerprint.items() for offset in (-1, 0, 1)}
+    keys |= {(address, length) for address in (*_DEBUG_ADDRESS, 0x800, 0x18DAF1E8) for length in (0, 8, 64)}
+
+    all_cars = all_legacy_fingerprint_cars()
+    for address, length in sorted(keys):
+      msg = CanData(address=address, dat=b'\x00' * max(length, 0), src=0)
+      expected = [car for car in all_cars if any(is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS)
+                                                 for fingerprint in FINGERPRINTS[car])]
+      assert eliminate_incompatible_cars(msg, all_cars) == expected
+      assert eliminate_incompatible_cars(msg, all_cars[::-1]) == expected[::-1]
+
   def test_timing(self, subtests):
     # just pick any CAN fingerprinting car
     car_model = "CHEVROLET_BOLT_EUV"
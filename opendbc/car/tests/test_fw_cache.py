@@ -0,0 +1,157 @@
+import json
+import os
+import pytest
+import time
+
+from opendbc.car.car_helpers import fingerprint
+from opendbc.car.fw_cache import FW_CACHE_VERSION, FileFwCache, FwCacheEntry
+from opendbc.car.structs import CarParams
+from opendbc.car.toyota.fingerprints import FW_VERSIONS as TOYOTA_FW_VERSIONS
+from opendbc.car.toyota.values import CAR as TOYOTA
+
+CarFw = CarParams.CarFw
+Ecu = CarParams.Ecu
+
+VIN = '1HGCM82633A004352'
+ECU_RX_ADDRS = {(0x7e8, None, 0), (0x7b3, 0x0f, 1)}
+
+
+def car_fw() -> list[CarParams.CarFw]:
+  return [
+    CarFw(ecu=Ecu.engine, fwVersion=b'\x01\x02abc', address=0x7e0, responseAddress=0x7e8, request=[b'\x22\xf1\x88'],
+          brand='toyota', bus=0, obdMultiplexing=True),
+    CarFw(ecu=Ecu.eps, fwVersion=b'xyz', address=0x7a3, subAddress=0x0f, responseAddress=0x7b3, request=[b'\x10\x03', b'\x22\xf1\x81'],
+          brand='toyota', bus=1, logging=True),
+  ]
+
+
+def fw_dicts(fws):
+  return [f.to_dict() for f in fws]
+
+
+class TestFileFwCache:
+  def test_roundtrip(self, tmp_path):
+    cache = FileFwCache(str(tmp_path / 'cache' / 'fw.json'))
+    assert cache.load(VIN) is None
+
+    cache.store(FwCacheEntry(VIN, ECU_RX_ADDRS, car_fw(), 1000.))
+    assert cache.load(VIN) is None  # expired
+    cache.store(FwCacheEntry(VIN, ECU_RX_ADDRS, car_fw(), time.time() - 10.))
+    cache.store(FwCacheEntry('5YJ3E1EA7KF000000', set(), car_fw()[:1]))
+
+    entry = cache.load(VIN)
+    assert entry.vin == VIN
+    assert entry.ecu_rx_addrs == ECU_RX_ADDRS
+    assert time.time() - entry.timestamp < 60.
+    assert fw_dicts(entry.car_fw) == fw_dicts(car_fw())
+    assert len(cache.load('5YJ3E1EA7KF000000').car_fw) == 1
+
+    # no temporary files are left behind
+    assert os.listdir(tmp_path / 'cache') == ['fw.json']
+
+  def test_invalid_files(self, tmp_path):
+    path = tmp_path / 'fw.json'
+    cache = FileFwCache(str(path))
+    cache.store(FwCacheEntry(VIN, ECU_RX_ADDRS, car_fw()))
+
+    data = json.loads(path.read_text())
+    data['version'] = FW_CACHE_VERSION + 1
+    path.write_text(json.dumps(data))
+    assert cache.load(VIN) is None
+
+    path.write_text('{"version": 1, "entr')
+    assert cache.load(VIN) is None
+
+    # a partial file is replaced on the next store
+    cache.store(FwCacheEntry(VIN, ECU_RX_ADDRS, car_fw()))
+    assert cache.load(VIN) is not None
+
+  @pytest.mark.parametrize("data", [
+    {'version': FW_CACHE_VERSION},
+    {'version': FW_CACHE_VERSION, 'entries': []},
+    {'version': FW_CACHE_VERSION, 'entries': {VIN: []}},
+    {'version': FW_CACHE_VERSION, 'entries': {VIN: {'timestamp': 0}}},
+    {'version': FW_CACHE_VERSION, 'entries': {VIN: {'timestamp': 'now', 'ecu_rx_addrs': [], 'car_fw': []}}},
+    {'version': FW_CACHE_VERSION, 'entries': {VIN: {'timestamp': time.time(), 'ecu_rx_addrs': [[1]], 'car_fw': [{}]}}},
+    [],
+  ])
+  def test_invalid_structure(self, tmp_path, data):
+    path = tmp_path / 'fw.json'
+    path.write_text(json.dumps(data))
+    cache = FileFwCache(str(path))
+    assert cache.load(VIN) is None
+
+    cache.store(FwCacheEntry(VIN, ECU_RX_ADDRS, car_fw()))
+    assert cache.load(VIN) is not None
+
+  @pytest.mark.parametrize("fail", ["os.fsync", "os.replace"])
+  def test_failed_write(self, tmp_path, mocker, fail):
+    cache = FileFwCache(str(tmp_path / 'fw.json'))
+    cache.store(FwCacheEntry(VIN, ECU_RX_ADDRS, car_fw()))
+
+    mocker.patch(f"opendbc.car.fw_cache.{fail}", side_effect=OSError)
+    cache.store(FwCacheEntry('5YJ3E1EA7KF000000', ECU_RX_ADDRS, car_fw()))
+
+    # the previous cache is kept and the temporary file is removed
+    assert os.listdir(tmp_path) == ['fw.json']
+    assert cache.load(VIN) is not None
+    assert cache.load('5YJ3E1EA7KF000000') is None
+
+  def test_expiry(self, tmp_path):
+    cache = FileFwCache(str(tmp_path / 'fw.json'), max_age=100.)
+    cache.store(FwCacheEntry(VIN, ECU_RX_ADDRS, car_fw(), time.time() - 200.))
+    cache.store(FwCacheEntry('5YJ3E1EA7KF000000', ECU_RX_ADDRS, car_fw()))
+    assert cache.load(VIN) is None
+
+    # expired entries are removed on write
+    data = json.loads((tmp_path / 'fw.json').read_text())
+    assert list(data['entries']) == ['5YJ3E1EA7KF000000']
+
+
+def avalon_fw() -> list[CarParams.CarFw]:
+  return [CarFw(ecu=ecu, fwVersion=fws[0], address=addr, subAddress=sub_addr or 0, responseAddress=addr + 8, request=[b'\x22\xf1\x81'],
+                brand='toyota') for (ecu, addr, sub_addr), fws in TOYOTA_FW_VERSIONS[TOYOTA.TOYOTA_AVALON].items()]
+
+
+class TestFingerprintFwCache:
+  def _fingerprint(self, mocker, tmp_path, fws, ecu_rx_addrs):
+    mocker.patch("opendbc.car.car_helpers.get_vin", return_value=(0x7e8, 0, VIN))
+    mocker.patch("opendbc.car.car_helpers.get_present_ecus", side_effect=lambda *args, **kwargs: set(ecu_rx_addrs))
+    get_fw_versions = mocker.patch("opendbc.car.car_helpers.get_fw_versions_ordered", side_effect=lambda *args, **kwargs: fws)
+
+    cache = FileFwCache(str(tmp_path / 'fw.json'))
+
+    def run():
+      car_fingerprint, _, vin, car_fw, _, _ = fingerprint(lambda wait_for_one=False: [[]], lambda msgs: None, lambda obd: None, 1, None, cache)
+      assert vin == VIN
+      assert fw_dicts(car_fw) == fw_dicts(fws)
+      return car_fingerprint
+
+    return run, get_fw_versions
+
+  def test_fingerprint(self, tmp_path, mocker):
+    ecu_rx_addrs = set(ECU_RX_ADDRS)
+    run, get_fw_versions = self._fingerprint(mocker, tmp_path, avalon_fw(), ecu_rx_addrs)
+
+    assert run() == TOYOTA.TOYOTA_AVALON
+    assert get_fw_versions.call_count == 1
+
+    # same VIN and ECUs, FW versions come from the cache
+    assert run() == TOYOTA.TOYOTA_AVALON
+    assert get_fw_versions.call_count == 1
+
+    # different ECUs respond, query again
+    ecu_rx_addrs.add((0x7e9, None, 0))
+    run()
+    assert get_fw_versions.call_count == 2
+    run()
+    assert get_fw_versions.call_count == 2
+
+  # a partial query that only matches fuzzily is queried again as well
+  @pytest.mark.parametrize("fws, car_fingerprint", [(car_fw(), None), (avalon_fw()[:-1], TOYOTA.TOYOTA_AVALON)], ids=["no_match", "fuzzy"])
+  def test_not_cached(self, tmp_path, mocker, fws, car_fingerprint):
+    run, get_fw_versions = self._fingerprint(mocker, tmp_path, fws, ECU_RX_ADDRS)
+    for i in range(2):
+      assert run() == car_fingerprint
+      assert get_fw_versions.call_count == i + 1
+    assert FileFwCache(str(tmp_path / 'fw.json')).load(VIN) is None
@@ -0,0 +1,154 @@
+import asyncio
+import pytest
+import time
+
+from opendbc.car import uds
+from opendbc.car.can_definitions import CanData
+from opendbc.car.isotp_parallel_query import CanReader, IsoTpParallelQuery, get_data_concurrently
+
+REQUEST = bytes([uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER]) + b'\xf1\x90'
+RESPONSE = bytes([uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER + 0x40]) + b'\xf1\x90'
+
+
+class FakeEcus:
+  """Answers ISO-TP requests sent on one bus, with single or multi frame responses"""
+  def __init__(self, responses: dict[tuple[int, int | None], list[bytes]], frames_per_recv: int = 64, bus: int = 0):
+    self.responses = responses  # (tx addr, sub addr): UDS responses, sent one after another
+    self.frames_per_recv = frames_per_recv
+    self.bus = bus
+    self.rx_queue: list[CanData] = []
+    self.pending_consecutive: dict[tuple[int, int | None], list[bytes]] = {}
+
+  def _send_frame(self, tx_addr: int, sub_addr: int | None, dat: bytes):
+    prefix = b'' if sub_addr is None else bytes([sub_addr])
+    self.rx_queue.append(CanData(uds.get_rx_addr_for_tx_addr(tx_addr), prefix + dat, self.bus))
+
+  def can_send(self, msgs: list[CanData]):
+    for address, dat, bus in msgs:
+      key = (address, None) if (address, None) in self.responses else (address, dat[0])
+      if bus != self.bus or key not in self.responses:
+        continue
+      if key[1] is not None:
+        dat = dat[1:]
+
+      if dat[0] >> 4 == 0x3:  # flow control, send the rest
+        for frame in self.pending_consecutive.pop(key, []):
+          self._send_frame(*key, frame)
+      elif dat[0] >> 4 == 0x0 and len(self.responses[key]):
+        response = self.responses[key].pop(0)
+        # response pending is followed by the actual response
+        while response[2:3] == b'\x78' and len(self.responses[key]):
+          self._send_response(key, response)
+          response = self.responses[key].pop(0)
+        self._send_response(key, response)
+
+  def _send_response(self, key: tuple[int, int | None], response: bytes):
+    if len(response) <= 7 - (key[1] is not None):
+      self._send_frame(*key, bytes([len(response)]) + response)
+    else:
+      self._send_frame(*key, bytes([0x10 | len(response) >> 8, len(response) & 0xFF]) + response[:6])
+      rest = response[6:]
+      self.pending_consecutive[key] = [bytes([0x20 | (i + 1) & 0xF]) + rest[i * 7:(i + 1) * 7] for i in range((len(rest) + 6) // 7)]
+
+  def can_recv(self, wait_for_one: bool = False) -> list[list[CanData]]:
+    packet, self.rx_queue = self.rx_queue[:self.frames_per_recv], self.rx_queue[self.frames_per_recv:]
+    return [packet] if packet else []
+
+
+class TestIsoTpParallelQuery:
+  def test_responses(self):
+    vin = b'1HGCM82633A004352'
+    ecus = FakeEcus({
+      (0x7e0, None): [RESPONSE + vin],  # multi frame
+      (0x7e1, None): [RESPONSE + b'\x01'],
+      (0x7e2, None): [bytes([0x7f, uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER, 0x78]), RESPONSE + b'\x02'],  # response pending
+      (0x7e3, None): [bytes([0x7f, uds.SERVICE_TYPE.READ_DATA_BY_IDENTIFIER, 0x31])],  # negative response
+      (0x750, 0x6d): [RESPONSE + b'\x03'],  # sub-addresses on the same rx address
+      (0x750, 0x0f): [RESPONSE + b'\x04'],
+    })
+    addrs = [0x7e0, 0x7e1, 0x7e2, 0x7e3, 0x7e4, (0x750, 0x6d), (0x750, 0x0f)]
+    query = IsoTpParallelQuery(ecus.can_send, ecus.can_recv, 0, addrs, [REQUEST], [RESPONSE])
+
+    t = time.monotonic()
+    results = query.get_data(0.1)
+    assert time.monotonic() - t < 1.0  # silent 0x7e4 times out
+    assert results == {
+      (0x7e0, None): vin,
+      (0x7e1, None): b'\x01',
+      (0x7e2, None): b'\x02',
+      (0x750, 0x6d): b'\x03',
+      (0x750, 0x0f): b'\x04',
+    }
+
+  def test_multiple_requests(self):
+    ecus = FakeEcus({(0x7e0, None): [RESPONSE + b'\x01', RESPONSE + b'\x02']})
+    query = IsoTpParallelQuery(ecus.can_send, ecus.can_recv, 0, [0x7e0], [REQUEST, REQUEST], [RESPONSE, RESPONSE])
+    assert query.get_data(0.1) == {(0x7e0, None): b'\x02'}
+
+  def test_response_storm(self, mocker):
+    # VIN query on all addresses, every ECU answers at once with a multi frame response
+    responders = [a for a in range(0x700, 0x800) if a != 0x7DF] + list(range(0x18DA00F1, 0x18DB00F1, 0x100))
+    ecus = FakeEcus({(addr, None): [RESPONSE + addr.to_bytes(4, 'big') * 4] for addr in responders})
+    query = IsoTpParallelQuery(ecus.can_send, ecus.can_recv, 0, responders, [REQUEST], [RESPONSE])
+
+    recv = mocker.spy(uds.IsoTpMessage, 'recv')
+    t = time.perf_counter()
+    results = query.get_data(1.0)
+    et = time.perf_counter() - t
+    print(f'{len(responders)} responses in {et * 1000:.1f} ms, {recv.call_count} ISO-TP polls')
+
+    assert results == {(addr, None): addr.to_bytes(4, 'big') * 4 for addr in responders}
+    # only messages that received frames are polled, each response is a first frame and two consecutive frames
+    assert recv.call_count <= len(responders) * 4
+
+  def test_concurrent_buses(self):
+    buses = [FakeEcus({(0x7e0, None): [RESPONSE + bytes([bus])]}, bus=bus) for bus in range(2)]
+
+    def can_send(msgs):
+      for ecus in buses:
+        ecus.can_send(msgs)
+
+    def can_recv(wait_for_one: bool = False):
+      return [packet for ecus in buses for packet in ecus.can_recv()]
+
+    # the silent 0x7e1 times out on both buses at the same time
+    queries = [IsoTpParallelQuery(can_send, can_recv, bus, [0x7e0, 0x7e1], [REQUEST], [RESPONSE]) for bus in range(2)]
+    t = time.monotonic()
+    results = get_data_concurrently(can_recv, queries, 0.3)
+    assert time.monotonic() - t < 0.5
+    assert results == [{(0x7e0, None): bytes([bus])} for bus in range(2)]
+
+  def test_concurrent_slow_frames(self):
+    # frames trickle in one at a time, with many empty reads in between that time out the reads of the queries
+    vin = b'1HGCM82633A004352'
+    buses = [FakeEcus({(0x7e0, None): [RESPONSE + vin], (0x7e1, None): [RESPONSE + bytes([bus])]}, frames_per_recv=1, bus=bus)
+             for bus in range(2)]
+    # a response left over from a previous query is dropped
+    buses[0]._send_frame(0x7e1, None, bytes([4]) + RESPONSE + b'\xff')
+
+    def can_send(msgs):
+      for ecus in buses:
+        ecus.can_send(msgs)
+
+    reads = 0
+
+    def can_recv(wait_for_one: bool = False):
+      nonlocal reads
+      reads += 1
+      return [packet for ecus in buses for packet in ecus.can_recv()] if reads % 5 == 1 else []
+
+    queries = [IsoTpParallelQuery(can_send, can_recv, bus, [0x7e0, 0x7e1], [REQUEST], [RESPONSE]) for bus in range(2)]
+    results = get_data_concurrently(can_recv, queries, 0.3)
+    assert results == [{(0x7e0, None): vin, (0x7e1, None): bytes([bus])} for bus in range(2)]
+
+  def test_reader_listeners(self):
+    async def listen():
+      reader = CanReader(lambda wait_for_one=False: [])
+      reader.listen(0, [0x7e8])
+      reader.listen(1, [0x7e8])
+      with pytest.raises(ValueError):
+        reader.listen(0, [0x7e9, 0x7e8])
+      reader.remove(0, [0x7e8])
+      reader.listen(0, [0x7e8])
+
+    asyncio.run(listen())